@@ -3,6 +3,13 @@ import os
 import argparse
 import re
 import sys
+import functools
+import multiprocessing
+import time
+import numpy as np
+
+import pipelineMetrics
+import pipelineIO
 
 # -----------------------------------------------------------------------------
 # 全局常量与预编译正则
@@ -13,13 +20,21 @@ import sys
 # 例如：对于 "Lso01g12345"，匹配 "Lso01g"，捕获组1为 "01"
 GENE_ID_PATTERN = re.compile(r'^[a-zA-Z]+(\d+)g')
 
+# 默认的基因行前缀 (block header 为 "the 1th path..." 或 "++++...")
+DEFAULT_LINE_PREFIX = 'L'
+
+# 批量模式每次读取的字符数
+BULK_CHUNK_SIZE = 16 * 1024 * 1024
+
 # -----------------------------------------------------------------------------
 # 辅助函数
 # -----------------------------------------------------------------------------
 
+@functools.lru_cache(maxsize=1 << 20)
 def parse_chromosome(gene_id):
     """
     使用正则解析基因ID中的染色体编号。
+    同一基因会在多个 block 中反复出现，解析结果按基因ID缓存。
     :param gene_id: 基因ID字符串 (如 Lso01g0001)
     :return: 整数类型的染色体号 (如 1)。若解析失败返回 0。
     """
@@ -28,12 +43,163 @@ def parse_chromosome(gene_id):
         return int(match.group(1)) # 自动处理前导0，例如 int('01') -> 1
     return 0
 
+def chrom_number(seqid):
+    """
+    从序列名 (如 "Chr01"、"Lso11"、"scaffold_3") 中取最后一段数字作为染色体编号，没有数字时返回 0。
+    """
+    digits = re.findall(r'\d+', seqid)
+    return int(digits[-1]) if digits else 0
+
+def load_id_table(table_file):
+    """
+    从 GFF/GFF3 或 BED 文件读取 基因ID -> 染色体编号 的映射。
+    - GFF: 第1列为序列名，第9列属性中的 ID= 与 Name= 均会登记
+    - BED: 第1列为序列名，第4列为基因名
+    """
+    table = {}
+    with pipelineIO.open_text(table_file) as f:
+        for line in f:
+            if not line.strip() or line.startswith('#') or line.startswith('track') or line.startswith('browser'):
+                continue
+            cols = line.rstrip('\n').split('\t')
+            if len(cols) >= 9 and '=' in cols[8]:
+                chrom = chrom_number(cols[0])
+                for attr in cols[8].split(';'):
+                    key, _, value = attr.strip().partition('=')
+                    if key in ('ID', 'Name') and value:
+                        table[value] = chrom
+            elif len(cols) >= 4:
+                table[cols[3]] = chrom_number(cols[0])
+    return table
+
+def make_chrom_parser(id_regex=None, id_table=None, id_slice=None):
+    """
+    根据配置生成 基因ID -> 染色体编号 的解析函数 (三者至多指定一个)。
+    :param id_regex: 正则字符串，命名组 chr 或第1个捕获组为染色体编号 (从ID开头匹配)
+    :param id_table: 基因ID -> 染色体编号 的字典 (来自 GFF/BED)
+    :param id_slice: (起, 止) 固定位置切片，如 (3, 5) 表示 gene_id[3:5]
+    :return: 解析函数，解析失败返回 0
+    """
+    if id_table is not None:
+        lookup = id_table.get
+        return lambda gene_id: lookup(gene_id, 0)
+
+    if id_slice is not None:
+        start, end = id_slice
+        def parse_slice(gene_id):
+            try:
+                return int(gene_id[start:end])
+            except ValueError:
+                return 0
+        return parse_slice
+
+    if id_regex is not None:
+        pattern = re.compile(id_regex)
+        group = 'chr' if 'chr' in pattern.groupindex else 1
+        match_fn = pattern.match
+        @functools.lru_cache(maxsize=1 << 20)
+        def parse_regex(gene_id):
+            match = match_fn(gene_id)
+            if match:
+                try:
+                    return int(match.group(group))
+                except (TypeError, ValueError):
+                    return 0
+            return 0
+        return parse_regex
+
+    return parse_chromosome
+
+def make_line_pattern(line_prefixes):
+    """
+    批量模式使用的多行正则：行首 (可含空白) 以指定前缀开头的第1列为基因1，第3列为基因2。
+    """
+    prefix = '|'.join(re.escape(p) for p in line_prefixes)
+    return re.compile(r'^[ \t]*((?:' + prefix + r')\S*)[ \t]+\S+[ \t]+(\S+)', re.M)
+
+# 当前生效的解析配置：由 set_id_parsing 设置，进程池子进程在初始化时同步
+ID_PARSING = {
+    'chrom': parse_chromosome,
+    'line_prefix': (DEFAULT_LINE_PREFIX,),
+    'line_pattern': make_line_pattern((DEFAULT_LINE_PREFIX,)),
+}
+
+def set_id_parsing(spec=None):
+    """
+    设置全局基因ID解析方式。
+    :param spec: 字典，可含 id_regex / id_table / id_slice / line_prefix；None 表示恢复默认
+    """
+    spec = spec or {}
+    prefixes = tuple(spec.get('line_prefix') or (DEFAULT_LINE_PREFIX,))
+    ID_PARSING['chrom'] = make_chrom_parser(spec.get('id_regex'), spec.get('id_table'), spec.get('id_slice'))
+    ID_PARSING['line_prefix'] = prefixes
+    ID_PARSING['line_pattern'] = make_line_pattern(prefixes)
+
+def parse_id_slice(slice_arg):
+    """解析 "起:止" 形式的切片参数，如 "3:5" -> (3, 5)"""
+    try:
+        start, end = slice_arg.split(':')
+        return (int(start) if start else None, int(end) if end else None)
+    except ValueError:
+        print(f"[错误] 切片参数格式错误: '{slice_arg}'。正确格式示例: '3:5'")
+        sys.exit(1)
+
+def add_id_parsing_arguments(parser):
+    """为常规模式与 index 子命令添加基因ID解析相关参数"""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--id-regex',
+        default=None,
+        help='从基因ID解析染色体编号的正则 (从ID开头匹配，命名组 chr 或第1个捕获组为编号)\n'
+             f'默认: {GENE_ID_PATTERN.pattern}'
+    )
+    group.add_argument(
+        '--id-table',
+        default=None,
+        help='基因 -> 染色体 对照表 (GFF/GFF3 或 BED)，染色体编号取序列名中最后一段数字'
+    )
+    group.add_argument(
+        '--id-slice',
+        default=None,
+        help='染色体编号在基因ID中的固定位置 (Python 切片)，如 "3:5" 表示 Lso01g12345 -> 01'
+    )
+    parser.add_argument(
+        '--line-prefix',
+        default=DEFAULT_LINE_PREFIX,
+        help=f'基因数据行的前缀，多个前缀用逗号分隔 (默认: {DEFAULT_LINE_PREFIX})\n例如: --line-prefix "Os,LOC_"'
+    )
+
+def id_parsing_spec(args):
+    """由命令行参数构造 set_id_parsing 所需的配置字典"""
+    spec = {'line_prefix': [p for p in args.line_prefix.split(',') if p]}
+    if not spec['line_prefix']:
+        print("[错误] --line-prefix 不能为空。")
+        sys.exit(1)
+    if args.id_regex:
+        try:
+            re.compile(args.id_regex)
+        except re.error as e:
+            print(f"[错误] 正则表达式无效: '{args.id_regex}' ({e})")
+            sys.exit(1)
+        spec['id_regex'] = args.id_regex
+    elif args.id_table:
+        if not os.path.exists(args.id_table):
+            print(f"[错误] 对照表文件不存在: {args.id_table}")
+            sys.exit(1)
+        spec['id_table'] = load_id_table(args.id_table)
+        print(f"[信息] 已从 {args.id_table} 读取 {len(spec['id_table'])} 个基因的染色体信息")
+    elif args.id_slice:
+        spec['id_slice'] = parse_id_slice(args.id_slice)
+    return spec
+
 def parse_target_chroms(chrom_arg):
     """
     解析命令行传入的染色体对参数。
-    :param chrom_arg: 字符串 (如 "1,1;11,11")
-    :return: 包含元组的集合 (如 {(1,1), (11,11)})
+    :param chrom_arg: 字符串 (如 "1,1;11,11")；"all" 表示不限染色体对
+    :return: 包含元组的集合 (如 {(1,1), (11,11)})；"all" 时返回 None
     """
+    if chrom_arg.strip().lower() == "all":
+        return None
     target_pairs = set()
     try:
         # 按分号分割多组
@@ -53,71 +219,387 @@ def parse_target_chroms(chrom_arg):
 # 核心处理逻辑
 # -----------------------------------------------------------------------------
 
-def process_block_files(input_pattern, output_suffix, target_pairs):
+def iter_block_gene_pairs(in_file):
+    """
+    逐行读取 block 文件，产出每个基因行的 (block编号, block内位置, 基因1, 基因2)。
+    block 编号从 1 开始：每遇到一段连续的基因行即为一个新 block，位置从 0 开始。
+    """
+    block_id = 0
+    pos = 0
+    in_block = False
+    line_prefix = ID_PARSING['line_prefix']
+    with pipelineIO.open_text(in_file) as f_in:
+        for line in f_in:
+            line = line.strip()
+            # 快速跳过空行或非基因数据行（默认基因行以'L'开头，可由 --line-prefix 指定）
+            # 根据你的文件样本，block header 是 "the 1th path..." 或 "++++..."
+            if not line or not line.startswith(line_prefix):
+                in_block = False
+                continue
+            
+            parts = line.split()
+            # 确保数据列足够 (列0为基因1, 列2为基因2)
+            if len(parts) < 3:
+                continue
+
+            if not in_block:
+                block_id += 1
+                pos = 0
+                in_block = True
+            yield block_id, pos, parts[0], parts[2]
+            pos += 1
+
+def iter_gene_pairs_bulk(in_file, chunk_size=BULK_CHUNK_SIZE):
+    """
+    批量模式：按大块读取文件，每块用一次 re.finditer 提取全部基因对。
+    结果与逐行模式相同，但不记录 block 编号。
+    """
+    finditer = ID_PARSING['line_pattern'].finditer
+    remainder = ''
+    with pipelineIO.open_text(in_file) as f_in:
+        while True:
+            chunk = f_in.read(chunk_size)
+            if not chunk:
+                break
+            chunk = remainder + chunk
+            # 只处理到最后一个完整行，余下部分并入下一块
+            cut = chunk.rfind('\n') + 1
+            remainder = chunk[cut:]
+            for match in finditer(chunk, 0, cut):
+                yield match.group(1), match.group(2)
+    for match in finditer(remainder):
+        yield match.group(1), match.group(2)
+
+def iter_gene_pairs(in_file, bulk=False):
+    """
+    读取 block 文件，产出每个基因行的 (基因1, 基因2)。
+    :param bulk: 是否使用批量正则模式
+    """
+    if bulk:
+        yield from iter_gene_pairs_bulk(in_file)
+        return
+    for _, _, gene1, gene2 in iter_block_gene_pairs(in_file):
+        yield gene1, gene2
+
+def iter_filtered_pairs(input_pattern, target_pairs, bulk=False):
+    """
+    流式接口：依次扫描匹配的 block 文件，产出目标染色体对的 (基因1, 基因2)，不写文件。
+    供流程驱动 runPipeline.py 将结果直接传给后续步骤。
+    :param target_pairs: 目标染色体对集合；None 表示不限
+    """
+    parse_chrom = ID_PARSING['chrom']
+    for in_file in sorted(glob.glob(input_pattern)):
+        for gene1, gene2 in iter_gene_pairs(in_file, bulk):
+            if target_pairs is None or (parse_chrom(gene1), parse_chrom(gene2)) in target_pairs:
+                yield gene1, gene2
+
+def pair_output_path(in_file, output_suffix, chrom_pair, partition_dir=None):
+    """
+    按染色体对拆分输出时的文件路径。
+    - 未指定 partition_dir: <输入文件>.chr<c1>_<c2><后缀>
+    - 指定 partition_dir:   <partition_dir>/chr<c1>_<c2>/<输入文件名><后缀>
+    """
+    tag = f"chr{chrom_pair[0]}_{chrom_pair[1]}"
+    if partition_dir:
+        pair_dir = os.path.join(partition_dir, tag)
+        os.makedirs(pair_dir, exist_ok=True)
+        return os.path.join(pair_dir, os.path.basename(pipelineIO.strip_compression_suffix(in_file)) + output_suffix)
+    return f"{pipelineIO.strip_compression_suffix(in_file)}.{tag}{output_suffix}"
+
+def filter_block_file(in_file, output_suffix, target_pairs, split_pairs=False, partition_dir=None, bulk=False):
+    """
+    单次扫描一个 block 文件，筛选目标染色体对的基因对。
+    split_pairs 或 partition_dir 开启时，每个染色体对写入各自的输出文件；否则全部写入 <输入文件><后缀>。
+    :param target_pairs: 目标染色体对集合；None 表示不限 (仅在拆分输出时使用)
+    :param bulk: 是否使用批量正则模式读取
+    :return: (输入文件, {输出文件: 提取的基因对数}, 扫描基因行数, 错误信息或 None)
+    """
+    routed = split_pairs or partition_dir is not None
+    parse_chrom = ID_PARSING['chrom']
+    out_handles = {}
+    out_counts = {}
+    line_processed = 0
+    
+    try:
+        if not routed:
+            out_file = f"{pipelineIO.strip_compression_suffix(in_file)}{output_suffix}"
+            out_handles[None] = open(out_file, 'w', encoding='utf-8')
+            out_counts[out_file] = 0
+        
+        for gene1, gene2 in iter_gene_pairs(in_file, bulk):
+            line_processed += 1
+            
+            # 解析染色体编号
+            chrom_pair = (parse_chrom(gene1), parse_chrom(gene2))
+            
+            # 检查是否在目标集合中 (利用Set的O(1)查找)
+            if target_pairs is not None and chrom_pair not in target_pairs:
+                continue
+            
+            key = chrom_pair if routed else None
+            f_out = out_handles.get(key)
+            if f_out is None:
+                # 首次遇到该染色体对时才创建输出文件
+                f_out = open(pair_output_path(in_file, output_suffix, chrom_pair, partition_dir), 'w', encoding='utf-8')
+                out_handles[key] = f_out
+                out_counts[f_out.name] = 0
+            
+            # 写入结果 (制表符分隔)
+            f_out.write(f"{gene1}\t{gene2}\n")
+            out_counts[f_out.name] += 1
+        
+        return in_file, out_counts, line_processed, None
+    
+    except Exception as e:
+        return in_file, out_counts, line_processed, str(e)
+    
+    finally:
+        for f_out in out_handles.values():
+            f_out.close()
+
+def _filter_block_file_task(task):
+    """进程池任务入口 (参数打包为元组)，同时返回该文件的 (墙钟时间, CPU 时间)"""
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = filter_block_file(*task)
+    return result, (time.perf_counter() - wall, time.process_time() - cpu)
+
+def process_block_files(input_pattern, output_suffix, target_pairs, jobs=1, split_pairs=False, partition_dir=None,
+                        bulk=False, id_spec=None, metrics=None):
     """
     遍历文件并筛选符合条件的基因对。
+    :param jobs: 并行处理的文件数 (进程池大小)
+    :param split_pairs: 是否按染色体对拆分输出
+    :param partition_dir: 按染色体对分区输出的目录 (指定后隐含 split_pairs)
+    :param bulk: 是否使用批量正则模式读取
+    :param id_spec: 基因ID解析配置 (见 set_id_parsing)，子进程初始化时使用
+    :param metrics: 可选的 pipelineMetrics.RunMetrics，记录每个文件的扫描耗时与计数
     """
     # 获取所有匹配的文件
-    files = glob.glob(input_pattern)
+    files = sorted(glob.glob(input_pattern))
     if not files:
         print(f"[警告] 未找到匹配模式 '{input_pattern}' 的文件，请检查路径。")
         return
 
-    print(f"目标染色体对: {target_pairs}")
+    print(f"目标染色体对: {target_pairs if target_pairs is not None else '全部'}")
     print(f"待处理文件数: {len(files)}")
 
+    tasks = [(in_file, output_suffix, target_pairs, split_pairs, partition_dir, bulk) for in_file in files]
+    if jobs > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(processes=min(jobs, len(files)), initializer=set_id_parsing, initargs=(id_spec,))
+        results = pool.imap(_filter_block_file_task, tasks)
+    else:
+        pool = None
+        results = map(_filter_block_file_task, tasks)
+
+    try:
+        for (in_file, out_counts, line_processed, error), (wall, cpu) in results:
+            print(f"--------------------------------------------------")
+            print(f"正在处理: {in_file}")
+            if metrics is not None:
+                metrics.add_phase("scan_file", wall, cpu)
+                metrics.count("lines_scanned", line_processed)
+                metrics.count("pairs_kept", sum(out_counts.values()))
+                metrics.count("files_failed" if error is not None else "files_done")
+            if error is not None:
+                print(f"[错误] 处理文件 {in_file} 时发生错误: {error}")
+                continue
+            for out_file, count in sorted(out_counts.items()):
+                print(f"处理完成: {out_file} ({count} 对)")
+            print(f"统计: 扫描基因行 {line_processed} 条，提取符合条件 {sum(out_counts.values())} 对")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+# -----------------------------------------------------------------------------
+# 二进制共线性索引 (index / query 子命令)
+# -----------------------------------------------------------------------------
+# 索引为 NumPy .npz 列式存储：
+#   genes      : 排序后的唯一基因ID (字符串驻留表)
+#   gene1/gene2: 基因在 genes 中的下标 (int32)
+#   chr1/chr2  : 染色体编号 (int32)
+#   block/pos  : block 编号 (从1开始) 与 block 内位置 (int32)
+# 由于 genes 已排序，基因ID的字典序区间可直接转换为下标区间。
+
+INDEX_SUFFIX = '.idx.npz'
+
+def build_block_index(in_file):
+    """
+    扫描一次 block 文件，构建列式索引。
+    :return: 包含各列 NumPy 数组的字典
+    """
+    blocks, positions, names1, names2 = [], [], [], []
+    for block_id, pos, gene1, gene2 in iter_block_gene_pairs(in_file):
+        blocks.append(block_id)
+        positions.append(pos)
+        names1.append(gene1)
+        names2.append(gene2)
+
+    n = len(names1)
+    # 基因ID驻留：np.unique 返回排序后的唯一ID及每个位置的下标
+    genes, codes = np.unique(np.array(names1 + names2, dtype=str), return_inverse=True)
+    codes = codes.astype(np.int32)
+    # 染色体只需对唯一基因解析一次
+    parse_chrom = ID_PARSING['chrom']
+    gene_chroms = np.array([parse_chrom(g) for g in genes], dtype=np.int32)
+    gene1 = codes[:n]
+    gene2 = codes[n:]
+    return {
+        'genes': genes,
+        'gene1': gene1,
+        'gene2': gene2,
+        'chr1': gene_chroms[gene1] if n else np.zeros(0, dtype=np.int32),
+        'chr2': gene_chroms[gene2] if n else np.zeros(0, dtype=np.int32),
+        'block': np.array(blocks, dtype=np.int32),
+        'pos': np.array(positions, dtype=np.int32),
+    }
+
+def save_block_index(index, out_file):
+    np.savez(out_file, **index)
+
+def load_block_index(index_file):
+    """读取 .npz 索引为字典 (不依赖 pickle)"""
+    with np.load(index_file, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+def parse_block_ranges(block_arg):
+    """
+    解析 block 编号参数，如 "1-10,15" -> [(1, 10), (15, 15)]
+    """
+    ranges = []
+    try:
+        for item in block_arg.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            if '-' in item:
+                lo, hi = item.split('-', 1)
+                ranges.append((int(lo), int(hi)))
+            else:
+                ranges.append((int(item), int(item)))
+    except ValueError:
+        print(f"[错误] block 参数格式错误: '{block_arg}'。正确格式示例: '1-10,15'")
+        sys.exit(1)
+    return ranges
+
+def query_block_index(index, target_pairs=None, block_ranges=None, gene_range=None):
+    """
+    在索引上做向量化筛选。
+    :param target_pairs: 染色体对集合；None 表示不限
+    :param block_ranges: [(起始block, 结束block), ...] (闭区间)；None 表示不限
+    :param gene_range: (起始基因ID, 结束基因ID) 字典序闭区间，任一侧基因落在区间内即保留；None 表示不限
+    :return: 满足条件的行的布尔掩码
+    """
+    n = len(index['gene1'])
+    mask = np.ones(n, dtype=bool)
+
+    if target_pairs is not None:
+        # 将染色体对编码为单个整数后用 np.isin 一次比较
+        width = int(max(index['chr2'].max(initial=0), max((c2 for _, c2 in target_pairs), default=0))) + 1
+        pair_codes = index['chr1'].astype(np.int64) * width + index['chr2']
+        wanted = np.array([c1 * width + c2 for c1, c2 in target_pairs], dtype=np.int64)
+        mask &= np.isin(pair_codes, wanted)
+
+    if block_ranges is not None:
+        block_mask = np.zeros(n, dtype=bool)
+        for lo, hi in block_ranges:
+            block_mask |= (index['block'] >= lo) & (index['block'] <= hi)
+        mask &= block_mask
+
+    if gene_range is not None:
+        # genes 已排序：字典序区间 -> 下标区间
+        lo = np.searchsorted(index['genes'], gene_range[0], side='left')
+        hi = np.searchsorted(index['genes'], gene_range[1], side='right')
+        in1 = (index['gene1'] >= lo) & (index['gene1'] < hi)
+        in2 = (index['gene2'] >= lo) & (index['gene2'] < hi)
+        mask &= in1 | in2
+
+    return mask
+
+def index_main(argv):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} index",
+        description="将共线性 Block 文件转换为二进制列式索引 (.npz)，供 query 子命令快速筛选",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('-i', '--input', required=True,
+                        help='输入文件的匹配模式 (必须用引号包裹)\n例如: -i "*.block.rr.txt"')
+    parser.add_argument('-o', '--output-suffix', default=INDEX_SUFFIX,
+                        help=f'索引文件后缀 (默认: {INDEX_SUFFIX})')
+    add_id_parsing_arguments(parser)
+    args = parser.parse_args(argv)
+    set_id_parsing(id_parsing_spec(args))
+
+    files = sorted(glob.glob(args.input))
+    if not files:
+        print(f"[警告] 未找到匹配模式 '{args.input}' 的文件，请检查路径。")
+        return
+
     for in_file in files:
-        # 构造输出文件名：原文件名 + 后缀
-        out_file = f"{in_file}{output_suffix}"
-        
-        filtered_count = 0
-        line_processed = 0
-        
-        print(f"--------------------------------------------------")
-        print(f"正在处理: {in_file}")
+        out_file = f"{pipelineIO.strip_compression_suffix(in_file)}{args.output_suffix}"
+        print(f"正在索引: {in_file}")
+        index = build_block_index(in_file)
+        save_block_index(index, out_file)
+        n_blocks = int(index['block'].max(initial=0))
+        print(f"索引完成: {out_file} (基因对 {len(index['gene1'])} 条, block {n_blocks} 个, 唯一基因 {len(index['genes'])} 个)")
 
-        try:
-            with open(in_file, 'r', encoding='utf-8') as f_in, \
-                 open(out_file, 'w', encoding='utf-8') as f_out:
-                
-                for line in f_in:
-                    line = line.strip()
-                    # 快速跳过空行或非基因数据行（假设基因行以'L'开头）
-                    # 根据你的文件样本，block header 是 "the 1th path..." 或 "++++..."
-                    if not line or not line.startswith('L'):
-                        continue
-                    
-                    parts = line.split()
-                    # 确保数据列足够 (列0为基因1, 列2为基因2)
-                    if len(parts) < 3:
-                        continue
-
-                    gene1 = parts[0]
-                    gene2 = parts[2]
-
-                    # 解析染色体编号
-                    chr1 = parse_chromosome(gene1)
-                    chr2 = parse_chromosome(gene2)
-
-                    # 检查是否在目标集合中 (利用Set的O(1)查找)
-                    if (chr1, chr2) in target_pairs:
-                        # 写入结果 (制表符分隔)
-                        f_out.write(f"{gene1}\t{gene2}\n")
-                        filtered_count += 1
-                    
-                    line_processed += 1
-
-            print(f"处理完成: {out_file}")
-            print(f"统计: 扫描基因行 {line_processed} 条，提取符合条件 {filtered_count} 对")
-
-        except Exception as e:
-            print(f"[错误] 处理文件 {in_file} 时发生错误: {e}")
+def query_main(argv):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} query",
+        description="在二进制索引上筛选基因对，输出格式与常规模式相同",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('-x', '--index', required=True, help='index 子命令生成的 .npz 索引文件')
+    parser.add_argument('-c', '--chroms', default=None,
+                        help='染色体对，格式同常规模式 (如 "1,1;11,11")；不指定则不限')
+    parser.add_argument('--blocks', default=None,
+                        help='block 编号 (从1开始)，支持区间，如 "1-10,15"')
+    parser.add_argument('--gene-range', default=None,
+                        help='基因ID区间 (字典序，闭区间)，任一侧基因落在区间内即保留\n例如: --gene-range Lso01g00100:Lso01g00500')
+    parser.add_argument('-o', '--output', default=None,
+                        help='输出文件 (默认: 索引文件名去掉 .idx.npz 后加 .pseu.ortologs)')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.index):
+        print(f"[错误] 索引文件不存在: {args.index}")
+        sys.exit(1)
+
+    target_pairs = parse_target_chroms(args.chroms) if args.chroms else None
+    block_ranges = parse_block_ranges(args.blocks) if args.blocks else None
+    gene_range = None
+    if args.gene_range:
+        if ':' not in args.gene_range:
+            print(f"[错误] 基因区间格式错误: '{args.gene_range}'。正确格式示例: 'Lso01g00100:Lso01g00500'")
+            sys.exit(1)
+        gene_range = tuple(args.gene_range.split(':', 1))
+
+    out_file = args.output
+    if out_file is None:
+        base = args.index[:-len(INDEX_SUFFIX)] if args.index.endswith(INDEX_SUFFIX) else args.index
+        out_file = f"{base}.pseu.ortologs"
+
+    index = load_block_index(args.index)
+    mask = query_block_index(index, target_pairs, block_ranges, gene_range)
+    genes = index['genes']
+    with open(out_file, 'w', encoding='utf-8') as f_out:
+        for g1, g2 in zip(genes[index['gene1'][mask]], genes[index['gene2'][mask]]):
+            f_out.write(f"{g1}\t{g2}\n")
+    print(f"查询完成: {out_file} (命中 {int(mask.sum())} / {len(mask)} 对)")
 
 # -----------------------------------------------------------------------------
 # 主程序入口
 # -----------------------------------------------------------------------------
 
 def main():
+    # 子命令: index / query；其余情况保持原有命令行
+    if len(sys.argv) > 1 and sys.argv[1] == 'index':
+        index_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'query':
+        query_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description="提取共线性文件中的特定染色体直系同源基因对",
         formatter_class=argparse.RawTextHelpFormatter
@@ -137,19 +619,53 @@ def main():
     parser.add_argument(
         '-c', '--chroms', 
         default='1,1;11,11', 
-        help='需要筛选的染色体对，用分号分隔组，逗号分隔对 (默认: 1,1;11,11)\n例如: -c "1,1;2,2;3,5"'
+        help='需要筛选的染色体对，用分号分隔组，逗号分隔对 (默认: 1,1;11,11)\n例如: -c "1,1;2,2;3,5"\n配合 --split-pairs 时可用 -c all 一次性输出所有染色体对'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='并行处理的文件数 (默认: 1)'
     )
+    parser.add_argument(
+        '--split-pairs',
+        action='store_true',
+        help='单次扫描，按染色体对拆分输出 (每对一个文件: <输入文件>.chr<c1>_<c2><后缀>)'
+    )
+    parser.add_argument(
+        '--partition-dir',
+        default=None,
+        help='按染色体对分区输出的目录 (输出为 <目录>/chr<c1>_<c2>/<输入文件名><后缀>，隐含 --split-pairs)'
+    )
+    parser.add_argument(
+        '--bulk',
+        action='store_true',
+        help='批量模式：按大块读取文件，每块一次正则扫描提取全部基因对 (适合超大文件)'
+    )
+    add_id_parsing_arguments(parser)
+    pipelineMetrics.add_metrics_arguments(parser, 'filterOrthlogs.metrics.json', 'filterOrthlogs.prof')
 
     args = parser.parse_args()
 
-    # 1. 解析目标染色体
+    # 1. 解析目标染色体与基因ID解析方式
     target_pairs = parse_target_chroms(args.chroms)
+    id_spec = id_parsing_spec(args)
+    set_id_parsing(id_spec)
+    if target_pairs is None and not (args.split_pairs or args.partition_dir):
+        print("[错误] -c all 需要配合 --split-pairs 或 --partition-dir 使用。")
+        sys.exit(1)
     
     # 2. 执行处理
-    process_block_files(args.input, args.output_suffix, target_pairs)
+    metrics = pipelineMetrics.RunMetrics('filterOrthlogs') if args.metrics else None
+    with pipelineMetrics.profiled(args.profile):
+        process_block_files(args.input, args.output_suffix, target_pairs,
+                            jobs=args.jobs, split_pairs=args.split_pairs, partition_dir=args.partition_dir,
+                            bulk=args.bulk, id_spec=id_spec, metrics=metrics)
     
     print(f"--------------------------------------------------")
     print("所有任务已完成。")
+    if metrics is not None:
+        metrics.write(args.metrics, items='lines_scanned')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
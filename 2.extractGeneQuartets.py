@@ -2,6 +2,10 @@ import argparse
 import sys
 import os
 
+import pipelineMetrics
+import pipelineIO
+from array import array
+
 def load_ortholog_map(ortho_file):
     """
     加载直系同源基因映射字典。
@@ -14,7 +18,7 @@ def load_ortholog_map(ortho_file):
     print(f"[信息] 正在加载直系同源文件: {ortho_file}")
     
     try:
-        with open(ortho_file, 'r', encoding='utf-8') as f:
+        with pipelineIO.open_text(ortho_file) as f:
             for line_num, line in enumerate(f, 1):
                 line = line.strip()
                 if not line:
@@ -41,6 +45,154 @@ def load_ortholog_map(ortho_file):
         print(f"[错误] 读取文件失败: {e}")
         sys.exit(1)
 
+def iter_ortholog_pairs(ortho_file):
+    """
+    逐行读取直系同源文件，产出 (物种1基因, 物种2基因)。
+    """
+    with pipelineIO.open_text(ortho_file) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 2:
+                continue
+            yield parts[0], parts[1]
+
+def iter_paralog_pairs(paralog_file, stats=None):
+    """
+    逐行读取旁系同源文件，产出旁系基因对 (索引1和2列)。
+    :param stats: 可选字典，total_lines 累计扫描的非空行数
+    """
+    with pipelineIO.open_text(paralog_file) as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if stats is not None:
+                stats['total_lines'] = stats.get('total_lines', 0) + 1
+            # 确保至少有3列 (ID, Gene1, Gene2)
+            if len(parts) < 3:
+                continue
+            yield parts[1], parts[2]
+
+class OrthologIndex:
+    """
+    一对多直系同源索引 (CSR 结构)。
+    物种1基因按首次出现顺序编号为行号；第 r 行的直系基因编号为
+    targets[offsets[r]:offsets[r+1]]，编号对应 target_names 中的物种2基因ID。
+    """
+
+    def __init__(self, rows, offsets, targets, target_names):
+        self.rows = rows                  # {物种1基因ID: 行号}
+        self.offsets = offsets            # array('l')，长度 = 行数 + 1
+        self.targets = targets            # array('l')，物种2基因编号
+        self.target_names = target_names  # [物种2基因ID, ...]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, gene):
+        return gene in self.rows
+
+    @property
+    def n_pairs(self):
+        return len(self.targets)
+
+    def target_ids(self, row):
+        return self.targets[self.offsets[row]:self.offsets[row + 1]]
+
+    def orthologs(self, gene):
+        """返回物种1基因的全部直系基因ID (按文件中出现的顺序)"""
+        row = self.rows.get(gene)
+        if row is None:
+            return []
+        return [self.target_names[t] for t in self.target_ids(row)]
+
+def load_ortholog_index(ortho_file):
+    """
+    加载一对多直系同源索引，保留每个物种1基因的全部直系基因 (重复行只记一次)。
+    文件格式同 load_ortholog_map。
+    
+    :param ortho_file: 直系同源基因文件路径
+    :return: OrthologIndex
+    """
+    print(f"[信息] 正在加载直系同源文件 (一对多模式): {ortho_file}")
+    
+    try:
+        index = build_ortholog_index(iter_ortholog_pairs(ortho_file))
+    except FileNotFoundError:
+        print(f"[错误] 未找到文件: {ortho_file}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"[错误] 读取文件失败: {e}")
+        sys.exit(1)
+    
+    n_rows = len(index)
+    multi = sum(1 for r in range(n_rows) if index.offsets[r + 1] - index.offsets[r] > 1)
+    print(f"[信息] 直系同源索引加载完成，共 {n_rows} 个基因、{index.n_pairs} 对直系关系 (一对多基因 {multi} 个)。")
+    return index
+
+def build_ortholog_index(ortholog_pairs):
+    """
+    由 (物种1基因, 物种2基因) 序列构建 OrthologIndex (重复的基因对只记一次)。
+    """
+    rows = {}
+    target_ids = {}
+    target_names = []
+    pair_rows = array('l')
+    pair_targets = array('l')
+    seen = set()
+    
+    for gene1, gene2 in ortholog_pairs:
+        row = rows.setdefault(gene1, len(rows))
+        target = target_ids.get(gene2)
+        if target is None:
+            target = target_ids[gene2] = len(target_names)
+            target_names.append(gene2)
+        
+        if (row, target) in seen:
+            continue
+        seen.add((row, target))
+        pair_rows.append(row)
+        pair_targets.append(target)
+    
+    # 计数排序构建 CSR：先统计每行的直系数目，再按行号稳定填充
+    n_rows = len(rows)
+    offsets = array('l', [0]) * (n_rows + 1)
+    for row in pair_rows:
+        offsets[row + 1] += 1
+    for r in range(n_rows):
+        offsets[r + 1] += offsets[r]
+    cursor = array('l', offsets[:-1])
+    targets = array('l', [0]) * len(pair_targets)
+    for row, target in zip(pair_rows, pair_targets):
+        targets[cursor[row]] = target
+        cursor[row] += 1
+    
+    return OrthologIndex(rows, offsets, targets, target_names)
+
+def iter_map_quartets(paralog_pairs, ortholog_map):
+    """
+    默认模式的四元组生成器：每个旁系基因对最多产出一个四元组。
+    :param paralog_pairs: 可迭代的 (旁系基因1, 旁系基因2)
+    :param ortholog_map: {物种1基因ID: 物种2基因ID}
+    """
+    for p_gene1, p_gene2 in paralog_pairs:
+        # 核心筛选逻辑：
+        # 1. 两个旁系基因必须都在直系同源字典中存在
+        if p_gene1 in ortholog_map and p_gene2 in ortholog_map:
+            
+            # 获取对应的直系基因
+            o_gene1 = ortholog_map[p_gene1]
+            o_gene2 = ortholog_map[p_gene2]
+            
+            # 2. 简单的格式校验 (保留原脚本逻辑：需包含 'g' 字符)
+            if 'g' not in o_gene1 or 'g' not in o_gene2:
+                continue
+                
+            # 3. 排除直系基因相同的情况 (防止多对一映射导致的重复)
+            if o_gene1 != o_gene2:
+                # 四元组: Lso1, Lma1, Lso2, Lma2
+                yield p_gene1, o_gene1, p_gene2, o_gene2
+
 def process_paralogs(paralog_file, ortholog_map, output_file):
     """
     读取旁系同源文件，结合直系同源映射，生成四元组文件。
@@ -53,54 +205,185 @@ def process_paralogs(paralog_file, ortholog_map, output_file):
     2. 查找 Lso1 对应的 Lma1 (直系)
     3. 查找 Lso2 对应的 Lma2 (直系)
     4. 确保 Lma1 != Lma2 (指向不同的直系基因)
+    :return: 统计字典 (total_lines 扫描的旁系记录数, quartets 生成的四元组数)
     """
     print(f"[信息] 正在处理旁系同源文件: {paralog_file}")
     
     valid_count = 0
-    total_lines = 0
+    stats = {'total_lines': 0}
     
     try:
-        with open(paralog_file, 'r', encoding='utf-8') as f_in, \
-             open(output_file, 'w', encoding='utf-8') as f_out:
-            
-            for line in f_in:
-                line = line.strip()
-                if not line:
+        with open(output_file, 'w', encoding='utf-8') as f_out:
+            for quartet in iter_map_quartets(iter_paralog_pairs(paralog_file, stats), ortholog_map):
+                f_out.write("\t".join(quartet) + "\n")
+                valid_count += 1
+
+        print(f"[信息] 处理完成。")
+        print(f"[统计] 扫描旁系记录: {stats['total_lines']} 条")
+        print(f"[统计] 生成有效四元组: {valid_count} 个")
+        print(f"[结果] 输出文件已保存至: {output_file}")
+        stats['quartets'] = valid_count
+        return stats
+
+    except FileNotFoundError:
+        print(f"[错误] 未找到文件: {paralog_file}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"[错误] 处理过程发生异常: {e}")
+        sys.exit(1)
+
+def quartet_key(p_gene1, o_gene1, p_gene2, o_gene2):
+    """四元组的规范化键：(A1,B1,A2,B2) 与 (A2,B2,A1,B1) 得到同一个键"""
+    if (p_gene1, o_gene1) <= (p_gene2, o_gene2):
+        return p_gene1, o_gene1, p_gene2, o_gene2
+    return p_gene2, o_gene2, p_gene1, o_gene1
+
+def iter_index_quartets(paralog_pairs, ortholog_index, max_per_pair=None, stats=None):
+    """
+    一对多模式的四元组生成器：对每个旁系基因对枚举全部 (Para1, Ortho1, Para2, Ortho2) 组合。
+    
+    - 校验规则与默认模式相同 (直系基因需包含 'g'，且 Ortho1 != Ortho2)
+    - 对称四元组 (A1,B1,A2,B2) 与 (A2,B2,A1,B1) 视为同一个，仅产出首次出现者
+    - max_per_pair: 每个旁系基因对最多产出的四元组数 (None 表示不限)；
+      按无序基因对计数，自比对文件中的 (A,B) 与 (B,A) 两行共用同一上限
+    - stats: 可选字典，累计 duplicates (去除的对称/重复四元组) 与 capped (达到上限的旁系基因对)
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('duplicates', 0)
+    stats.setdefault('capped', 0)
+    
+    rows = ortholog_index.rows
+    target_names = ortholog_index.target_names
+    target_ids = ortholog_index.target_ids
+    # 预先标记可用的直系基因 (保留原脚本逻辑：需包含 'g' 字符)
+    target_ok = [('g' in name) for name in target_names]
+    # 规范化后的四元组 (行号/编号整数元组) 哈希集合，用于去除对称与重复的四元组
+    emitted = set()
+    # 每个无序旁系基因对 (行号对) 已产出的四元组数，以及达到上限的基因对
+    pair_counts = {}
+    capped_pairs = set()
+    
+    for p_gene1, p_gene2 in paralog_pairs:
+        row1 = rows.get(p_gene1)
+        row2 = rows.get(p_gene2)
+        if row1 is None or row2 is None:
+            continue
+        
+        pair_key = (row1, row2) if row1 <= row2 else (row2, row1)
+        pair_count = pair_counts.get(pair_key, 0)
+        capped = False
+        for t1 in target_ids(row1):
+            if not target_ok[t1]:
+                continue
+            for t2 in target_ids(row2):
+                if t1 == t2 or not target_ok[t2]:
                     continue
                 
-                total_lines += 1
-                parts = line.split()
-                
-                # 确保至少有3列 (ID, Gene1, Gene2)
-                if len(parts) < 3:
+                key = (row1, t1, row2, t2) if (row1, t1) <= (row2, t2) else (row2, t2, row1, t1)
+                if key in emitted:
+                    stats['duplicates'] += 1
                     continue
                 
-                # 提取旁系基因对 (索引1和2)
-                p_gene1 = parts[1]
-                p_gene2 = parts[2]
+                if max_per_pair is not None and pair_count >= max_per_pair:
+                    capped = True
+                    break
                 
-                # 核心筛选逻辑：
-                # 1. 两个旁系基因必须都在直系同源字典中存在
-                if p_gene1 in ortholog_map and p_gene2 in ortholog_map:
-                    
-                    # 获取对应的直系基因
-                    o_gene1 = ortholog_map[p_gene1]
-                    o_gene2 = ortholog_map[p_gene2]
-                    
-                    # 2. 简单的格式校验 (保留原脚本逻辑：需包含 'g' 字符)
-                    if 'g' not in o_gene1 or 'g' not in o_gene2:
-                        continue
-                        
-                    # 3. 排除直系基因相同的情况 (防止多对一映射导致的重复)
-                    if o_gene1 != o_gene2:
-                        # 写入四元组: Lso1, Lma1, Lso2, Lma2
-                        f_out.write(f"{p_gene1}\t{o_gene1}\t{p_gene2}\t{o_gene2}\n")
-                        valid_count += 1
+                emitted.add(key)
+                pair_count += 1
+                yield p_gene1, target_names[t1], p_gene2, target_names[t2]
+            if capped:
+                break
+        
+        pair_counts[pair_key] = pair_count
+        if capped:
+            capped_pairs.add(pair_key)
+    
+    stats['capped'] += len(capped_pairs)
+
+def iter_streaming_quartets(ortholog_pairs, paralog_pairs, max_per_pair=None, stats=None):
+    """
+    流式四元组生成器 (对称哈希连接，一对多语义)。
+    旁系基因对预先按基因建立哈希表；直系关系逐条到达，每到一条就与已到达的直系关系连接，
+    立即产出新凑齐的四元组，无需等待直系同源文件读完。
+    产出的四元组集合与 iter_index_quartets 相同 (顺序按直系关系的到达顺序，对称四元组的方向可能不同)。
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('duplicates', 0)
+    stats.setdefault('capped', 0)
+    
+    paralogs = list(paralog_pairs)
+    para_by_gene = {}
+    for i, (p_gene1, p_gene2) in enumerate(paralogs):
+        para_by_gene.setdefault(p_gene1, []).append(i)
+        if p_gene2 != p_gene1:
+            para_by_gene.setdefault(p_gene2, []).append(i)
+    
+    orthologs = {}
+    # 按无序旁系基因对计数 (同 iter_index_quartets)
+    pair_counts = {}
+    capped = set()
+    emitted = set()
+    
+    for gene, ortho in ortholog_pairs:
+        known = orthologs.setdefault(gene, [])
+        if ortho in known:
+            continue
+        known.append(ortho)
+        # 保留原脚本逻辑：直系基因需包含 'g' 字符
+        if 'g' not in ortho:
+            continue
+        
+        for i in para_by_gene.get(gene, ()):
+            p_gene1, p_gene2 = paralogs[i]
+            candidates = []
+            if gene == p_gene1:
+                candidates.extend((ortho, o_gene2) for o_gene2 in orthologs.get(p_gene2, ()))
+            if gene == p_gene2:
+                candidates.extend((o_gene1, ortho) for o_gene1 in orthologs.get(p_gene1, ()))
+            
+            for o_gene1, o_gene2 in candidates:
+                if o_gene1 == o_gene2 or 'g' not in o_gene1 or 'g' not in o_gene2:
+                    continue
+                key = quartet_key(p_gene1, o_gene1, p_gene2, o_gene2)
+                if key in emitted:
+                    stats['duplicates'] += 1
+                    continue
+                pair_key = frozenset((p_gene1, p_gene2))
+                if max_per_pair is not None and pair_counts.get(pair_key, 0) >= max_per_pair:
+                    capped.add(pair_key)
+                    continue
+                emitted.add(key)
+                pair_counts[pair_key] = pair_counts.get(pair_key, 0) + 1
+                yield p_gene1, o_gene1, p_gene2, o_gene2
+    
+    stats['capped'] += len(capped)
+
+def process_paralogs_multi(paralog_file, ortholog_index, output_file, max_per_pair=None):
+    """
+    一对多模式：对每个旁系基因对枚举全部四元组组合并写出 (见 iter_index_quartets)。
+    :return: 统计字典 (total_lines, quartets, duplicates, capped)
+    """
+    print(f"[信息] 正在处理旁系同源文件 (一对多模式): {paralog_file}")
+    
+    valid_count = 0
+    stats = {'total_lines': 0}
+    
+    try:
+        with open(output_file, 'w', encoding='utf-8') as f_out:
+            paralog_pairs = iter_paralog_pairs(paralog_file, stats)
+            for quartet in iter_index_quartets(paralog_pairs, ortholog_index, max_per_pair, stats):
+                f_out.write("\t".join(quartet) + "\n")
+                valid_count += 1
 
         print(f"[信息] 处理完成。")
-        print(f"[统计] 扫描旁系记录: {total_lines} 条")
+        print(f"[统计] 扫描旁系记录: {stats['total_lines']} 条")
         print(f"[统计] 生成有效四元组: {valid_count} 个")
+        print(f"[统计] 去除对称/重复四元组: {stats['duplicates']} 个")
+        if max_per_pair is not None:
+            print(f"[统计] 达到上限 ({max_per_pair}) 的旁系基因对: {stats['capped']} 个")
         print(f"[结果] 输出文件已保存至: {output_file}")
+        stats['quartets'] = valid_count
+        return stats
 
     except FileNotFoundError:
         print(f"[错误] 未找到文件: {paralog_file}")
@@ -131,14 +414,51 @@ def main():
         default='Lso_Lma.quartet',
         help='输出的四元组文件路径 (默认: Lso_Lma.quartet)'
     )
+    parser.add_argument(
+        '--multi',
+        action='store_true',
+        help='一对多模式：保留每个基因的全部直系同源基因，枚举所有四元组组合并去除对称重复\n(默认模式下同一基因的多个直系基因仅保留最后一个)'
+    )
+    parser.add_argument(
+        '--max-per-pair',
+        type=int,
+        default=None,
+        help='一对多模式下每个旁系基因对最多输出的四元组数 (默认: 不限)'
+    )
+    
+    pipelineMetrics.add_metrics_arguments(parser)
     
     args = parser.parse_args()
+    pipelineMetrics.resolve_output_paths(args, args.output)
     
-    # 步骤 1: 加载映射
-    ortho_map = load_ortholog_map(args.ortho)
+    if args.max_per_pair is not None and not args.multi:
+        print("[错误] --max-per-pair 需要配合 --multi 使用。")
+        sys.exit(1)
+    if args.max_per_pair is not None and args.max_per_pair < 1:
+        print("[错误] --max-per-pair 必须为正整数。")
+        sys.exit(1)
+    
+    metrics = pipelineMetrics.RunMetrics('extractGeneQuartets') if args.metrics else None
+    with pipelineMetrics.profiled(args.profile):
+        if args.multi:
+            # 一对多模式
+            with pipelineMetrics.stage(metrics, 'load_orthologs'):
+                ortho_index = load_ortholog_index(args.ortho)
+            with pipelineMetrics.stage(metrics, 'build_quartets'):
+                stats = process_paralogs_multi(args.para, ortho_index, args.output, args.max_per_pair)
+        else:
+            # 步骤 1: 加载映射
+            with pipelineMetrics.stage(metrics, 'load_orthologs'):
+                ortho_map = load_ortholog_map(args.ortho)
+            
+            # 步骤 2: 筛选并输出结果
+            with pipelineMetrics.stage(metrics, 'build_quartets'):
+                stats = process_paralogs(args.para, ortho_map, args.output)
     
-    # 步骤 2: 筛选并输出结果
-    process_paralogs(args.para, ortho_map, args.output)
+    if metrics is not None:
+        for key, value in stats.items():
+            metrics.count(key, value)
+        metrics.write(args.metrics, items='total_lines', item_stage='build_quartets')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
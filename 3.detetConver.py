@@ -5,10 +5,50 @@ import subprocess
 import random
 import math
 import shutil
+import tempfile
+import multiprocessing
+import statistics
+import collections
+import json
+import shlex
+import io
+import hashlib
+import sqlite3
+import time
+import contextlib
+import asyncio
+import itertools
+import concurrent.futures
+import traceback
+import numpy as np
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from Bio.Data import CodonTable
+from Bio.Align import PairwiseAligner, substitution_matrices
+import pipelineMetrics
+import pipelineIO
+
+# 运行统计 (--metrics)：由 enable_metrics() 创建；未开启时为 None，phase()/count_metric() 不做任何事
+METRICS = None
+
+def enable_metrics(args, script="detetConver"):
+    """按 --metrics 创建本进程的 RunMetrics (进程池 worker 各自调用一次)"""
+    global METRICS
+    METRICS = pipelineMetrics.RunMetrics(script) if args.metrics else None
+    return METRICS
+
+def stage(name):
+    """计时脚本级步骤 (如 加载序列、分析)"""
+    return pipelineMetrics.stage(METRICS, name)
+
+def phase(name):
+    """计时单个四元组内部的计算阶段 (translate / align / back_translate / kaks / bootstrap / screen)"""
+    return METRICS.phase(name) if METRICS is not None else contextlib.nullcontext()
+
+def count_metric(name, n=1):
+    if METRICS is not None:
+        METRICS.count(name, n)
 
 # =========================================================
 # 1. 科学计算核心模块 (Ka/Ks 计算)
@@ -17,70 +57,143 @@ from Bio.Data import CodonTable
 # 获取标准遗传密码表 (NCBI Table 1)
 STANDARD_TABLE = CodonTable.unambiguous_dna_by_id[1]
 
-def get_neighbors_score(codon, aa):
+# 64 个密码子按 TCAG 顺序排列 (索引 = 16*第1位 + 4*第2位 + 第3位)
+CODON_BASES = "TCAG"
+ALL_CODONS = [a + b + c for a in CODON_BASES for b in CODON_BASES for c in CODON_BASES]
+
+# 整数编码中的哨兵值：含缺口的密码子 / 含 N 等其他字符的密码子
+CODON_GAP = 64
+CODON_AMBIG = 65
+N_CODON_CODES = 66
+
+# 碱基 -> 2bit 编码的查找表 (大小写均可)；'-' 记为 4，其他字符记为 5
+_BASE_CODE = np.full(256, 5, dtype=np.uint8)
+for _i, _b in enumerate(CODON_BASES):
+    _BASE_CODE[ord(_b)] = _i
+    _BASE_CODE[ord(_b.lower())] = _i
+_BASE_CODE[ord('-')] = 4
+
+def get_neighbors_score(codon, aa, codon_table=STANDARD_TABLE):
     """
     计算一个密码子的同义(Synonymous)和非同义(Nonsynonymous)邻居分数。
     原理：Nei-Gojobori (1986) 算法的简化步骤。
+    :return: (同义邻居数, 非同义邻居数)，除以 3 即为位点分数
     """
     syn_neighbors = 0
     neighbors = 0
-    bases = ['T', 'C', 'A', 'G']
     
     # 对密码子的3个位置分别尝试突变
     for pos in range(3):
         orig_base = codon[pos]
-        for b in bases:
+        for b in CODON_BASES:
             if b == orig_base:
                 continue
             
             # 构建突变密码子
-            temp_codon_list = list(codon)
-            temp_codon_list[pos] = b
-            temp_codon = "".join(temp_codon_list)
+            temp_codon = codon[:pos] + b + codon[pos + 1:]
             
             # 查表获取氨基酸
-            # 注意：Biopython的表不包含终止密码子作为键，需捕获异常或预处理
-            try:
-                temp_aa = STANDARD_TABLE.forward_table.get(temp_codon, '*')
-            except KeyError:
-                if temp_codon in STANDARD_TABLE.stop_codons:
-                    temp_aa = '*'
-                else:
-                    temp_aa = 'X'
-
+            # 注意：Biopython的表不包含终止密码子作为键，查不到即视为终止
+            temp_aa = codon_table.forward_table.get(temp_codon, '*')
             if temp_aa == '*': continue # 忽略导致终止的突变
             
             neighbors += 1
             if temp_aa == aa:
                 syn_neighbors += 1
                 
-    s_score = syn_neighbors / 3.0
-    n_score = (neighbors - syn_neighbors) / 3.0
-    return s_score, n_score
+    return syn_neighbors, neighbors - syn_neighbors
+
+def build_codon_tables(table_id):
+    """
+    为指定的 NCBI 遗传密码表预计算 Ka/Ks 所需的查找表。
+    - sites:     {密码子: (同义邻居数, 非同义邻居数)}，仅包含有义密码子
+    - pair_diff: {(密码子1, 密码子2): (同义差异, 非同义差异)}，仅包含有义密码子对
+    - site_syn / site_nonsyn / pair_syn / pair_nonsyn: 以整数编码 (0-65) 为下标的
+      NumPy 数组版本，供向量化内核使用；终止密码子与哨兵值对应的分数均为 0
+    位点分数以"三分之一位点"的整数形式保存，累加后再统一除以 3，结果与累加顺序无关。
+    """
+    codon_table = CodonTable.unambiguous_dna_by_id[table_id]
+    forward = codon_table.forward_table
+    sense_codons = [c for c in ALL_CODONS if c in forward]
+    
+    sites = {c: get_neighbors_score(c, forward[c], codon_table) for c in sense_codons}
+    
+    pair_diff = {}
+    for c1 in sense_codons:
+        for c2 in sense_codons:
+            if c1 == c2:
+                pair_diff[(c1, c2)] = (0, 0)
+            elif forward[c1] == forward[c2]:
+                # 简化判定：氨基酸改变即为非同义差异
+                pair_diff[(c1, c2)] = (1, 0)
+            else:
+                pair_diff[(c1, c2)] = (0, 1)
+    
+    site_syn = np.zeros(N_CODON_CODES, dtype=np.int64)
+    site_nonsyn = np.zeros(N_CODON_CODES, dtype=np.int64)
+    pair_syn = np.zeros((N_CODON_CODES, N_CODON_CODES), dtype=np.int64)
+    pair_nonsyn = np.zeros((N_CODON_CODES, N_CODON_CODES), dtype=np.int64)
+    codon_index = {c: i for i, c in enumerate(ALL_CODONS)}
+    for c, (syn, nonsyn) in sites.items():
+        site_syn[codon_index[c]] = syn
+        site_nonsyn[codon_index[c]] = nonsyn
+    for (c1, c2), (syn, nonsyn) in pair_diff.items():
+        pair_syn[codon_index[c1], codon_index[c2]] = syn
+        pair_nonsyn[codon_index[c1], codon_index[c2]] = nonsyn
+    
+    return {
+        "id": table_id,
+        "codon_table": codon_table,
+        "sites": sites,
+        "pair_diff": pair_diff,
+        "site_syn": site_syn,
+        "site_nonsyn": site_nonsyn,
+        "pair_syn": pair_syn,
+        "pair_nonsyn": pair_nonsyn,
+    }
+
+# 已构建的查找表缓存 {table_id: tables}
+_CODON_TABLES_CACHE = {}
+
+def get_codon_tables(table_id):
+    """获取 (必要时构建) 指定遗传密码表的查找表，每个 ID 只构建一次"""
+    if table_id not in _CODON_TABLES_CACHE:
+        _CODON_TABLES_CACHE[table_id] = build_codon_tables(table_id)
+    return _CODON_TABLES_CACHE[table_id]
+
+# 当前使用的查找表 (模块导入时即构建标准密码表，可通过 set_genetic_code 切换)
+CODON_TABLES = get_codon_tables(1)
+
+def set_genetic_code(table_id):
+    """切换 Ka/Ks 计算与翻译所使用的遗传密码表 (如 2: 脊椎动物线粒体, 11: 细菌/质体)"""
+    global CODON_TABLES
+    CODON_TABLES = get_codon_tables(table_id)
 
 def count_sites(seq):
     """
     计算序列中的潜在同义位点(S_sites)和非同义位点(N_sites)。
+    含 '-'/'N'、终止或无法识别的密码子在查找表中不存在，直接跳过。
     """
-    S_sites = 0
-    N_sites = 0
-    length = len(seq)
+    sites = CODON_TABLES["sites"]
+    S_thirds = 0
+    N_thirds = 0
     
-    for i in range(0, length, 3):
-        codon = seq[i:i+3]
-        if len(codon) < 3 or 'N' in codon or '-' in codon:
+    for i in range(0, len(seq), 3):
+        score = sites.get(seq[i:i+3])
+        if score is None:
             continue
-        
-        # 获取当前氨基酸
-        if codon in STANDARD_TABLE.stop_codons: continue
-        aa = STANDARD_TABLE.forward_table.get(codon, 'X')
-        if aa == 'X': continue
+        S_thirds += score[0]
+        N_thirds += score[1]
 
-        s_score, n_score = get_neighbors_score(codon, aa)
-        S_sites += s_score
-        N_sites += n_score
+    return S_thirds / 3.0, N_thirds / 3.0
 
-    return S_sites, N_sites
+def jc_correction(p):
+    """Jukes-Cantor 校正"""
+    if p >= 0.75: return 5.0 # 饱和上限
+    try:
+        return -0.75 * math.log(1 - (4.0/3.0) * p)
+    except ValueError:
+        return 5.0 # 处理 log 负数情况
 
 def calculate_kaks(seq1, seq2):
     """
@@ -100,114 +213,512 @@ def calculate_kaks(seq1, seq2):
     sd = 0 # 观察到的同义差异
     nd = 0 # 观察到的非同义差异
     
-    # 2. 逐密码子比对
+    # 2. 逐密码子比对 (含缺口、N 或终止密码子的密码子对不在表中，直接跳过)
+    pair_diff = CODON_TABLES["pair_diff"]
     for i in range(0, len(seq1), 3):
-        c1 = seq1[i:i+3]
-        c2 = seq2[i:i+3]
-        
-        if '-' in c1 or '-' in c2 or 'N' in c1 or 'N' in c2: continue
-        
-        # 跳过终止密码子
-        if c1 in STANDARD_TABLE.stop_codons or c2 in STANDARD_TABLE.stop_codons: continue
-        
-        aa1 = STANDARD_TABLE.forward_table.get(c1, 'X')
-        aa2 = STANDARD_TABLE.forward_table.get(c2, 'X')
-        
-        if aa1 == 'X' or aa2 == 'X': continue
-        
-        diffs = sum(1 for j in range(3) if c1[j] != c2[j])
-        if diffs == 0: continue
-        
-        # 简化判定：氨基酸改变即为非同义差异
-        if aa1 == aa2: sd += 1 
-        else: nd += 1 
+        diff = pair_diff.get((seq1[i:i+3], seq2[i:i+3]))
+        if diff is None: continue
+        sd += diff[0]
+        nd += diff[1]
+
+    return kaks_from_counts(S_total, N_total, sd, nd)
+
+def jc_correction_array(p):
+    """jc_correction 的数组版本 (p >= 0.75 视为饱和，取上限 5.0)"""
+    p = np.asarray(p, dtype=np.float64)
+    saturated = p >= 0.75
+    safe_p = np.where(saturated, 0.0, p)
+    return np.where(saturated, 5.0, -0.75 * np.log(1 - (4.0/3.0) * safe_p))
 
+def kaks_from_counts(S_total, N_total, sd, nd):
+    """由位点总数与差异数计算 (Ka, Ks, Pn, Ps)，各计算内核共用"""
     # 3. 计算比率 (P-distance)
     Ps = sd / S_total if S_total > 0 else 0
     Pn = nd / N_total if N_total > 0 else 0
     
     # 4. Jukes-Cantor 校正
-    def jc_correction(p):
-        if p >= 0.75: return 5.0 # 饱和上限
-        try:
-            return -0.75 * math.log(1 - (4.0/3.0) * p)
-        except ValueError:
-            return 5.0 # 处理 log 负数情况
-
     Ks = jc_correction(Ps)
     Ka = jc_correction(Pn)
     
     return Ka, Ks, Pn, Ps
 
+def encode_codons(seq):
+    """
+    将 (比对后的) DNA 序列编码为密码子整数数组 (uint8)。
+    0-63 为 TCAG 顺序的密码子索引；含 '-' 的记为 CODON_GAP，含 N 等其他字符的记为 CODON_AMBIG。
+    末尾不足 3 个碱基的残余部分被忽略 (与逐密码子计算时的处理一致)。
+    """
+    n_codons = len(seq) // 3
+    raw = np.frombuffer(seq[:n_codons * 3].encode('ascii', 'replace'), dtype=np.uint8)
+    bases = _BASE_CODE[raw].reshape(n_codons, 3)
+    
+    codons = (bases[:, 0] * 16 + bases[:, 1] * 4 + bases[:, 2]).astype(np.uint8)
+    codons[(bases > 3).any(axis=1)] = CODON_AMBIG
+    codons[(bases == 4).any(axis=1)] = CODON_GAP
+    return codons
+
+def calculate_kaks_numpy(codons1, codons2):
+    """
+    calculate_kaks 的 NumPy 向量化版本，输入为 encode_codons 的编码结果。
+    位点数与差异数均通过查表 (gather) + 整数求和得到，结果与 calculate_kaks 完全一致。
+    """
+    if len(codons1) != len(codons2): return 0, 0, 0, 0
+    
+    t = CODON_TABLES
+    S_total = (int(t["site_syn"][codons1].sum()) / 3.0 + int(t["site_syn"][codons2].sum()) / 3.0) / 2.0
+    N_total = (int(t["site_nonsyn"][codons1].sum()) / 3.0 + int(t["site_nonsyn"][codons2].sum()) / 3.0) / 2.0
+    
+    if S_total == 0 or N_total == 0: return 0, 0, 0, 0
+    
+    sd = int(t["pair_syn"][codons1, codons2].sum())
+    nd = int(t["pair_nonsyn"][codons1, codons2].sum())
+    
+    return kaks_from_counts(S_total, N_total, sd, nd)
+
 # =========================================================
 # 2. 序列处理与比对工具
 # =========================================================
 
-def check_dependencies():
-    """检查 ClustalW 是否存在"""
-    if not shutil.which("clustalw2"):
+def check_dependencies(aligner="clustalw"):
+    """检查所选比对后端依赖的外部程序是否存在 (内置比对器无需检查)"""
+    if aligner == "clustalw" and not shutil.which("clustalw2"):
         print("[错误] 未在系统路径中找到 'clustalw2'。")
         print("       请安装 ClustalW2 (sudo apt install clustalw 或下载二进制包)。")
         sys.exit(1)
+    if aligner == "mafft" and not shutil.which("mafft"):
+        print("[错误] 未在系统路径中找到 'mafft'。")
+        print("       请安装 MAFFT (sudo apt install mafft 或 conda install -c bioconda mafft)。")
+        sys.exit(1)
 
-def load_fasta(fasta_file):
-    """加载FASTA文件到内存"""
+def load_fasta(fasta_file, needed_ids=None):
+    """
+    加载FASTA文件到内存 (支持 .gz / .bgz / .zst 压缩文件)
+    :param needed_ids: 可选，只保留这些基因 (如 --shard 时本分片用到的基因)；None 表示全部加载
+    """
     seqs = {}
     if not os.path.exists(fasta_file):
         print(f"[错误] 找不到文件: {fasta_file}")
         sys.exit(1)
     
     try:
-        for record in SeqIO.parse(fasta_file, "fasta"):
-            seqs[record.id] = str(record.seq).upper()
+        with pipelineIO.open_text(fasta_file) as handle:
+            for record in SeqIO.parse(handle, "fasta"):
+                if needed_ids is None or record.id in needed_ids:
+                    seqs[record.id] = str(record.seq).upper()
     except Exception as e:
         print(f"[错误] 读取 FASTA 文件失败: {e}")
         sys.exit(1)
     return seqs
 
-def run_alignment_workflow(gene_ids, all_seqs, temp_dir):
+def is_bgzf(path):
+    """判断 gzip 文件是否为 bgzip 格式 (首个成员的额外字段含 BC 子字段)"""
+    with open(path, "rb") as fh:
+        header = fh.read(18)
+    return len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+def load_fasta_indexed(fasta_file, needed_ids):
     """
-    执行：提取DNA -> 翻译蛋白 -> ClustalW比对 -> 回译DNA比对
+    通过磁盘索引按需加载 FASTA：只读取 needed_ids 中出现的序列。
+    索引 (SQLite, 与 FASTA 同目录的 <fasta>.idx) 首次运行时建立，此后直接复用；
+    FASTA 比索引更新时自动重建。内存占用只与所需基因数有关，而与基因组大小无关。
+    压缩文件中只有 bgzip 格式支持随机访问；普通 gzip 与 zstd 文件退化为流式读取所需基因。
+    :return: {基因ID: 大写序列}，仅包含 FASTA 中存在的所需基因
     """
-    prot_fasta = os.path.join(temp_dir, "temp_prot.fasta")
-    prot_aln = os.path.join(temp_dir, "temp_prot.aln")
+    if not os.path.exists(fasta_file):
+        print(f"[错误] 找不到文件: {fasta_file}")
+        sys.exit(1)
+    compression = pipelineIO.compression_of(fasta_file)
+    if compression == "zstd" or (compression == "gzip" and not is_bgzf(fasta_file)):
+        print(f"[信息] {fasta_file} 不是 bgzip 格式，无法建立索引，改为流式读取所需基因")
+        return load_fasta(fasta_file, set(needed_ids))
+    
+    index_file = fasta_file + ".idx"
+    if os.path.exists(index_file) and os.path.getmtime(index_file) < os.path.getmtime(fasta_file):
+        os.remove(index_file)
     
+    try:
+        try:
+            index = SeqIO.index_db(index_file, fasta_file, "fasta")
+        except (OSError, sqlite3.Error):
+            # 索引文件无法写入 (如只读目录)：退化为仅本次运行有效的内存偏移索引
+            index = SeqIO.index(fasta_file, "fasta")
+        
+        seqs = {}
+        for gene_id in needed_ids:
+            if gene_id in index:
+                seqs[gene_id] = str(index[gene_id].seq).upper()
+        index.close()
+    except Exception as e:
+        print(f"[错误] 读取 FASTA 文件失败: {e}")
+        sys.exit(1)
+    return seqs
+
+class SequenceStore:
+    """
+    多个基因组共用的只读 CDS 序列库 (批量模式使用)，可代替 {基因ID: 序列} 字典传入分析函数。
+    目录结构:
+      sequences.bin         全部序列依次拼接 (大写 ASCII)，以内存映射方式读取
+      g<序号>.ids.npy       每个基因组排序后的基因ID；.offsets.npy / .lengths.npy 为对应序列的位置
+      sources.json          基因组名称、来源 FASTA 及其大小与修改时间 (最后写入，标志序列库完整)
+    进程池 worker 反序列化时只重新打开同一组文件，序列数据在系统页缓存中只保留一份。
+    """
+
+    def __init__(self, store_dir, genomes=None):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "sources.json"), encoding="utf-8") as fh:
+            self.sources = json.load(fh)
+        self.genomes = list(self.sources if genomes is None else genomes)
+        for name in self.genomes:
+            if name not in self.sources:
+                raise KeyError(f"序列库中没有基因组 '{name}'")
+        
+        data_file = os.path.join(store_dir, "sequences.bin")
+        # 长度为 0 的文件无法映射
+        if os.path.getsize(data_file) > 0:
+            self._data = np.memmap(data_file, dtype=np.uint8, mode='r')
+        else:
+            self._data = np.zeros(0, dtype=np.uint8)
+        # 后列出的基因组优先，与 {**seqs1, **seqs2} 合并字典时的覆盖顺序一致
+        self._index = []
+        for name in reversed(self.genomes):
+            prefix = os.path.join(store_dir, self.sources[name]["prefix"])
+            self._index.append(tuple(np.load(f"{prefix}.{part}.npy", mmap_mode='r')
+                                     for part in ("ids", "offsets", "lengths")))
+
+    def __getstate__(self):
+        return {"store_dir": self.store_dir, "genomes": self.genomes}
+
+    def __setstate__(self, state):
+        self.__init__(state["store_dir"], state["genomes"])
+
+    def view(self, genomes):
+        """只包含指定基因组的序列库 (共用同一组文件)"""
+        return SequenceStore(self.store_dir, genomes)
+
+    def _locate(self, gene_id):
+        key = gene_id.encode("utf-8")
+        for ids, offsets, lengths in self._index:
+            i = int(np.searchsorted(ids, key))
+            if i < len(ids) and ids[i] == key:
+                return int(offsets[i]), int(lengths[i])
+        return None
+
+    def __contains__(self, gene_id):
+        return self._locate(gene_id) is not None
+
+    def __getitem__(self, gene_id):
+        loc = self._locate(gene_id)
+        if loc is None:
+            raise KeyError(gene_id)
+        offset, length = loc
+        return self._data[offset:offset + length].tobytes().decode("ascii")
+
+    def get(self, gene_id, default=None):
+        return self[gene_id] if gene_id in self else default
+
+    def genome_size(self, name):
+        """基因组中的序列数"""
+        prefix = os.path.join(self.store_dir, self.sources[name]["prefix"])
+        return len(np.load(f"{prefix}.ids.npy", mmap_mode='r'))
+
+    @staticmethod
+    def _source_info(fasta_file):
+        st = os.stat(fasta_file)
+        return {"fasta": os.path.abspath(fasta_file), "size": st.st_size, "mtime": st.st_mtime}
+
+    @classmethod
+    def open_or_build(cls, store_dir, genome_fastas):
+        """
+        打开序列库；不存在、基因组列表不同或任一 FASTA 有改动时重新构建。
+        :param genome_fastas: {基因组名称: CDS FASTA 文件}
+        """
+        for name, fasta_file in genome_fastas.items():
+            if not os.path.exists(fasta_file):
+                print(f"[错误] 找不到基因组 '{name}' 的序列文件: {fasta_file}")
+                sys.exit(1)
+        
+        sources_file = os.path.join(store_dir, "sources.json")
+        if os.path.exists(sources_file):
+            with open(sources_file, encoding="utf-8") as fh:
+                sources = json.load(fh)
+            current = {name: cls._source_info(f) for name, f in genome_fastas.items()}
+            if {name: {k: v for k, v in info.items() if k != "prefix"} for name, info in sources.items()} == current:
+                print(f"[信息] 复用已有序列库: {store_dir}")
+                return cls(store_dir)
+            os.remove(sources_file)
+        
+        print(f"[信息] 正在构建序列库: {store_dir} ({len(genome_fastas)} 个基因组)")
+        os.makedirs(store_dir, exist_ok=True)
+        sources = {}
+        offset = 0
+        with open(os.path.join(store_dir, "sequences.bin"), "wb") as data_fh:
+            for n, (name, fasta_file) in enumerate(genome_fastas.items()):
+                # 逐个基因组加载，峰值内存只与最大的单个基因组有关
+                seqs = load_fasta(fasta_file)
+                ids = np.array([gene_id.encode("utf-8") for gene_id in seqs], dtype=bytes)
+                lengths = np.array([len(seq) for seq in seqs.values()], dtype=np.int64)
+                offsets = offset + np.cumsum(lengths) - lengths
+                for seq in seqs.values():
+                    data_fh.write(seq.encode("ascii"))
+                offset += int(lengths.sum())
+                
+                order = np.argsort(ids, kind="stable")
+                prefix = f"g{n}"
+                for part, values in (("ids", ids), ("offsets", offsets), ("lengths", lengths)):
+                    np.save(os.path.join(store_dir, f"{prefix}.{part}.npy"), values[order])
+                sources[name] = {**cls._source_info(fasta_file), "prefix": prefix}
+                print(f"[信息]   {name}: {len(seqs)} 条序列")
+        with open(sources_file, "w", encoding="utf-8") as fh:
+            json.dump(sources, fh, ensure_ascii=False, indent=2)
+        return cls(store_dir)
+
+def translate_genes(gene_ids, all_seqs):
+    """
+    提取DNA并翻译为蛋白。
+    :return: (蛋白记录列表, {基因ID: DNA序列})；序列缺失、过短或翻译失败时返回 None
+    """
     prot_records = []
     gene_dna_map = {}
     
-    # 1. 翻译
     for uid in gene_ids:
         if uid not in all_seqs:
+            count_metric("skip_missing_sequence")
             return None # 序列缺失
         
         dna = all_seqs[uid]
         try:
-            # table=1 (标准), cds=False (允许非完整CDS), to_stop=True (遇终止子停止)
-            prot_seq = str(Seq(dna).translate(table=1, to_stop=True))
+            # table=当前遗传密码表 (默认1), cds=False (允许非完整CDS), to_stop=True (遇终止子停止)
+            prot_seq = str(Seq(dna).translate(table=CODON_TABLES["id"], to_stop=True))
             if len(prot_seq) < 5: # 忽略极短序列
+                count_metric("skip_short_protein")
                 return None
             
             prot_records.append(SeqRecord(Seq(prot_seq), id=uid, description=""))
             gene_dna_map[uid] = dna
         except Exception:
+            count_metric("skip_translate_error")
             return None
+    
+    return prot_records, gene_dna_map
+
+# ClustalW 命令中影响比对结果的参数 (同时作为比对缓存键的一部分)
+CLUSTALW_OPTIONS = ["-output=FASTA", "-quiet"]
 
+def align_proteins_clustalw(prot_records, temp_dir):
+    """
+    调用 ClustalW 进行蛋白多序列比对。
+    :return: {基因ID: 比对后的蛋白序列}；比对失败时返回 None
+    """
+    prot_fasta = os.path.join(temp_dir, "temp_prot.fasta")
+    prot_aln = os.path.join(temp_dir, "temp_prot.aln")
+    
     SeqIO.write(prot_records, prot_fasta, "fasta")
     
-    # 2. 调用 ClustalW
-    cmd = ["clustalw2", f"-infile={prot_fasta}", f"-outfile={prot_aln}", "-output=FASTA", "-quiet"]
     try:
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        subprocess.run(clustalw_command(prot_fasta, prot_aln), check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     except subprocess.CalledProcessError:
         return None
+    return read_clustalw_output(prot_aln)
 
-    # 3. 回译 (Back-translation)
-    if not os.path.exists(prot_aln): return None
+def clustalw_command(in_file, out_file):
+    return ["clustalw2", f"-infile={in_file}", f"-outfile={out_file}"] + CLUSTALW_OPTIONS
+
+def read_clustalw_output(out_file, stdout=None):
+    """读取 ClustalW 的比对结果文件 (FASTA 格式)；文件不存在时返回 None"""
+    if not os.path.exists(out_file): return None
+    return {prot.id: str(prot.seq) for prot in SeqIO.parse(out_file, "fasta")}
+
+# MAFFT 命令中影响比对结果的参数 (同时作为比对缓存键的一部分)
+MAFFT_OPTIONS = ["--quiet", "--amino"]
+
+def align_proteins_mafft(prot_records, temp_dir):
+    """
+    调用 MAFFT 进行蛋白多序列比对 (比对结果直接从标准输出读取)。
+    :return: {基因ID: 比对后的蛋白序列}；比对失败时返回 None
+    """
+    prot_fasta = os.path.join(temp_dir, "temp_prot.fasta")
+    SeqIO.write(prot_records, prot_fasta, "fasta")
     
+    try:
+        proc = subprocess.run(mafft_command(prot_fasta), check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except subprocess.CalledProcessError:
+        return None
+    return read_mafft_output(None, proc.stdout)
+
+def mafft_command(in_file, out_file=None):
+    return ["mafft"] + MAFFT_OPTIONS + [in_file]
+
+def read_mafft_output(out_file, stdout):
+    """解析 MAFFT 写到标准输出的比对结果 (out_file 未使用)"""
+    aligned = {prot.id: str(prot.seq).upper() for prot in SeqIO.parse(io.StringIO(stdout), "fasta")}
+    return aligned or None
+
+# 内置比对器参数 (与 ClustalW 蛋白比对的默认打分接近；末端缺口不罚分)
+INTERNAL_ALIGNER_OPTIONS = {"matrix": "BLOSUM62", "open_gap_score": -10.0, "extend_gap_score": -0.5}
+
+_PAIRWISE_ALIGNER = None
+
+def get_pairwise_aligner():
+    """构建 (每个进程一次) 内置比对器使用的 PairwiseAligner"""
+    global _PAIRWISE_ALIGNER
+    if _PAIRWISE_ALIGNER is None:
+        aligner = PairwiseAligner()
+        aligner.mode = "global"
+        aligner.substitution_matrix = substitution_matrices.load(INTERNAL_ALIGNER_OPTIONS["matrix"])
+        aligner.open_gap_score = INTERNAL_ALIGNER_OPTIONS["open_gap_score"]
+        aligner.extend_gap_score = INTERNAL_ALIGNER_OPTIONS["extend_gap_score"]
+        aligner.end_gap_score = 0
+        _PAIRWISE_ALIGNER = aligner
+    return _PAIRWISE_ALIGNER
+
+def mask_unknown_residues(seq, alphabet):
+    """将替换矩阵字母表之外的残基 (如 MTT 翻译得到的 J，以及 U/O) 替换为 X，PairwiseAligner 才能打分"""
+    if all(c in alphabet for c in seq):
+        return seq
+    return "".join(c if c in alphabet else "X" for c in seq)
+
+def restore_residues(aligned_row, original):
+    """将比对行中的残基依次换回原始序列中的字符 (缺口位置不变)"""
+    residues = iter(original)
+    return "".join(c if c == '-' else next(residues) for c in aligned_row)
+
+def align_proteins_internal(prot_records, temp_dir=None):
+    """
+    进程内蛋白多序列比对 (中心星渐进合并)，全程在内存中完成，无需外部程序与临时文件。
+    1. 计算所有序列两两的全局比对得分，选取得分之和最高的序列作为中心序列
+    2. 其余序列依次与中心序列做两两比对
+    3. 以中心序列为锚点合并各两两比对 ("一旦为缺口，始终为缺口")
+    替换矩阵之外的残基按 X 参与比对，输出中仍为原始残基。
+    :return: {基因ID: 比对后的蛋白序列}
+    """
+    aligner = get_pairwise_aligner()
+    originals = [str(r.seq) for r in prot_records]
+    alphabet = set(aligner.substitution_matrix.alphabet)
+    seqs = [mask_unknown_residues(seq, alphabet) for seq in originals]
+    n = len(seqs)
+    
+    # 1. 选取中心序列
+    totals = [0.0] * n
+    for i in range(n):
+        for j in range(i + 1, n):
+            score = aligner.score(seqs[i], seqs[j])
+            totals[i] += score
+            totals[j] += score
+    center = max(range(n), key=lambda i: totals[i])
+    center_seq = seqs[center]
+    center_len = len(center_seq)
+    
+    # 2. 与中心序列两两比对，记录每个中心残基之前插入的残基与对齐到中心残基的字符
+    pieces = {}
+    for i in range(n):
+        if i == center:
+            continue
+        aln = aligner.align(center_seq, seqs[i])[0]
+        inserts = [[] for _ in range(center_len + 1)]
+        matched = []
+        pos = 0
+        for c_char, s_char in zip(aln[0], aln[1]):
+            if c_char == '-':
+                inserts[pos].append(s_char)
+            else:
+                matched.append(s_char)
+                pos += 1
+        pieces[i] = (inserts, matched)
+    
+    # 3. 合并：每个插入位置取各两两比对中的最大插入长度
+    widths = [max([len(ins[pos]) for ins, _ in pieces.values()] + [0]) for pos in range(center_len + 1)]
+    
+    aligned = {}
+    for i, record in enumerate(prot_records):
+        row = []
+        for pos in range(center_len + 1):
+            if i == center:
+                row.append('-' * widths[pos])
+                if pos < center_len:
+                    row.append(center_seq[pos])
+            else:
+                inserts, matched = pieces[i]
+                row.append("".join(inserts[pos]).ljust(widths[pos], '-'))
+                if pos < center_len:
+                    row.append(matched[pos])
+        row = "".join(row)
+        aligned[record.id] = row if seqs[i] is originals[i] else restore_residues(row, originals[i])
+    
+    return aligned
+
+# 可选的比对后端：
+# - align:         单个四元组的比对函数
+# - settings:      影响比对结果的设置描述 (作为比对缓存键的一部分)
+# - batch_command: 批量模式下每个作业的 shell 命令模板 (None 表示进程内比对，无需批量调用)
+# - command:       异步调度 (--async-align) 时由 (输入文件, 输出文件) 生成的命令参数列表
+# - read_output:   由 (输出文件, 标准输出文本) 解析比对结果
+ALIGNER_BACKENDS = {
+    "clustalw": {
+        "align": align_proteins_clustalw,
+        "settings": " ".join(["clustalw2"] + CLUSTALW_OPTIONS),
+        "batch_command": "clustalw2 -infile={infile} -outfile={outfile} " + " ".join(CLUSTALW_OPTIONS)
+                         + " > /dev/null 2>&1",
+        "command": clustalw_command,
+        "read_output": read_clustalw_output,
+    },
+    "mafft": {
+        "align": align_proteins_mafft,
+        "settings": " ".join(["mafft"] + MAFFT_OPTIONS),
+        "batch_command": "mafft " + " ".join(MAFFT_OPTIONS) + " {infile} > {outfile} 2> /dev/null",
+        "command": mafft_command,
+        "read_output": read_mafft_output,
+    },
+    "internal": {
+        "align": align_proteins_internal,
+        "settings": "internal center-star " + " ".join(f"{k}={v}" for k, v in sorted(INTERNAL_ALIGNER_OPTIONS.items())),
+        "batch_command": None,
+        "command": None,
+        "read_output": None,
+    },
+}
+
+def align_proteins_batch_external(jobs, temp_dir, command_template):
+    """
+    批量调用外部比对器：整批作业的蛋白 FASTA 写入同一个工作目录，
+    由一个 shell 脚本依次执行全部比对命令，Python 端每批只启动一次子进程。
+    :param jobs: 蛋白记录列表组成的列表 (每个元素对应一个四元组)
+    :return: 与 jobs 等长的列表，元素为 {基因ID: 比对后的蛋白序列} 或 None (该作业比对失败)
+    """
+    batch_dir = tempfile.mkdtemp(prefix="batch_", dir=temp_dir)
+    try:
+        commands = []
+        out_files = []
+        for k, prot_records in enumerate(jobs):
+            in_file = os.path.join(batch_dir, f"job_{k}.fasta")
+            out_file = os.path.join(batch_dir, f"job_{k}.aln")
+            SeqIO.write(prot_records, in_file, "fasta")
+            commands.append(command_template.format(infile=shlex.quote(in_file), outfile=shlex.quote(out_file)))
+            out_files.append(out_file)
+        
+        script = os.path.join(batch_dir, "run_batch.sh")
+        with open(script, 'w', encoding='utf-8') as fh:
+            fh.write("\n".join(commands) + "\n")
+        # 单个作业失败不影响其余作业，失败的作业通过缺失/空的输出文件识别
+        subprocess.run(["sh", script], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        
+        results = []
+        for prot_records, out_file in zip(jobs, out_files):
+            aligned = None
+            if os.path.exists(out_file) and os.path.getsize(out_file) > 0:
+                aligned = {prot.id: str(prot.seq).upper() for prot in SeqIO.parse(out_file, "fasta")}
+                if set(aligned) != {r.id for r in prot_records}:
+                    aligned = None
+            results.append(aligned)
+        return results
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+def back_translate(aligned_prots, gene_dna_map):
+    """回译 (Back-translation)：按蛋白比对中的缺口位置将 CDS 展开为密码子比对"""
     dna_aln = {}
-    for prot in SeqIO.parse(prot_aln, "fasta"):
-        gene_id = prot.id
-        aa_seq = str(prot.seq)
+    for gene_id, aa_seq in aligned_prots.items():
         dna_seq = gene_dna_map[gene_id]
         
         codon_aln = []
@@ -224,14 +735,233 @@ def run_alignment_workflow(gene_ids, all_seqs, temp_dir):
         
     return dna_aln
 
-def bootstrap_resample(dna_alignment, length_codons):
-    """Bootstrap 重采样"""
+def back_translate_codons(aligned_prots, gene_dna_map):
+    """
+    回译为密码子整数比对 (numpy 内核使用)，结果与 encode_codons(back_translate(...)) 相同，但不拼接字符串：
+    每条 CDS 整体编码一次，再按蛋白比对的缺口掩码放入 (序列数, 比对列数) 的 uint8 矩阵。
+    :return: {基因ID: 矩阵中对应的行 (视图)}
+    """
+    gene_ids = list(aligned_prots)
+    masks = [np.frombuffer(aligned_prots[uid].encode('ascii', 'replace'), dtype=np.uint8) != ord('-')
+             for uid in gene_ids]
+    cds_codons = [encode_codons(gene_dna_map[uid]) for uid in gene_ids]
+    if len({len(mask) for mask in masks}) != 1 or \
+            any(np.count_nonzero(mask) > len(codons) for mask, codons in zip(masks, cds_codons)):
+        # 比对行长度不一致或残基数超过 CDS 密码子数 (异常比对)：按字符串回译保持原有行为
+        return as_codon_alignment(back_translate(aligned_prots, gene_dna_map))
+    
+    matrix = np.full((len(gene_ids), len(masks[0])), CODON_GAP, dtype=np.uint8)
+    for row, mask, codons in zip(matrix, masks, cds_codons):
+        row[mask] = codons[:np.count_nonzero(mask)]
+    return dict(zip(gene_ids, matrix))
+
+def as_codon_alignment(aln):
+    """将 {基因ID: 比对后的 DNA 序列} 编码为密码子整数数组；已是数组的比对原样返回"""
+    return {uid: seq if isinstance(seq, np.ndarray) else encode_codons(seq) for uid, seq in aln.items()}
+
+def alignment_codon_length(aln):
+    """比对的密码子列数 (DNA 字符串或密码子数组均可)"""
+    seq = next(iter(aln.values()))
+    return len(seq) if isinstance(seq, np.ndarray) else len(seq) // 3
+
+class AlignmentCache:
+    """
+    基于 SQLite 的持久化比对缓存 (单文件，可在多次参数扫描之间共享)。
+    键为 "比对器设置 + 四条蛋白序列" 的 SHA-256 摘要 (与基因ID无关)，值为按输入顺序排列的比对后蛋白序列。
+    回译只依赖蛋白比对中的缺口位置，因此命中缓存时只需重新回译即可得到密码子比对。
+    总大小超过上限时按最近使用时间 (LRU) 淘汰。
+    为避免每次读写都竞争 SQLite 写锁：
+    - 总大小在打开时读取一次，之后随写入累计；多个进程共用文件时每 RESYNC_PUTS 次写入
+      (以及判断需要淘汰时) 重新统计一次
+    - 命中时只在内存中记录使用时间，随下一次写入、累计满 TOUCH_BATCH 条或 close() 时一并提交
+    """
+
+    RESYNC_PUTS = 256
+    TOUCH_BATCH = 256
+
+    def __init__(self, path, max_mb=1024):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        # 多个 worker 进程可同时访问同一缓存文件：WAL 模式 + 等待锁超时
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS aln_cache ("
+            "key TEXT PRIMARY KEY, aln TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON aln_cache (last_used)")
+        self.conn.commit()
+        self._touched = {}  # 键 -> 尚未提交的最近使用时间
+        self._puts = 0
+        self._total = self._stored_size()
+
+    def _stored_size(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM aln_cache").fetchone()[0]
+
+    def _write_touched(self):
+        """写入缓存的使用时间 (不提交，由调用方提交)"""
+        if self._touched:
+            self.conn.executemany("UPDATE aln_cache SET last_used = ? WHERE key = ?",
+                                  [(used, key) for key, used in self._touched.items()])
+            self._touched = {}
+
+    @staticmethod
+    def make_key(prot_seqs, settings):
+        """由比对器设置与蛋白序列 (按输入顺序) 计算缓存键"""
+        digest = hashlib.sha256(settings.encode('utf-8'))
+        for seq in prot_seqs:
+            digest.update(b"\n" + seq.encode('ascii'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """查询缓存，命中时返回比对后的蛋白序列列表并记录其使用时间 (批量提交)"""
+        row = self.conn.execute("SELECT aln FROM aln_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched[key] = time.time()
+        if len(self._touched) >= self.TOUCH_BATCH:
+            self._write_touched()
+            self.conn.commit()
+        return row[0].split("\n")
+
+    def put(self, key, aligned_seqs):
+        """写入缓存，并在超出大小上限时淘汰最久未使用的条目"""
+        aln = "\n".join(aligned_seqs)
+        self._write_touched()
+        self.conn.execute("INSERT OR REPLACE INTO aln_cache (key, aln, size, last_used) VALUES (?, ?, ?, ?)",
+                          (key, aln, len(aln), time.time()))
+        self._total += len(aln)
+        self._puts += 1
+        if self._puts % self.RESYNC_PUTS == 0 or self._total > self.max_bytes:
+            # 其他进程也可能写入同一文件，累计值只作估计；需要淘汰前以实际总大小为准
+            self._total = self._stored_size()
+        if self._total > self.max_bytes:
+            total = self._total
+            # 按使用时间从旧到新删除，直到总大小回落到上限的 90% 以下 (避免每次写入都触发淘汰)
+            target = total - int(self.max_bytes * 0.9)
+            freed = 0
+            stale = []
+            for old_key, size in self.conn.execute("SELECT key, size FROM aln_cache ORDER BY last_used"):
+                if freed >= target:
+                    break
+                stale.append((old_key,))
+                freed += size
+            self.conn.executemany("DELETE FROM aln_cache WHERE key = ?", stale)
+            self._total -= freed
+        self.conn.commit()
+
+    def close(self):
+        self._write_touched()
+        self.conn.commit()
+        self.conn.close()
+
+def run_alignment_workflow(gene_ids, all_seqs, temp_dir, aln_cache=None, aligner="clustalw", codons=False):
+    """
+    执行：提取DNA -> 翻译蛋白 -> 蛋白比对 -> 回译DNA比对
+    :param aln_cache: 可选的 AlignmentCache；命中时跳过比对
+    :param aligner: 比对后端名称 (见 ALIGNER_BACKENDS)
+    :param codons: True 时直接回译为密码子整数数组 (见 back_translate_codons)，否则为 DNA 字符串
+    """
+    backend = ALIGNER_BACKENDS[aligner]
+    
+    # 1. 翻译
+    with phase("translate"):
+        translated = translate_genes(gene_ids, all_seqs)
+    if translated is None:
+        return None
+    prot_records, gene_dna_map = translated
+    
+    # 2. 蛋白比对 (优先查询缓存)
+    with phase("align"):
+        cache_key, aligned_prots = lookup_cached_alignment(aln_cache, prot_records, backend["settings"])
+        if aligned_prots is None:
+            aligned_prots = backend["align"](prot_records, temp_dir)
+            if aligned_prots is not None and aln_cache is not None:
+                aln_cache.put(cache_key, [aligned_prots[r.id] for r in prot_records])
+    if aligned_prots is None:
+        count_metric("skip_align_failed")
+        return None
+
+    # 3. 回译 (Back-translation)
+    translate_back = back_translate_codons if codons else back_translate
+    with phase("back_translate"):
+        return translate_back(aligned_prots, gene_dna_map)
+
+def lookup_cached_alignment(aln_cache, prot_records, settings):
+    """
+    查询比对缓存。
+    :return: (缓存键, {基因ID: 比对后的蛋白序列} 或 None)；未启用缓存时返回 (None, None)
+    """
+    if aln_cache is None:
+        return None, None
+    cache_key = AlignmentCache.make_key([str(r.seq) for r in prot_records], settings)
+    cached = aln_cache.get(cache_key)
+    if cached is None:
+        return cache_key, None
+    return cache_key, {r.id: aa_seq for r, aa_seq in zip(prot_records, cached)}
+
+def run_alignment_batch(batch_gene_ids, all_seqs, temp_dir, aln_cache=None, aligner="clustalw", codons=False):
+    """
+    批量版本的 run_alignment_workflow：先翻译整批并查询缓存，
+    未命中的作业通过 align_proteins_batch_external 一次性交给外部比对器。
+    :param batch_gene_ids: 每个四元组的基因ID列表组成的列表
+    :param codons: True 时回译为密码子整数数组 (同 run_alignment_workflow)
+    :return: 与输入等长的列表，元素为回译后的 DNA 比对字典或 None
+    """
+    backend = ALIGNER_BACKENDS[aligner]
+    translate_back = back_translate_codons if codons else back_translate
+    results = [None] * len(batch_gene_ids)
+    pending = [] # (下标, 蛋白记录, DNA 映射, 缓存键)
+    
+    for idx, gene_ids in enumerate(batch_gene_ids):
+        with phase("translate"):
+            translated = translate_genes(gene_ids, all_seqs)
+        if translated is None:
+            continue
+        prot_records, gene_dna_map = translated
+        with phase("align"):
+            cache_key, aligned_prots = lookup_cached_alignment(aln_cache, prot_records, backend["settings"])
+        if aligned_prots is not None:
+            with phase("back_translate"):
+                results[idx] = translate_back(aligned_prots, gene_dna_map)
+        else:
+            pending.append((idx, prot_records, gene_dna_map, cache_key))
+    
+    if not pending:
+        return results
+    
+    jobs = [prot_records for _, prot_records, _, _ in pending]
+    with phase("align"):
+        if backend["batch_command"] is None:
+            aligned_list = [backend["align"](prot_records, temp_dir) for prot_records in jobs]
+        else:
+            aligned_list = align_proteins_batch_external(jobs, temp_dir, backend["batch_command"])
+    
+    for (idx, prot_records, gene_dna_map, cache_key), aligned_prots in zip(pending, aligned_list):
+        if aligned_prots is None:
+            count_metric("skip_align_failed")
+            continue
+        if aln_cache is not None:
+            aln_cache.put(cache_key, [aligned_prots[r.id] for r in prot_records])
+        with phase("back_translate"):
+            results[idx] = translate_back(aligned_prots, gene_dna_map)
+    
+    return results
+
+def bootstrap_resample(dna_alignment, length_codons, rng=None):
+    """
+    Bootstrap 重采样
+    :param rng: 可选的 random.Random 实例 (用于可复现的抽样)，默认使用全局随机数
+    """
     ids = list(dna_alignment.keys())
     new_aln = {i: "" for i in ids}
     cols = list(range(length_codons))
     
     # 有放回随机抽样
-    sampled_cols = random.choices(cols, k=length_codons)
+    sampled_cols = (rng or random).choices(cols, k=length_codons)
     
     for idx in sampled_cols:
         start = idx * 3
@@ -240,11 +970,1453 @@ def bootstrap_resample(dna_alignment, length_codons):
             
     return new_aln
 
+def bootstrap_resample_codons(codon_alignment, length_codons, rng=None):
+    """Bootstrap 重采样 (encode_codons 编码后的比对，按列下标直接取样)"""
+    # 与 bootstrap_resample 使用相同的随机抽样方式
+    sampled_cols = (rng or random).choices(range(length_codons), k=length_codons)
+    return {gene_id: codons[sampled_cols] for gene_id, codons in codon_alignment.items()}
+
+def codon_contributions(codons1, codons2):
+    """
+    计算一对编码序列每个比对列 (密码子) 对 Ka/Ks 统计量的贡献。
+    :return: (L, 6) 数组，列依次为 同义位点1、同义位点2、非同义位点1、非同义位点2 (均为三分之一位点)、
+             同义差异、非同义差异。任意列子集 (含重复) 的统计量即为对应行的加权和。
+    """
+    t = CODON_TABLES
+    return np.stack([
+        t["site_syn"][codons1], t["site_syn"][codons2],
+        t["site_nonsyn"][codons1], t["site_nonsyn"][codons2],
+        t["pair_syn"][codons1, codons2], t["pair_nonsyn"][codons1, codons2],
+    ], axis=1).astype(np.float64)
+
+def ks_from_totals(totals):
+    """
+    由 codon_contributions 的加权和 (..., 6) 批量计算 Ks，公式与 calculate_kaks 一致。
+    位点数为 0 时 Ks 记为 0 (与 calculate_kaks 的返回值相同)。
+    """
+    S_total = (totals[..., 0] / 3.0 + totals[..., 1] / 3.0) / 2.0
+    N_total = (totals[..., 2] / 3.0 + totals[..., 3] / 3.0) / 2.0
+    valid = (S_total != 0) & (N_total != 0)
+    Ps = totals[..., 4] / np.where(valid, S_total, 1.0)
+    return np.where(valid, jc_correction_array(Ps), 0.0)
+
+def bootstrap_support_classic(aln, aln_len, pairs, boot, kaks_fn, resample_fn, check_sp1, check_sp2, rng=None):
+    """
+    逐次重建重采样比对并重新计算 Ks 的 Bootstrap。
+    :param aln_len: 比对长度 (密码子数)
+    :param rng: 可选的 random.Random 实例
+    :return: (物种1 支持次数, 物种2 支持次数)
+    """
+    boot_sup_sp1 = 0
+    boot_sup_sp2 = 0
+    
+    for _ in range(boot):
+        res_aln = resample_fn(aln, aln_len, rng)
+        
+        # 快速计算无需全部计算，只需计算必要的
+        b_ks_p1 = kaks_fn(res_aln[pairs["P1"][0]], res_aln[pairs["P1"][1]])[1]
+        b_ks_p2 = kaks_fn(res_aln[pairs["P2"][0]], res_aln[pairs["P2"][1]])[1]
+        b_ks_o1 = kaks_fn(res_aln[pairs["O1"][0]], res_aln[pairs["O1"][1]])[1]
+        b_ks_o2 = kaks_fn(res_aln[pairs["O2"][0]], res_aln[pairs["O2"][1]])[1]
+        
+        if check_sp1 and (b_ks_p1 < b_ks_o1 and b_ks_p1 < b_ks_o2):
+            boot_sup_sp1 += 1
+        if check_sp2 and (b_ks_p2 < b_ks_o1 and b_ks_p2 < b_ks_o2):
+            boot_sup_sp2 += 1
+    
+    return boot_sup_sp1, boot_sup_sp2
+
+def bootstrap_contributions(codon_aln, pairs):
+    """四个比较组 (P1, P2, O1, O2) 的逐列贡献，拼接为 (L, 24) 矩阵"""
+    order = ["P1", "P2", "O1", "O2"]
+    return np.concatenate(
+        [codon_contributions(codon_aln[pairs[k][0]], codon_aln[pairs[k][1]]) for k in order], axis=1)
+
+def bootstrap_support_indexed(contrib, boot, check_sp1, check_sp2, batch_size=256, rng=None):
+    """
+    基于列贡献矩阵的 Bootstrap：不重建比对字符串。
+    四个比较组的逐列贡献只计算一次 (bootstrap_contributions)；每次重采样等价于一个多项分布的列计数向量，
+    一批重复即为 (batch x L) 计数矩阵与贡献矩阵的一次矩阵乘法。
+    :param rng: 可选的 numpy.random.Generator
+    :return: (物种1 支持次数, 物种2 支持次数)
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    aln_len = contrib.shape[0]
+    if aln_len == 0:
+        return 0, 0
+    col_prob = np.full(aln_len, 1.0 / aln_len)
+    
+    boot_sup_sp1 = 0
+    boot_sup_sp2 = 0
+    remaining = boot
+    while remaining > 0:
+        n = min(batch_size, remaining)
+        remaining -= n
+        
+        counts = rng.multinomial(aln_len, col_prob, size=n).astype(np.float64)
+        # (n, 24) -> (n, 4, 6)：每个比较组 6 个统计量的加权和 (均为整数，浮点矩阵乘法无舍入误差)
+        totals = (counts @ contrib).reshape(n, 4, 6)
+        ks = ks_from_totals(totals)
+        b_ks_p1, b_ks_p2, b_ks_o1, b_ks_o2 = ks[:, 0], ks[:, 1], ks[:, 2], ks[:, 3]
+        
+        if check_sp1:
+            boot_sup_sp1 += int(np.count_nonzero((b_ks_p1 < b_ks_o1) & (b_ks_p1 < b_ks_o2)))
+        if check_sp2:
+            boot_sup_sp2 += int(np.count_nonzero((b_ks_p2 < b_ks_o1) & (b_ks_p2 < b_ks_o2)))
+    
+    return boot_sup_sp1, boot_sup_sp2
+
+def scan_windows(contrib, sizes, step=None, boot=0, batch_size=256, rng=None):
+    """
+    滑动窗口扫描部分基因置换：在每个窗口内比较旁系与直系的 Ks。
+    窗口统计量由逐列贡献的前缀和相减得到，每种窗口大小的扫描为 O(L)，无需对窗口切片重新计算 Ka/Ks；
+    只对满足 Ks_旁系 < 两个 Ks_直系 的窗口，在窗口内的列上做 Bootstrap (同 bootstrap_support_indexed)。
+    :param contrib: bootstrap_contributions 的 (L, 24) 逐列贡献矩阵
+    :param sizes: 窗口大小 (密码子数) 列表
+    :param step: 步长；None 表示窗口大小的一半。最后一个窗口总是对齐比对末端
+    :return: [(物种 1/2, 窗口大小, 起点, 终点 (不含), Ks_旁系, Ks_直系1, Ks_直系2, Bootstrap 支持率), ...]
+    """
+    aln_len = contrib.shape[0]
+    prefix = np.zeros((aln_len + 1, contrib.shape[1]))
+    np.cumsum(contrib, axis=0, out=prefix[1:])
+    
+    windows = []
+    for size in sizes:
+        if size > aln_len:
+            continue
+        starts = np.arange(0, aln_len - size + 1, step or max(1, size // 2))
+        if starts[-1] != aln_len - size:
+            starts = np.append(starts, aln_len - size)
+        ks = ks_from_totals((prefix[starts + size] - prefix[starts]).reshape(-1, 4, 6))
+        ks_p1, ks_p2, ks_o1, ks_o2 = ks[:, 0], ks[:, 1], ks[:, 2], ks[:, 3]
+        for species, ks_para in ((1, ks_p1), (2, ks_p2)):
+            for i in np.flatnonzero((ks_para < ks_o1) & (ks_para < ks_o2)):
+                start = int(starts[i])
+                support = 0.0
+                if boot > 0:
+                    sup_sp1, sup_sp2 = bootstrap_support_indexed(
+                        contrib[start:start + size], boot, species == 1, species == 2, batch_size=batch_size, rng=rng)
+                    support = (sup_sp1 if species == 1 else sup_sp2) / boot
+                # + 0.0 将 -0.0 规范为 0.0
+                windows.append((species, size, start, start + size,
+                                float(ks_para[i]) + 0.0, float(ks_o1[i]) + 0.0, float(ks_o2[i]) + 0.0, support))
+    return windows
+
+def bootstrap_support_pairwise_classic(pair_alns, boot, kaks_fn, resample_fn, check_sp1, check_sp2, rng=None):
+    """
+    逐对比对模式的 Bootstrap：四个比较组各有独立的两两比对，每次重复对每个比较组分别重采样。
+    :param pair_alns: 按 P1, P2, O1, O2 顺序的 [(两序列比对字典, 比对长度, 基因1, 基因2), ...]
+    :return: (物种1 支持次数, 物种2 支持次数)
+    """
+    boot_sup_sp1 = 0
+    boot_sup_sp2 = 0
+    
+    for _ in range(boot):
+        ks = []
+        for aln, aln_len, u1, u2 in pair_alns:
+            res_aln = resample_fn(aln, aln_len, rng)
+            ks.append(kaks_fn(res_aln[u1], res_aln[u2])[1])
+        b_ks_p1, b_ks_p2, b_ks_o1, b_ks_o2 = ks
+        
+        if check_sp1 and (b_ks_p1 < b_ks_o1 and b_ks_p1 < b_ks_o2):
+            boot_sup_sp1 += 1
+        if check_sp2 and (b_ks_p2 < b_ks_o1 and b_ks_p2 < b_ks_o2):
+            boot_sup_sp2 += 1
+    
+    return boot_sup_sp1, boot_sup_sp2
+
+def bootstrap_support_pairwise_indexed(contribs, boot, check_sp1, check_sp2, batch_size=256, rng=None):
+    """
+    逐对比对模式的列贡献 Bootstrap：每个比较组按各自的比对长度独立抽取多项分布列计数。
+    :param contribs: 按 P1, P2, O1, O2 顺序的 codon_contributions 结果 [(L_k, 6), ...]
+    :return: (物种1 支持次数, 物种2 支持次数)
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    if any(contrib.shape[0] == 0 for contrib in contribs):
+        return 0, 0
+    
+    boot_sup_sp1 = 0
+    boot_sup_sp2 = 0
+    remaining = boot
+    while remaining > 0:
+        n = min(batch_size, remaining)
+        remaining -= n
+        
+        ks = []
+        for contrib in contribs:
+            aln_len = contrib.shape[0]
+            counts = rng.multinomial(aln_len, np.full(aln_len, 1.0 / aln_len), size=n).astype(np.float64)
+            ks.append(ks_from_totals(counts @ contrib))
+        b_ks_p1, b_ks_p2, b_ks_o1, b_ks_o2 = ks
+        
+        if check_sp1:
+            boot_sup_sp1 += int(np.count_nonzero((b_ks_p1 < b_ks_o1) & (b_ks_p1 < b_ks_o2)))
+        if check_sp2:
+            boot_sup_sp2 += int(np.count_nonzero((b_ks_p2 < b_ks_o1) & (b_ks_p2 < b_ks_o2)))
+    
+    return boot_sup_sp1, boot_sup_sp2
+
+def wilson_interval(successes, n, alpha=0.05):
+    """支持比例的 Wilson 置信区间"""
+    if n == 0:
+        return 0.0, 1.0
+    z = statistics.NormalDist().inv_cdf(1 - alpha / 2)
+    p = successes / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return center - half, center + half
+
+def run_bootstrap(run_round, boot, check_sp1, check_sp2, adaptive=False,
+                  threshold=0.95, alpha=0.05, min_reps=20, step=20):
+    """
+    执行 Bootstrap (固定次数或自适应提前停止)。
+    :param run_round: 函数 run_round(n) -> (物种1 支持次数, 物种2 支持次数)，执行 n 次重复
+    :param adaptive: 为 True 时每 step 次重复检查一次：待检验物种支持率的置信区间
+                     全部落在 threshold 之上或之下 (且已达到 min_reps 次) 即停止
+    :return: (物种1 支持次数, 物种2 支持次数, 实际重复次数)
+    """
+    if not adaptive:
+        boot_sup_sp1, boot_sup_sp2 = run_round(boot)
+        return boot_sup_sp1, boot_sup_sp2, boot
+    
+    def decided(successes, n):
+        low, high = wilson_interval(successes, n, alpha)
+        return low > threshold or high < threshold
+    
+    boot_sup_sp1 = 0
+    boot_sup_sp2 = 0
+    n_done = 0
+    while n_done < boot:
+        n = min(step, boot - n_done)
+        sup1, sup2 = run_round(n)
+        boot_sup_sp1 += sup1
+        boot_sup_sp2 += sup2
+        n_done += n
+        if n_done >= min_reps and \
+                (not check_sp1 or decided(boot_sup_sp1, n_done)) and \
+                (not check_sp2 or decided(boot_sup_sp2, n_done)):
+            break
+    return boot_sup_sp1, boot_sup_sp2, n_done
+
+def quartet_seed(seed, quartet):
+    """由全局种子与四元组基因ID派生该四元组的随机种子 (与处理顺序、进程数无关)"""
+    key = "\t".join([str(seed)] + list(quartet))
+    digest = hashlib.sha256(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], "big")
+
 # =========================================================
-# 3. 主程序
+# 3. 四元组分析与并行调度
 # =========================================================
 
+# 输出表头 (顺序与 format_row 保持一致)
+RESULT_HEADERS = [
+    "QuartetID", 
+    "Ka_P1", "Ks_P1", "Ka_P2", "Ks_P2", 
+    "Ka_O1", "Ks_O1", "Ka_O2", "Ks_O2",
+    "Conv_Sp1(Para<Ortho)", "Conv_Sp2(Para<Ortho)", 
+    "Boot_Prob_Sp1", "Boot_Prob_Sp2"
+]
+
+def iter_quartets(quartet_file):
+    """
+    逐行读取四元组文件 (支持压缩文件)。
+    :return: 生成器，依次产出 (Para1, Ortho1, Para2, Ortho2) 元组 (保持文件顺序)
+    """
+    with pipelineIO.open_text(quartet_file) as qf:
+        for line in qf:
+            line = line.strip()
+            if not line or line.startswith("#"): continue
+            
+            parts = line.split()
+            if len(parts) < 4: continue
+            
+            # 假定格式: Para1 Ortho1 Para2 Ortho2
+            # 对应: Lso1 Lma1 Lso2 Lma2
+            yield parts[0], parts[1], parts[2], parts[3]
+
+def collect_quartet_gene_ids(quartets):
+    """收集四元组中出现的全部基因ID"""
+    gene_ids = set()
+    for quartet in quartets:
+        gene_ids.update(quartet)
+    return gene_ids
+
+def parse_shard(shard_arg):
+    """解析 --shard "i/N" (i 从 0 开始)，返回 (i, N)；格式错误时退出"""
+    try:
+        index, total = (int(x) for x in shard_arg.split("/"))
+    except ValueError:
+        index, total = -1, 0
+    if total < 1 or not 0 <= index < total:
+        print(f"[错误] --shard 格式应为 i/N (0 <= i < N)，例如 0/8: {shard_arg}")
+        sys.exit(1)
+    return index, total
+
+def shard_of(quartet, total):
+    """按 QuartetID 的稳定哈希 (与行序、进程、Python 版本无关) 确定四元组所属分片"""
+    quartet_id = f"{quartet[0]}-{quartet[2]}"
+    digest = hashlib.sha256(quartet_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], "big") % total
+
+def iter_shard_quartets(quartets, shard):
+    """只产出属于分片 shard = (i, N) 的四元组；shard 为 None 时原样产出"""
+    if shard is None:
+        yield from quartets
+        return
+    index, total = shard
+    for quartet in quartets:
+        if shard_of(quartet, total) == index:
+            yield quartet
+
+# --screen-k 的上限：k 过大时几乎没有共享 k-mer，距离估计失去意义
+MAX_SCREEN_K = 32
+
+def kmer_set(seq, k):
+    """序列中全部长度为 k 的子串集合"""
+    return {seq[i:i+k] for i in range(len(seq) - k + 1)}
+
+def mash_distance(kmers1, kmers2, k):
+    """
+    由 k-mer 集合的 Jaccard 指数估计每位点替换率 (Mash 距离): D = -ln(2J/(1+J)) / k。
+    没有共享 k-mer 时返回 inf (视为完全饱和)。
+    """
+    shared = len(kmers1 & kmers2)
+    if shared == 0:
+        return math.inf
+    jaccard = shared / len(kmers1 | kmers2)
+    return -math.log(2 * jaccard / (1 + jaccard)) / k
+
+def screen_distances(quartet, all_seqs, k):
+    """
+    不比对，直接由 CDS 的 k-mer 估计四个比较组的距离 (作为 Ks 的快速近似)。
+    :return: {"P1"/"P2"/"O1"/"O2": 距离}；序列缺失时返回 None
+    """
+    id_p1_a, id_o1, id_p1_b, id_o2 = quartet
+    if any(uid not in all_seqs for uid in quartet):
+        return None
+    kmers = {uid: kmer_set(all_seqs[uid], k) for uid in quartet}
+    pairs = {
+        "P1": (id_p1_a, id_p1_b),
+        "P2": (id_o1, id_o2),
+        "O1": (id_p1_a, id_o1),
+        "O2": (id_p1_b, id_o2)
+    }
+    return {key: mash_distance(kmers[u1], kmers[u2], k) for key, (u1, u2) in pairs.items()}
+
+def screen_quartet(quartet, all_seqs, args):
+    """
+    快速筛选：仅当某个物种的旁系距离可能小于两个直系距离时 (允许 --screen-margin 的相对余量)，
+    四元组才进入完整的比对与 Bootstrap 流程。
+    :return: None 表示通过筛选 (或无法筛选)；未通过时返回标记为已筛除的结果字典
+    """
+    with phase("screen"):
+        dist = screen_distances(quartet, all_seqs, args.screen_k)
+    if dist is None:
+        return None
+    
+    limit = min(dist["O1"], dist["O2"]) * (1 + args.screen_margin)
+    if dist["P1"] <= limit or dist["P2"] <= limit:
+        return None
+    
+    count_metric("screened_out")
+    id_p1_a, _, id_p1_b, _ = quartet
+    return {
+        "quartet_id": f"{id_p1_a}-{id_p1_b}",
+        "stats": None,
+        "conv_sp1": False,
+        "conv_sp2": False,
+        "prob_sp1": 0.0,
+        "prob_sp2": 0.0,
+        "boot_reps": 0,
+        "screened": True,
+    }
+
+class PairResultCache:
+    """
+    基因对结果的进程内 LRU 缓存 (逐对比对模式)。
+    键为排序后的 (基因A, 基因B)；值为该基因对的两两比对与 Ka/Ks 结果 (见 compute_pair_result)。
+    同一基因对出现在多个四元组中时只比对、计算一次。
+    """
+
+    def __init__(self, max_pairs=200000):
+        self.max_pairs = max(1, int(max_pairs))
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        # 批量预取的条目首次取用时已计入 misses，不算作命中
+        if not entry.pop("prefetched", False):
+            self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_pairs:
+            self.entries.popitem(last=False)
+
+def compute_pair_result(key, all_seqs, temp_dir, args, aln_cache=None):
+    """
+    对一个基因对做两两密码子比对并计算 Ka/Ks。
+    :param key: 排序后的 (基因A, 基因B)
+    :return: {"aln": 比对 (按 --kernel 为字符串或密码子编码), "len": 密码子数, "kaks": (Ka, Ks, Pn, Ps),
+              "contrib": indexed Bootstrap 的逐列贡献 (首次需要时计算)}；失败时返回 None
+    """
+    dna_aln = run_alignment_workflow(list(key), all_seqs, temp_dir, aln_cache, args.aligner,
+                                     codons=args.kernel == "numpy")
+    if not dna_aln:
+        return None
+    return make_pair_result(key, dna_aln, args)
+
+def make_pair_result(key, dna_aln, args):
+    """由基因对的 DNA 比对构建缓存条目 (格式见 compute_pair_result)"""
+    with phase("kaks"):
+        if args.kernel == "numpy":
+            aln = as_codon_alignment(dna_aln)
+            kaks = calculate_kaks_numpy(aln[key[0]], aln[key[1]])
+        else:
+            aln = dna_aln
+            kaks = calculate_kaks(aln[key[0]], aln[key[1]])
+    return {"aln": aln, "len": alignment_codon_length(aln), "kaks": kaks, "contrib": None}
+
+def prefetch_pair_results(batch, all_seqs, temp_dir, args, aln_cache, pair_cache):
+    """
+    逐对比对模式的批量预取：收集一批四元组中尚未缓存的基因对，整批只调用一次外部比对器，
+    结果写入 pair_cache，随后逐个四元组分析时即可全部命中。
+    """
+    missing = []
+    for quartet in batch:
+        id_p1_a, id_o1, id_p1_b, id_o2 = quartet
+        for pair in ((id_p1_a, id_p1_b), (id_o1, id_o2), (id_p1_a, id_o1), (id_p1_b, id_o2)):
+            key = tuple(sorted(pair))
+            if key not in pair_cache.entries and key not in missing:
+                missing.append(key)
+    if not missing:
+        return
+    alignments = run_alignment_batch([list(key) for key in missing], all_seqs, temp_dir, aln_cache, args.aligner,
+                                     codons=args.kernel == "numpy")
+    for key, dna_aln in zip(missing, alignments):
+        if dna_aln:
+            entry = make_pair_result(key, dna_aln, args)
+            entry["prefetched"] = True
+            pair_cache.misses += 1
+            pair_cache.put(key, entry)
+
+def pair_contributions(entry, key):
+    """基因对的逐列贡献 (L, 6)，计算一次后保存在缓存条目中"""
+    if entry["contrib"] is None:
+        aln = as_codon_alignment(entry["aln"])
+        entry["contrib"] = codon_contributions(aln[key[0]], aln[key[1]])
+    return entry["contrib"]
+
+def analyze_quartet_pairwise(quartet, all_seqs, temp_dir, args, aln_cache=None, pair_cache=None):
+    """
+    逐对比对模式：四个比较组各自做两两比对，基因对的比对与 Ka/Ks 结果经 pair_cache 复用。
+    Bootstrap 对每个比较组的比对分别独立重采样。
+    :return: 结果字典 (格式同 analyze_alignment)；任一基因对比对失败时返回 None
+    """
+    id_p1_a, id_o1, id_p1_b, id_o2 = quartet
+    pairs = {
+        "P1": (id_p1_a, id_p1_b),
+        "P2": (id_o1, id_o2),
+        "O1": (id_p1_a, id_o1),
+        "O2": (id_p1_b, id_o2)
+    }
+    
+    entries = {}
+    for k, pair in pairs.items():
+        key = tuple(sorted(pair))
+        entry = pair_cache.get(key) if pair_cache is not None else None
+        if entry is None:
+            entry = compute_pair_result(key, all_seqs, temp_dir, args, aln_cache)
+            if entry is None:
+                return None
+            if pair_cache is not None:
+                pair_cache.put(key, entry)
+        entries[k] = (key, entry)
+    
+    # Ka/Ks 对两条序列对称，直接使用缓存结果
+    stats = {k: entry["kaks"] for k, (key, entry) in entries.items()}
+    ks_p1, ks_p2, ks_o1, ks_o2 = (stats[k][1] for k in ("P1", "P2", "O1", "O2"))
+    is_conv_sp1 = (ks_p1 < ks_o1 and ks_p1 < ks_o2)
+    is_conv_sp2 = (ks_p2 < ks_o1 and ks_p2 < ks_o2)
+    
+    boot_sup_sp1 = 0
+    boot_sup_sp2 = 0
+    boot_reps = 0
+    
+    if is_conv_sp1 or is_conv_sp2:
+        seed = quartet_seed(args.seed, quartet) if args.seed is not None else None
+        order = [entries[k] for k in ("P1", "P2", "O1", "O2")]
+        if args.boot_engine == "indexed":
+            contribs = [pair_contributions(entry, key) for key, entry in order]
+            np_rng = np.random.default_rng(seed)
+            run_round = lambda n: bootstrap_support_pairwise_indexed(
+                contribs, n, is_conv_sp1, is_conv_sp2, batch_size=args.boot_batch, rng=np_rng)
+        else:
+            if args.kernel == "numpy":
+                kaks_fn, resample_fn = calculate_kaks_numpy, bootstrap_resample_codons
+            else:
+                kaks_fn, resample_fn = calculate_kaks, bootstrap_resample
+            pair_alns = [(entry["aln"], entry["len"], key[0], key[1]) for key, entry in order]
+            py_rng = random.Random(seed) if seed is not None else None
+            run_round = lambda n: bootstrap_support_pairwise_classic(
+                pair_alns, n, kaks_fn, resample_fn, is_conv_sp1, is_conv_sp2, rng=py_rng)
+        
+        with phase("bootstrap"):
+            boot_sup_sp1, boot_sup_sp2, boot_reps = run_bootstrap(
+                run_round, args.boot, is_conv_sp1, is_conv_sp2, adaptive=args.boot_adaptive,
+                threshold=args.boot_threshold, alpha=args.boot_alpha, min_reps=args.boot_min, step=args.boot_step)
+    
+    return {
+        "quartet_id": f"{id_p1_a}-{id_p1_b}",
+        "stats": stats,
+        "conv_sp1": is_conv_sp1,
+        "conv_sp2": is_conv_sp2,
+        "prob_sp1": boot_sup_sp1 / boot_reps if is_conv_sp1 and boot_reps > 0 else 0.0,
+        "prob_sp2": boot_sup_sp2 / boot_reps if is_conv_sp2 and boot_reps > 0 else 0.0,
+        "boot_reps": boot_reps,
+    }
+
+def analyze_quartet(quartet, all_seqs, temp_dir, args, aln_cache=None, pair_cache=None):
+    """
+    对单个四元组执行 比对 -> Ka/Ks -> 置换判定 -> Bootstrap 验证。
+    :param quartet: (Para1, Ortho1, Para2, Ortho2)
+    :param temp_dir: 本次比对专用的临时目录 (并行时每个进程独占一个)
+    :param args: 命令行参数 (使用其中的 boot 等运行选项)
+    :param aln_cache: 可选的 AlignmentCache (每个进程各自打开)
+    :param pair_cache: 逐对比对模式 (--pairwise) 的 PairResultCache
+    :return: 结果字典；序列缺失或比对失败时返回 None
+    """
+    # 快速筛选：未通过的四元组不进行比对
+    if args.screen:
+        screened = screen_quartet(quartet, all_seqs, args)
+        if screened is not None:
+            return screened
+    
+    if args.pairwise:
+        return analyze_quartet_pairwise(quartet, all_seqs, temp_dir, args, aln_cache, pair_cache)
+    
+    # 执行比对流程
+    dna_aln = run_alignment_workflow(quartet_alignment_ids(quartet), all_seqs, temp_dir, aln_cache, args.aligner,
+                                     codons=args.kernel == "numpy")
+    if not dna_aln:
+        return None
+    return analyze_alignment(quartet, dna_aln, args)
+
+def analyze_batch(batch, all_seqs, temp_dir, args, aln_cache=None, pair_cache=None):
+    """
+    批量分析一组四元组：整批比对只调用一次外部比对器，随后逐个计算。
+    逐对比对模式下整批预取尚未缓存的基因对，再逐个四元组组装结果。
+    :return: 与 batch 等长的结果列表 (失败的四元组为 None)
+    """
+    # 快速筛选：未通过的四元组直接得到结果，其余的整批比对
+    screened = [screen_quartet(q, all_seqs, args) if args.screen else None for q in batch]
+    todo = [q for q, result in zip(batch, screened) if result is None]
+    
+    if args.pairwise:
+        pair_cache = pair_cache if pair_cache is not None else PairResultCache(args.pair_cache_size)
+        prefetch_pair_results(todo, all_seqs, temp_dir, args, aln_cache, pair_cache)
+        return [result if result is not None else
+                analyze_quartet_pairwise(quartet, all_seqs, temp_dir, args, aln_cache, pair_cache)
+                for quartet, result in zip(batch, screened)]
+    
+    alignments = iter(run_alignment_batch([quartet_alignment_ids(q) for q in todo],
+                                          all_seqs, temp_dir, aln_cache, args.aligner,
+                                          codons=args.kernel == "numpy"))
+    results = []
+    for quartet, result in zip(batch, screened):
+        if result is None:
+            dna_aln = next(alignments)
+            result = analyze_alignment(quartet, dna_aln, args) if dna_aln else None
+        results.append(result)
+    return results
+
+def quartet_alignment_ids(quartet):
+    """四元组 (Para1, Ortho1, Para2, Ortho2) 在比对中的基因顺序"""
+    id_p1_a, id_o1, id_p1_b, id_o2 = quartet
+    return [id_p1_a, id_p1_b, id_o1, id_o2]
+
+def analyze_alignment(quartet, dna_aln, args):
+    """
+    由四元组的密码子比对计算 Ka/Ks、置换判定与 Bootstrap 支持率。
+    :param dna_aln: {基因ID: 比对后的 DNA 序列}；numpy 内核下通常已是密码子整数数组 (见 back_translate_codons)
+    :return: 结果字典
+    """
+    id_p1_a, id_o1, id_p1_b, id_o2 = quartet
+    boot = args.boot
+    quartet_id = f"{id_p1_a}-{id_p1_b}"
+        
+    # 计算距离
+    # P1: 物种1内的旁系 (Lso1 vs Lso2)
+    # P2: 物种2内的旁系 (Lma1 vs Lma2) - 注意：原脚本逻辑需要两个物种的旁系对比
+    # O1: 直系对1 (Lso1 vs Lma1)
+    # O2: 直系对2 (Lso2 vs Lma2)
+    
+    # 映射关系:
+    # id_p1_a (Lso1)
+    # id_p1_b (Lso2)
+    # id_o1   (Lma1)
+    # id_o2   (Lma2)
+    
+    # 定义对比组
+    pairs = {
+        "P1": (id_p1_a, id_p1_b), # Sp1 Paralog
+        "P2": (id_o1, id_o2),     # Sp2 Paralog (Inferred)
+        "O1": (id_p1_a, id_o1),   # Ortho pair 1
+        "O2": (id_p1_b, id_o2)    # Ortho pair 2
+    }
+    
+    with phase("kaks"):
+        # 选择计算内核
+        if args.kernel == "numpy":
+            # 回译时已直接得到密码子整数数组，后续 Ka/Ks 与 Bootstrap 均在整数数组上完成
+            aln = as_codon_alignment(dna_aln)
+            kaks_fn = calculate_kaks_numpy
+            resample_fn = bootstrap_resample_codons
+        else:
+            aln = dna_aln
+            kaks_fn = calculate_kaks
+            resample_fn = bootstrap_resample
+        
+        # Ks=0且Ps=0 可能是完全相同或错误，此处允许完全相同的情况存在
+        stats = {}
+        for k, (u1, u2) in pairs.items():
+            stats[k] = kaks_fn(aln[u1], aln[u2])
+
+    # 提取 Ks 值
+    ks_p1 = stats["P1"][1]
+    ks_p2 = stats["P2"][1]
+    ks_o1 = stats["O1"][1]
+    ks_o2 = stats["O2"][1]
+    
+    # 基因转换判定逻辑 (Ks_Paralog < Ks_Ortholog)
+    # 物种1是否发生转换：Lso1和Lso2比直系更像
+    is_conv_sp1 = (ks_p1 < ks_o1 and ks_p1 < ks_o2)
+    
+    # 物种2是否发生转换：Lma1和Lma2比直系更像
+    is_conv_sp2 = (ks_p2 < ks_o1 and ks_p2 < ks_o2)
+    
+    # Bootstrap 验证
+    boot_sup_sp1 = 0
+    boot_sup_sp2 = 0
+    boot_reps = 0
+    
+    if is_conv_sp1 or is_conv_sp2:
+        # 指定 --seed 时每个四元组使用由种子和基因ID派生的独立随机数，结果可复现
+        seed = quartet_seed(args.seed, quartet) if args.seed is not None else None
+        if args.boot_engine == "indexed":
+            codon_aln = as_codon_alignment(aln)
+            contrib = bootstrap_contributions(codon_aln, pairs)
+            np_rng = np.random.default_rng(seed)
+            run_round = lambda n: bootstrap_support_indexed(
+                contrib, n, is_conv_sp1, is_conv_sp2, batch_size=args.boot_batch, rng=np_rng)
+        else:
+            aln_len = alignment_codon_length(aln)
+            py_rng = random.Random(seed) if seed is not None else None
+            run_round = lambda n: bootstrap_support_classic(
+                aln, aln_len, pairs, n, kaks_fn, resample_fn, is_conv_sp1, is_conv_sp2, rng=py_rng)
+        
+        with phase("bootstrap"):
+            boot_sup_sp1, boot_sup_sp2, boot_reps = run_bootstrap(
+                run_round, boot, is_conv_sp1, is_conv_sp2, adaptive=args.boot_adaptive,
+                threshold=args.boot_threshold, alpha=args.boot_alpha, min_reps=args.boot_min, step=args.boot_step)
+                
+    prob_sp1 = boot_sup_sp1 / boot_reps if is_conv_sp1 and boot_reps > 0 else 0.0
+    prob_sp2 = boot_sup_sp2 / boot_reps if is_conv_sp2 and boot_reps > 0 else 0.0
+    
+    result = {
+        "quartet_id": quartet_id,
+        "stats": stats,
+        "conv_sp1": is_conv_sp1,
+        "conv_sp2": is_conv_sp2,
+        "prob_sp1": prob_sp1,
+        "prob_sp2": prob_sp2,
+        "boot_reps": boot_reps,
+    }
+    
+    # 滑动窗口扫描 (部分置换)：与整基因判定无关，每个四元组都扫描
+    if args.window:
+        with phase("window"):
+            seed = quartet_seed(args.seed, quartet) if args.seed is not None else None
+            # 使用独立的随机数流，不影响整基因 Bootstrap 的结果
+            window_rng = np.random.default_rng(None if seed is None else [seed, 1])
+            contrib = bootstrap_contributions(as_codon_alignment(aln), pairs)
+            result["windows"] = scan_windows(contrib, args.window, args.step, boot,
+                                             batch_size=args.boot_batch, rng=window_rng)
+    return result
+
+# 可选输出列 (由运行选项开启，追加在固定列之后)：列名 -> 格式化函数
+OPTIONAL_COLUMNS = {
+    "Boot_N": lambda result: str(result["boot_reps"]),
+    "Screened": lambda result: "Y" if result.get("screened") else "N",
+}
+
+def optional_columns(args):
+    """根据运行选项返回需要追加的可选列名"""
+    columns = []
+    if args.boot_adaptive:
+        columns.append("Boot_N")
+    if args.screen:
+        columns.append("Screened")
+    return columns
+
+def format_row(result, extra_columns=()):
+    """将 analyze_quartet 的结果字典格式化为输出行 (字符串列表)"""
+    stats = result["stats"]
+    if stats is None:
+        # 被快速筛选排除的四元组没有计算 Ka/Ks
+        values = ["NA"] * 8
+    else:
+        values = [f"{stats[k][i]:.4f}" for k in ("P1", "P2", "O1", "O2") for i in (0, 1)]
+    row = [
+        result["quartet_id"],
+        *values,
+        "Y" if result["conv_sp1"] else "N",
+        "Y" if result["conv_sp2"] else "N",
+        f"{result['prob_sp1']:.2f}",
+        f"{result['prob_sp2']:.2f}"
+    ]
+    return row + [OPTIONAL_COLUMNS[column](result) for column in extra_columns]
+
+# 滑动窗口结果 (<输出文件>.tracts.tsv) 的列：Start/End 为比对中的密码子列 (从 1 开始，含两端)
+TRACT_HEADERS = ["QuartetID", "Species", "Window", "Start", "End", "Ks_Para", "Ks_Ortho1", "Ks_Ortho2", "Boot_Prob"]
+
+def tracts_path(output_file):
+    """输出文件对应的滑动窗口结果路径"""
+    return output_file + ".tracts.tsv"
+
+def format_tract_rows(result):
+    """将结果字典中的窗口 (见 scan_windows) 格式化为 tracts 文件的行"""
+    return [[result["quartet_id"], f"Sp{species}", str(size), str(start + 1), str(end),
+             f"{ks_para:.4f}", f"{ks_o1:.4f}", f"{ks_o2:.4f}", f"{support:.2f}"]
+            for species, size, start, end, ks_para, ks_o1, ks_o2, support in result.get("windows", ())]
+
+def parse_window_sizes(text):
+    """解析 --window (逗号分隔的窗口大小)"""
+    try:
+        sizes = [int(x) for x in text.split(",") if x.strip()]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) < 1:
+        raise argparse.ArgumentTypeError(f"窗口大小必须为正整数 (逗号分隔): {text}")
+    return sizes
+
+def columnar_path(output_file, fmt):
+    """列式结果表 (--columnar) 的路径: <输出文件>.parquet 或 <输出文件>.npz"""
+    return f"{output_file}.{fmt}"
+
+# 列式结果表中可选列的类型 (列名与 TSV 相同)
+OPTIONAL_COLUMN_TYPES = {"Boot_N": "int", "Screened": "bool"}
+
+def columnar_columns(extra_columns=()):
+    """列式结果表的列定义：与 TSV 的列一致，数值保留完整精度，Y/N 列为布尔值"""
+    kinds = ["str"] + ["float"] * 8 + ["bool", "bool", "float", "float"]
+    return list(zip(RESULT_HEADERS, kinds)) + [(column, OPTIONAL_COLUMN_TYPES[column]) for column in extra_columns]
+
+def columnar_row(result, extra_columns=()):
+    """将结果字典转换为列式结果表的一行 (未计算 Ka/Ks 时为 NaN)"""
+    stats = result["stats"]
+    if stats is None:
+        values = [math.nan] * 8
+    else:
+        values = [float(stats[k][i]) for k in ("P1", "P2", "O1", "O2") for i in (0, 1)]
+    row = [result["quartet_id"], *values, bool(result["conv_sp1"]), bool(result["conv_sp2"]),
+           float(result["prob_sp1"]), float(result["prob_sp2"])]
+    extras = {"Boot_N": lambda: int(result["boot_reps"]), "Screened": lambda: bool(result.get("screened"))}
+    return row + [extras[column]() for column in extra_columns]
+
+def open_columnar_writer(args, extra_columns=()):
+    """按 --columnar 创建列式结果表的写出器；未指定时返回 None"""
+    if not args.columnar:
+        return None
+    return pipelineIO.ColumnarWriter(columnar_path(args.output, args.columnar), columnar_columns(extra_columns))
+
+# =========================================================
+# 断点续跑 (Checkpoint)
+# =========================================================
+# 每个四元组处理完毕后，先向 <输出文件>.ckpt 追加一行 JSON 记录 (含完整精度的结果)，再写出 TSV 行。
+# 日志是结果的权威来源：--resume 时据此跳过已完成的四元组，并由日志重建 TSV，
+# 因此即使进程在两次写入之间中断，TSV 与日志也不会出现重复或缺失。
+
+def checkpoint_path(output_file):
+    """输出文件对应的断点日志路径"""
+    return output_file + ".ckpt"
+
+def truncate_partial_line(path):
+    """截去文件末尾未写完的行 (进程中断时可能残留)"""
+    with open(path, 'rb+') as fh:
+        data = fh.read()
+        if data and not data.endswith(b"\n"):
+            fh.truncate(data.rfind(b"\n") + 1)
+
+def load_checkpoint(path):
+    """
+    读取断点日志 (忽略末尾不完整的记录)。
+    :return: 记录列表，每条为 {"key": [Para1, Ortho1, Para2, Ortho2], "status": "ok"/"skip"/"error", "result": ...}
+    """
+    truncate_partial_line(path)
+    entries = []
+    with open(path, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries
+
+def write_checkpoint_entry(fh, quartet, result):
+    """追加一条断点记录 (单次写入整行并立即刷新)；分析出错的四元组记为 "error"，续跑时重新分析"""
+    if isinstance(result, QuartetError):
+        entry = {"key": list(quartet), "status": "error", "result": None, "error": result.message}
+    else:
+        entry = {"key": list(quartet), "status": "skip" if result is None else "ok", "result": result}
+    fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    fh.flush()
+
+def rewrite_checkpoint(path, entries):
+    """用给定记录重写断点日志 (写入临时文件后原子替换)"""
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as fh:
+        for entry in entries:
+            fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp_file, path)
+
+def rebuild_output_from_checkpoint(output_file, entries, extra_columns=()):
+    """由断点日志重建 TSV (写入临时文件后原子替换)"""
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as fh:
+        fh.write("\t".join(RESULT_HEADERS + list(extra_columns)) + "\n")
+        for entry in entries:
+            if entry["status"] == "ok":
+                fh.write("\t".join(format_row(entry["result"], extra_columns)) + "\n")
+    os.replace(tmp_file, output_file)
+
+def rebuild_tracts_from_checkpoint(tracts_file, entries):
+    """由断点日志重建滑动窗口结果 (写入临时文件后原子替换)"""
+    tmp_file = tracts_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as fh:
+        fh.write("\t".join(TRACT_HEADERS) + "\n")
+        for entry in entries:
+            if entry["status"] == "ok":
+                for row in format_tract_rows(entry["result"]):
+                    fh.write("\t".join(row) + "\n")
+    os.replace(tmp_file, tracts_file)
+
+def read_output_quartet_ids(output_file):
+    """读取已有 TSV 中完整写出的 QuartetID (无断点日志时的续跑依据)"""
+    truncate_partial_line(output_file)
+    quartet_ids = set()
+    with open(output_file, 'r', encoding='utf-8') as fh:
+        next(fh, None) # 跳过表头
+        for line in fh:
+            if line.strip():
+                quartet_ids.add(line.split("\t", 1)[0])
+    return quartet_ids
+
+def read_output_header(output_file):
+    """读取结果 TSV 的表头，返回其中的可选列名 (固定列之后的部分)"""
+    with open(output_file, 'r', encoding='utf-8') as fh:
+        header = fh.readline().rstrip("\n").split("\t")
+    if header[:len(RESULT_HEADERS)] != RESULT_HEADERS:
+        print(f"[错误] 不是本脚本的结果文件: {output_file}")
+        sys.exit(1)
+    return header[len(RESULT_HEADERS):]
+
+def merge_shard_outputs(quartet_file, shard_outputs, output_file, allow_missing=False, columnar=None):
+    """
+    合并 --shard 各分片的结果：以各分片的断点日志为准，按四元组文件的顺序写出与不分片运行相同的 TSV
+    (及对应的断点日志，可继续 --resume)，并检查四元组是否有缺失或重复。
+    :param columnar: 可选，同时写出列式结果表 ("parquet" / "npz")
+    :return: (写出的四元组数, 缺失数, 重复数)
+    """
+    extra_columns = None
+    found = collections.defaultdict(collections.deque)
+    for shard_output in shard_outputs:
+        ckpt_file = checkpoint_path(shard_output)
+        if not os.path.exists(ckpt_file):
+            print(f"[错误] 未找到分片的断点日志: {ckpt_file}")
+            sys.exit(1)
+        columns = read_output_header(shard_output)
+        if extra_columns is not None and columns != extra_columns:
+            print(f"[错误] 分片结果的列不一致 (运行参数不同?): {shard_output}")
+            sys.exit(1)
+        extra_columns = columns
+        for entry in load_checkpoint(ckpt_file):
+            # 出错的四元组视为缺失 (对该分片 --resume 即可重新分析)
+            if entry["status"] != "error":
+                found[tuple(entry["key"])].append(entry)
+    
+    merged = []
+    missing = []
+    for quartet in iter_quartets(quartet_file):
+        entries = found.get(quartet)
+        if entries:
+            merged.append(entries.popleft())
+        else:
+            missing.append(quartet)
+    duplicated = [key for key, entries in found.items() for _ in entries]
+    
+    for label, keys in (("缺失", missing), ("重复或不属于四元组文件", duplicated)):
+        if keys:
+            examples = ", ".join(f"{k[0]}-{k[2]}" for k in keys[:5])
+            print(f"[警告] {label}的四元组 {len(keys)} 个，例如: {examples}")
+    if (missing or duplicated) and not allow_missing:
+        print("[错误] 分片结果不完整，未写出合并文件 (确认后可加 --allow-missing 强制合并)。")
+        sys.exit(1)
+    
+    with open(checkpoint_path(output_file) + ".tmp", 'w', encoding='utf-8') as fh:
+        for entry in merged:
+            fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    rebuild_output_from_checkpoint(output_file, merged, extra_columns or ())
+    if any(os.path.exists(tracts_path(shard_output)) for shard_output in shard_outputs):
+        rebuild_tracts_from_checkpoint(tracts_path(output_file), merged)
+    if columnar:
+        columns = extra_columns or []
+        with pipelineIO.ColumnarWriter(columnar_path(output_file, columnar), columnar_columns(columns)) as writer:
+            for entry in merged:
+                if entry["status"] == "ok":
+                    writer.add(columnar_row(entry["result"], columns))
+    os.replace(checkpoint_path(output_file) + ".tmp", checkpoint_path(output_file))
+    return len(merged), len(missing), len(duplicated)
+
+def open_alignment_cache(args):
+    """按命令行参数打开比对缓存；未指定 --aln-cache 时返回 None"""
+    if not args.aln_cache:
+        return None
+    return AlignmentCache(args.aln_cache, args.aln_cache_size)
+
+def open_pair_cache(args):
+    """逐对比对模式下创建基因对结果缓存；其他模式返回 None"""
+    if not args.pairwise:
+        return None
+    return PairResultCache(args.pair_cache_size)
+
+# 进程池 worker 的全局状态 (由 _init_worker 在每个子进程内初始化一次)
+_WORKER_STATE = {}
+
+def _init_worker(all_seqs, temp_root, args):
+    """
+    进程池初始化函数。
+    每个 worker 在 temp_root 下创建独占的临时目录，避免 ClustalW 的输入/输出文件互相覆盖。
+    """
+    # 子进程 (spawn 启动方式) 不继承父进程对模块全局状态的修改，需重新设置
+    set_genetic_code(args.table)
+    _WORKER_STATE["all_seqs"] = all_seqs
+    _WORKER_STATE["args"] = args
+    _WORKER_STATE["temp_dir"] = tempfile.mkdtemp(prefix=f"worker_{os.getpid()}_", dir=temp_root)
+    # SQLite 连接不能跨进程共享，每个 worker 单独打开
+    _WORKER_STATE["aln_cache"] = open_alignment_cache(args)
+    _WORKER_STATE["pair_cache"] = open_pair_cache(args)
+    # 每个 worker 单独计时，统计增量随任务结果返回主进程汇总
+    enable_metrics(args)
+
+def _worker_metrics():
+    """取出本 worker 自上次调用以来的阶段计时与计数 (未开启 --metrics 时为 None)"""
+    return METRICS.snapshot(reset=True) if METRICS is not None else None
+
+class QuartetError:
+    """
+    单个四元组分析时抛出的异常 (区别于序列缺失、比对失败等正常跳过)。
+    由 worker 返回主进程，断点日志中记为 "error"，--resume 时重新分析。
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+def report_quartet_error(quartet):
+    """在 except 块中调用：向 stderr 打印出错的四元组与异常堆栈，记为 skip_worker_error 并返回 QuartetError"""
+    count_metric("skip_worker_error")
+    print(f"\n[错误] 四元组 {quartet[0]}-{quartet[2]} ({', '.join(quartet)}) 分析出错:", file=sys.stderr)
+    traceback.print_exc()
+    sys.stderr.flush()
+    exc_type, exc, _ = sys.exc_info()
+    return QuartetError(traceback.format_exception_only(exc_type, exc)[-1].strip())
+
+def analyze_quartet_safe(quartet, all_seqs, temp_dir, args, aln_cache=None, pair_cache=None):
+    """
+    analyze_quartet 的容错版本：单个四元组的异常不应中断整个运行，
+    打印错误后返回 QuartetError (断点日志中记为 "error"，续跑时重新分析)。串行与并行共用。
+    """
+    try:
+        return analyze_quartet(quartet, all_seqs, temp_dir, args, aln_cache, pair_cache)
+    except Exception:
+        return report_quartet_error(quartet)
+
+def analyze_batch_safe(batch, all_seqs, temp_dir, args, aln_cache=None, pair_cache=None):
+    """analyze_batch 的容错版本：整批失败时改为逐个分析，只有真正出错的四元组记为错误"""
+    try:
+        return analyze_batch(batch, all_seqs, temp_dir, args, aln_cache, pair_cache)
+    except Exception as e:
+        print(f"\n[警告] 批量分析 {len(batch)} 个四元组失败 ({type(e).__name__}: {e})，改为逐个分析", file=sys.stderr)
+        return [analyze_quartet_safe(quartet, all_seqs, temp_dir, args, aln_cache, pair_cache) for quartet in batch]
+
+def _worker_analyze(quartet):
+    """进程池任务入口：分析单个四元组，返回 (四元组, 结果, 统计增量)"""
+    result = analyze_quartet_safe(quartet, _WORKER_STATE["all_seqs"], _WORKER_STATE["temp_dir"],
+                                  _WORKER_STATE["args"], _WORKER_STATE["aln_cache"], _WORKER_STATE["pair_cache"])
+    return quartet, result, _worker_metrics()
+
+def _worker_analyze_batch(batch):
+    """进程池任务入口：批量分析一组四元组，返回 ([(四元组, 结果), ...], 统计增量)"""
+    results = analyze_batch_safe(batch, _WORKER_STATE["all_seqs"], _WORKER_STATE["temp_dir"],
+                                 _WORKER_STATE["args"], _WORKER_STATE["aln_cache"], _WORKER_STATE["pair_cache"])
+    return list(zip(batch, results)), _worker_metrics()
+
+def iter_pending(quartets, done_keys, done_ids):
+    """续跑时跳过断点日志 (按四元组) 或已有输出 (按 QuartetID) 中已完成的四元组"""
+    for quartet in quartets:
+        if quartet in done_keys or f"{quartet[0]}-{quartet[2]}" in done_ids:
+            count_metric("skip_resumed")
+            continue
+        yield quartet
+
+def iter_batches(items, size):
+    """将可迭代对象按固定大小切分为列表 (最后一批可能不足 size)"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_results(quartets, all_seqs, temp_dir, args):
+    """
+    依次产出 (四元组, 分析结果)，跳过的四元组结果为 None，出错的为 QuartetError。
+    args.threads > 1 时使用进程池并行计算；imap 保证结果顺序与输入顺序一致。
+    args.align_batch > 1 时按批比对，下游仍逐个四元组产出结果。
+    args.async_align > 0 时改用异步比对调度 (见 iter_results_async)。
+    """
+    if args.async_align:
+        yield from iter_results_async(quartets, all_seqs, temp_dir, args)
+        return
+    
+    batched = args.align_batch > 1
+    
+    if args.threads <= 1:
+        aln_cache = open_alignment_cache(args)
+        pair_cache = open_pair_cache(args)
+        try:
+            if batched:
+                for batch in iter_batches(quartets, args.align_batch):
+                    yield from zip(batch, analyze_batch_safe(batch, all_seqs, temp_dir, args, aln_cache, pair_cache))
+            else:
+                for quartet in quartets:
+                    yield quartet, analyze_quartet_safe(quartet, all_seqs, temp_dir, args, aln_cache, pair_cache)
+        finally:
+            if pair_cache is not None:
+                print(f"\n[信息] 基因对结果缓存命中 {pair_cache.hits} 次，计算 {pair_cache.misses} 个基因对")
+                count_metric("pair_cache_hits", pair_cache.hits)
+                count_metric("pair_cache_misses", pair_cache.misses)
+            if aln_cache is not None:
+                count_metric("aln_cache_hits", aln_cache.hits)
+                count_metric("aln_cache_misses", aln_cache.misses)
+                print(f"\n[信息] 比对缓存命中 {aln_cache.hits} 次，未命中 {aln_cache.misses} 次")
+                aln_cache.close()
+        return
+
+    with multiprocessing.Pool(processes=args.threads, initializer=_init_worker,
+                              initargs=(all_seqs, temp_dir, args)) as pool:
+        if batched:
+            for pairs, delta in pool.imap(_worker_analyze_batch, iter_batches(quartets, args.align_batch)):
+                if delta is not None:
+                    METRICS.merge(delta)
+                yield from pairs
+        else:
+            # chunksize 适当放大以降低进程间通信开销
+            for quartet, result, delta in pool.imap(_worker_analyze, quartets, chunksize=4):
+                if delta is not None:
+                    METRICS.merge(delta)
+                yield quartet, result
+
+# ---------------------------------------------------------
+# 异步比对调度 (--async-align)
+# ---------------------------------------------------------
+# 主进程用 asyncio 同时保持 N 个外部比对器进程运行，每个作业使用独立命名的输入/输出文件
+# (优先放在 /dev/shm 内存文件系统)，MAFFT 的结果直接从管道读取；
+# 比对完成的四元组交给进程池计算 Ka/Ks 与 Bootstrap，比对器的 I/O 等待与 Python 计算相互重叠。
+
+def async_job_root(temp_dir):
+    """异步比对作业文件的目录：/dev/shm 可写时放在内存文件系统中，否则放在 temp_dir 下"""
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        try:
+            return tempfile.mkdtemp(prefix="conversion_align_", dir=shm)
+        except OSError:
+            pass
+    return tempfile.mkdtemp(prefix="align_jobs_", dir=temp_dir)
+
+def _init_analysis_worker(args):
+    """异步模式进程池的初始化函数：worker 只做回译与 Ka/Ks 计算，不需要序列与缓存"""
+    set_genetic_code(args.table)
+    _WORKER_STATE["args"] = args
+    enable_metrics(args)
+
+def _worker_analyze_alignment(quartet, aligned_prots, gene_dna_map):
+    """进程池任务入口：由蛋白比对回译并完成分析，返回 (结果, 统计增量)"""
+    args = _WORKER_STATE["args"]
+    try:
+        translate_back = back_translate_codons if args.kernel == "numpy" else back_translate
+        with phase("back_translate"):
+            dna_aln = translate_back(aligned_prots, gene_dna_map)
+        result = analyze_alignment(quartet, dna_aln, args) if dna_aln else None
+    except Exception:
+        result = report_quartet_error(quartet)
+    return result, _worker_metrics()
+
+class AsyncAlignScheduler:
+    """
+    异步比对调度器 (在主进程的事件循环中运行)。
+    align() 受信号量限制，同一时刻最多 limit 个比对器进程；analyze() 用 run_in_executor
+    把 CPU 密集的计算交给进程池，事件循环在等待期间继续调度其他作业的比对。
+    """
+
+    def __init__(self, all_seqs, args, executor, job_dir, aln_cache=None):
+        self.all_seqs = all_seqs
+        self.args = args
+        self.backend = ALIGNER_BACKENDS[args.aligner]
+        self.executor = executor
+        self.job_dir = job_dir
+        self.aln_cache = aln_cache
+        self.semaphore = asyncio.Semaphore(args.async_align)
+        self._job_ids = itertools.count()
+
+    async def align(self, prot_records):
+        """运行一次外部比对 (独立命名的作业文件)，返回 {基因ID: 比对后的蛋白序列} 或 None"""
+        job = next(self._job_ids)
+        in_file = os.path.join(self.job_dir, f"job_{job}.fasta")
+        out_file = os.path.join(self.job_dir, f"job_{job}.aln")
+        SeqIO.write(prot_records, in_file, "fasta")
+        try:
+            async with self.semaphore:
+                wall = time.perf_counter()
+                proc = await asyncio.create_subprocess_exec(
+                    *self.backend["command"](in_file, out_file),
+                    stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL)
+                stdout, _ = await proc.communicate()
+                # 比对器在子进程中运行，这里只记录墙钟时间
+                if METRICS is not None:
+                    METRICS.add_phase("align", time.perf_counter() - wall, 0.0)
+            if proc.returncode != 0:
+                return None
+            return self.backend["read_output"](out_file, stdout.decode("utf-8", errors="replace"))
+        finally:
+            for path in (in_file, out_file):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    async def analyze(self, quartet):
+        """分析单个四元组 (流程同 analyze_quartet)；跳过时返回 None，出错时返回 QuartetError"""
+        args = self.args
+        try:
+            if args.screen:
+                screened = screen_quartet(quartet, self.all_seqs, args)
+                if screened is not None:
+                    return screened
+            
+            with phase("translate"):
+                translated = translate_genes(quartet_alignment_ids(quartet), self.all_seqs)
+            if translated is None:
+                return None
+            prot_records, gene_dna_map = translated
+            
+            cache_key, aligned_prots = lookup_cached_alignment(self.aln_cache, prot_records, self.backend["settings"])
+            if aligned_prots is None:
+                aligned_prots = await self.align(prot_records)
+                if aligned_prots is None:
+                    count_metric("skip_align_failed")
+                    return None
+                if self.aln_cache is not None:
+                    self.aln_cache.put(cache_key, [aligned_prots[r.id] for r in prot_records])
+        except Exception:
+            return report_quartet_error(quartet)
+        
+        # 计算中的异常已在 worker 内处理；进程池本身的故障 (如 BrokenProcessPool) 直接中止运行
+        loop = asyncio.get_running_loop()
+        result, delta = await loop.run_in_executor(self.executor, _worker_analyze_alignment,
+                                                   quartet, aligned_prots, gene_dna_map)
+        if delta is not None:
+            METRICS.merge(delta)
+        return result
+
+def iter_results_async(quartets, all_seqs, temp_dir, args):
+    """
+    异步调度版本的 iter_results：依次产出 (四元组, 分析结果)，顺序与输入一致。
+    最多同时处理 (比对器数 + 进程数) 的数倍个四元组，避免一次性读入整个四元组生成器。
+    """
+    loop = asyncio.new_event_loop()
+    aln_cache = open_alignment_cache(args)
+    job_dir = async_job_root(temp_dir)
+    window = collections.deque()
+    max_in_flight = 4 * (args.async_align + max(args.threads, 1))
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(args.threads, 1),
+                                                    initializer=_init_analysis_worker,
+                                                    initargs=(args,)) as executor:
+            scheduler = AsyncAlignScheduler(all_seqs, args, executor, job_dir, aln_cache)
+            quartets = iter(quartets)
+            exhausted = False
+            while True:
+                while not exhausted and len(window) < max_in_flight:
+                    quartet = next(quartets, None)
+                    if quartet is None:
+                        exhausted = True
+                        break
+                    window.append((quartet, loop.create_task(scheduler.analyze(quartet))))
+                if not window:
+                    break
+                # 等待最早提交的四元组；等待期间其余作业的比对与计算继续进行
+                quartet, task = window.popleft()
+                yield quartet, loop.run_until_complete(task)
+    finally:
+        for _, task in window:
+            task.cancel()
+        if window:
+            loop.run_until_complete(asyncio.gather(*(task for _, task in window), return_exceptions=True))
+        loop.close()
+        shutil.rmtree(job_dir, ignore_errors=True)
+        if aln_cache is not None:
+            count_metric("aln_cache_hits", aln_cache.hits)
+            count_metric("aln_cache_misses", aln_cache.misses)
+            print(f"\n[信息] 比对缓存命中 {aln_cache.hits} 次，未命中 {aln_cache.misses} 次")
+            aln_cache.close()
+
+# =========================================================
+# 4. 主程序
+# =========================================================
+
+def add_detection_arguments(parser):
+    """
+    添加检测阶段的运行参数 (Bootstrap、并行、内核、比对器、缓存等)。
+    本脚本与流程驱动 runPipeline.py 共用同一组参数定义。
+    """
+    parser.add_argument("--boot", type=int, default=100, help="Bootstrap 重采样次数 (默认: 100)")
+    parser.add_argument("--resume", action="store_true",
+                        help="断点续跑：跳过断点日志 (<输出文件>.ckpt) 或已有输出中记录的四元组，\n并在原输出文件后继续追加")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+                        help="并行进程数 (默认: 1，即串行)。\n每个进程使用独立的临时目录，结果仍按输入顺序写出")
+    parser.add_argument("--table", type=int, default=1, choices=sorted(CodonTable.unambiguous_dna_by_id),
+                        metavar="ID",
+                        help="NCBI 遗传密码表编号 (默认: 1 标准密码表)。\n例如: 2 脊椎动物线粒体, 5 无脊椎动物线粒体, 11 细菌/古菌/质体")
+    parser.add_argument("--kernel", choices=["python", "numpy"], default="python",
+                        help="Ka/Ks 计算内核 (默认: python)。\nnumpy: 将比对编码为密码子整数数组后向量化计算，结果与 python 内核一致")
+    parser.add_argument("--boot-engine", choices=["classic", "indexed"], default="classic",
+                        help="Bootstrap 实现 (默认: classic)。\nindexed: 预先计算逐列贡献，每批重复一次矩阵乘法完成，不重建比对序列")
+    parser.add_argument("--boot-batch", type=int, default=256,
+                        help="indexed 模式下每批同时计算的重复次数 (默认: 256)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="随机种子。每个四元组使用由种子和基因ID派生的独立随机数，\n结果与处理顺序、进程数无关，可完全复现")
+    parser.add_argument("--boot-adaptive", action="store_true",
+                        help="自适应 Bootstrap：支持率的置信区间完全高于或低于 --boot-threshold 时提前停止，\n--boot 作为最大重复次数；实际次数写入 Boot_N 列")
+    parser.add_argument("--boot-threshold", type=float, default=0.95,
+                        help="自适应 Bootstrap 的判定阈值 (默认: 0.95)")
+    parser.add_argument("--boot-alpha", type=float, default=0.05,
+                        help="自适应 Bootstrap 置信区间 (Wilson) 的显著性水平 (默认: 0.05)")
+    parser.add_argument("--boot-min", type=int, default=20,
+                        help="自适应 Bootstrap 的最少重复次数 (默认: 20)")
+    parser.add_argument("--boot-step", type=int, default=20,
+                        help="自适应 Bootstrap 每轮重复次数，每轮结束后检查是否可以停止 (默认: 20)")
+    parser.add_argument("--aligner", choices=sorted(ALIGNER_BACKENDS), default="clustalw",
+                        help="蛋白比对后端 (默认: clustalw)。\nmafft: 调用 MAFFT\ninternal: 基于 Biopython PairwiseAligner 的进程内中心星比对，无需外部程序与临时文件")
+    parser.add_argument("--align-batch", type=int, default=0,
+                        help="批量比对的四元组数 (默认: 0，即逐个比对)。\n外部比对器 (clustalw/mafft) 每批只启动一次，整批比对结果再逐个进入下游计算")
+    parser.add_argument("--async-align", type=int, default=0, metavar="N",
+                        help="异步比对调度：同时运行 N 个外部比对器进程 (clustalw/mafft)，\n"
+                             "比对完成的四元组由 -t 个进程计算 Ka/Ks 与 Bootstrap，两者同时进行 (默认: 0，不启用)")
+    parser.add_argument("--aln-cache", default=None,
+                        help="持久化比对缓存文件路径 (SQLite)。\n以蛋白序列与比对器设置的哈希为键，重复运行时直接复用已有比对")
+    parser.add_argument("--aln-cache-size", type=float, default=1024,
+                        help="比对缓存大小上限 (MB，默认: 1024)，超出后按 LRU 淘汰")
+    parser.add_argument("--pairwise", action="store_true",
+                        help="逐对比对模式：四个比较组各自做两两密码子比对，同一基因对在多个四元组间\n只比对并计算一次 Ka/Ks (进程内 LRU 缓存)；Bootstrap 对每个基因对独立重采样")
+    parser.add_argument("--pair-cache-size", type=int, default=200000,
+                        help="逐对比对模式下每个进程缓存的基因对数上限 (默认: 200000)")
+    parser.add_argument("--screen", action="store_true",
+                        help="快速筛选：先用 k-mer 距离近似四个比较组的 Ks，只有旁系距离可能小于两个直系距离的\n四元组才进行比对与 Bootstrap；被筛除的行 Ka/Ks 为 NA，并在 Screened 列标记为 Y")
+    parser.add_argument("--screen-k", type=int, default=8,
+                        help=f"快速筛选的 k-mer 长度 (默认: 8，范围 1-{MAX_SCREEN_K})")
+    parser.add_argument("--screen-margin", type=float, default=0.2,
+                        help="快速筛选的相对余量 (默认: 0.2)：旁系距离 <= 最小直系距离 x (1 + 余量) 即通过")
+    parser.add_argument("--window", type=parse_window_sizes, default=None, metavar="W[,W...]",
+                        help="滑动窗口扫描部分基因置换：窗口大小 (密码子数)，可用逗号给出多个。\n"
+                             "Ks_旁系 < 两个 Ks_直系 的窗口及其窗口内 Bootstrap 支持率写入 <输出文件>.tracts.tsv")
+    parser.add_argument("--step", type=int, default=None,
+                        help="滑动窗口的步长 (密码子数，默认: 窗口大小的一半)")
+    parser.add_argument("--columnar", choices=pipelineIO.COLUMNAR_FORMATS, default=None,
+                        help="另外以列式格式写出结果表 <输出文件>.parquet 或 <输出文件>.npz：\n"
+                             "数值为完整精度，Y/N 列为布尔值，分批写出；parquet 需要 pyarrow")
+    pipelineMetrics.add_metrics_arguments(parser)
+
+def run_detection(quartets, all_seqs, temp_dir, args, source="-"):
+    """
+    分析四元组并写出结果文件 (含断点日志与续跑)。
+    :param quartets: 可迭代的 (Para1, Ortho1, Para2, Ortho2)，可以是边生成边消费的生成器
+    :param source: 四元组来源描述 (仅用于日志)
+    :return: 分析出错的四元组数 (未写入结果，--resume 时重新分析)
+    """
+    if args.async_align:
+        if args.async_align < 0 or ALIGNER_BACKENDS[args.aligner]["command"] is None:
+            print("[错误] --async-align 需要正整数，且只适用于外部比对器 (--aligner clustalw/mafft)。")
+            sys.exit(1)
+        if args.pairwise or args.align_batch > 1:
+            print("[错误] --async-align 不能与 --pairwise 或 --align-batch 同时使用。")
+            sys.exit(1)
+    if not 1 <= args.screen_k <= MAX_SCREEN_K:
+        print(f"[错误] --screen-k 必须在 1 与 {MAX_SCREEN_K} 之间。")
+        sys.exit(1)
+    if args.screen_margin < 0:
+        print("[错误] --screen-margin 不能为负数。")
+        sys.exit(1)
+    if args.boot_batch < 1:
+        print("[错误] --boot-batch 必须为正整数。")
+        sys.exit(1)
+    if args.boot_step < 1:
+        print("[错误] --boot-step 必须为正整数。")
+        sys.exit(1)
+    if args.boot_min < 0:
+        print("[错误] --boot-min 不能为负数。")
+        sys.exit(1)
+    if not 0 < args.boot_alpha < 1:
+        print("[错误] --boot-alpha 必须在 0 与 1 之间。")
+        sys.exit(1)
+    if args.window and args.pairwise:
+        print("[错误] --window 需要四条序列的联合比对，不能与 --pairwise 同时使用。")
+        sys.exit(1)
+    if args.step is not None and args.step < 1:
+        print("[错误] --step 必须为正整数。")
+        sys.exit(1)
+    
+    # 准备输出 (续跑时跳过已完成的四元组)
+    ckpt_file = checkpoint_path(args.output)
+    tracts_file = tracts_path(args.output) if args.window else None
+    extra_columns = optional_columns(args)
+    done_keys = set()
+    done_ids = set()
+    entries = []
+    resuming = False
+    if args.resume and os.path.exists(ckpt_file):
+        entries = load_checkpoint(ckpt_file)
+        # 上次出错的四元组不算已处理：从日志中移除，本次重新分析
+        retry_count = sum(1 for entry in entries if entry["status"] == "error")
+        if retry_count:
+            entries = [entry for entry in entries if entry["status"] != "error"]
+            rewrite_checkpoint(ckpt_file, entries)
+            print(f"[信息] 断点续跑：重新分析上次出错的 {retry_count} 个四元组")
+        done_keys = {tuple(entry["key"]) for entry in entries}
+        rebuild_output_from_checkpoint(args.output, entries, extra_columns)
+        if tracts_file:
+            rebuild_tracts_from_checkpoint(tracts_file, entries)
+        resuming = True
+        print(f"[信息] 断点续跑：日志中已有 {len(done_keys)} 个已处理的四元组")
+    elif args.resume and os.path.exists(args.output):
+        done_ids = read_output_quartet_ids(args.output)
+        resuming = True
+        print(f"[信息] 断点续跑：未找到断点日志，按输出文件中的 {len(done_ids)} 个 QuartetID 跳过")
+        if args.columnar:
+            print("[警告] 没有断点日志，列式结果表只包含本次新分析的四元组")
+    
+    mode = 'a' if resuming else 'w'
+    tracts_header = tracts_file is not None and not (resuming and os.path.exists(tracts_file))
+    with open(args.output, mode, encoding='utf-8') as out_fh, \
+         open(ckpt_file, mode, encoding='utf-8') as ckpt_fh, \
+         (open(tracts_file, mode, encoding='utf-8') if tracts_file else contextlib.nullcontext()) as tracts_fh, \
+         (open_columnar_writer(args, extra_columns) or contextlib.nullcontext()) as columnar_writer:
+        # 列式结果表每次运行都重新写出：续跑时先写入断点日志中的结果 (完整精度)
+        if columnar_writer is not None:
+            for entry in entries:
+                if entry["status"] == "ok":
+                    columnar_writer.add(columnar_row(entry["result"], extra_columns))
+        if not resuming:
+            out_fh.write("\t".join(RESULT_HEADERS + extra_columns) + "\n")
+            out_fh.flush()
+        if tracts_header:
+            tracts_fh.write("\t".join(TRACT_HEADERS) + "\n")
+        
+        processed_count = 0
+        error_count = 0
+        
+        print(f"[信息] 开始分析四元组: {source} (进程数: {max(args.threads, 1)})")
+        
+        pending = iter_pending(quartets, done_keys, done_ids)
+        with stage("analyze"):
+            for quartet, result in iter_results(pending, all_seqs, temp_dir, args):
+                # 先写断点日志，再写结果行；每行单次写入并立即刷新，中断时不会留下半行
+                write_checkpoint_entry(ckpt_fh, quartet, result)
+                if result is None or isinstance(result, QuartetError):
+                    if result is not None:
+                        error_count += 1
+                    count_metric("quartets_failed")
+                    continue
+                
+                # 写入行
+                out_fh.write("\t".join(format_row(result, extra_columns)) + "\n")
+                out_fh.flush()
+                if tracts_fh is not None:
+                    tracts_fh.write("".join("\t".join(row) + "\n" for row in format_tract_rows(result)))
+                    tracts_fh.flush()
+                if columnar_writer is not None:
+                    columnar_writer.add(columnar_row(result, extra_columns))
+                
+                count_metric("quartets_done")
+                processed_count += 1
+                if processed_count % 10 == 0:
+                    print(f"\r[进度] 已处理 {processed_count} 个四元组...", end='', flush=True)
+
+    print(f"\n[完成] 结果已保存至: {args.output}")
+    if tracts_file:
+        print(f"[完成] 滑动窗口结果已保存至: {tracts_file}")
+    if args.columnar:
+        print(f"[完成] 列式结果表已保存至: {columnar_path(args.output, args.columnar)}")
+    if error_count:
+        print(f"[警告] {error_count} 个四元组分析出错，未写入结果 (错误信息见标准错误输出)；"
+              f"排除问题后使用 --resume 重新分析")
+    return error_count
+
+def write_metrics(args):
+    """写出运行统计 (--metrics)：吞吐量按分析步骤的墙钟时间计算"""
+    if METRICS is not None:
+        METRICS.write(args.metrics, items="quartets_done", item_stage="analyze")
+
+def merge_main(argv):
+    """merge 子命令：合并 --shard 各分片的结果"""
+    parser = argparse.ArgumentParser(
+        prog="3.detetConver.py merge",
+        description="按四元组文件的顺序合并 --shard 各分片的结果，并检查缺失与重复的四元组",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("shards", nargs="+", help="各分片的输出文件 (需保留同名的 .ckpt 断点日志)")
+    parser.add_argument("-q", "--quartet", required=True, help="分片运行时使用的四元组文件")
+    parser.add_argument("-o", "--output", required=True, help="合并后的输出文件路径")
+    parser.add_argument("--allow-missing", action="store_true",
+                        help="存在缺失或重复的四元组时仍写出合并结果 (默认报错退出)")
+    parser.add_argument("--columnar", choices=pipelineIO.COLUMNAR_FORMATS, default=None,
+                        help="同时写出列式结果表 <输出文件>.parquet 或 .npz (同检测时的 --columnar)")
+    args = parser.parse_args(argv)
+    
+    if not os.path.exists(args.quartet):
+        print(f"[错误] 找不到文件: {args.quartet}")
+        sys.exit(1)
+    written, missing, duplicated = merge_shard_outputs(args.quartet, args.shards, args.output, args.allow_missing,
+                                                      args.columnar)
+    print(f"[信息] 已合并 {len(args.shards)} 个分片，共 {written} 个四元组 (缺失 {missing}，重复 {duplicated})")
+    print(f"[完成] 结果已保存至: {args.output}")
+    if args.columnar:
+        print(f"[完成] 列式结果表已保存至: {columnar_path(args.output, args.columnar)}")
+
 def main():
+    # 子命令: merge；其余情况保持原有命令行
+    if len(sys.argv) > 1 and sys.argv[1] == "merge":
+        merge_main(sys.argv[2:])
+        return
+    
     parser = argparse.ArgumentParser(
         description="基于四元组(Quartet)检测基因转换事件 (Gene Conversion Detection)",
         formatter_class=argparse.RawTextHelpFormatter
@@ -253,149 +2425,59 @@ def main():
     parser.add_argument("-a", "--fasta1", required=True, help="物种1的 CDS 序列文件 (.fasta)")
     parser.add_argument("-b", "--fasta2", required=True, help="物种2的 CDS 序列文件 (.fasta)")
     parser.add_argument("-o", "--output", required=True, help="输出结果文件路径")
-    parser.add_argument("--boot", type=int, default=100, help="Bootstrap 重采样次数 (默认: 100)")
+    parser.add_argument("--lazy-fasta", action="store_true",
+                        help="按需加载 CDS：为 FASTA 建立磁盘索引 (<fasta>.idx，可重复使用)，\n只读取四元组文件中出现的基因，内存占用与基因组大小无关")
+    parser.add_argument("--shard", default=None, metavar="i/N",
+                        help="只处理第 i 个分片 (i 从 0 开始，共 N 片)，用于集群阵列作业。\n"
+                             "按 QuartetID 的稳定哈希分片，与行序无关；只加载本分片用到的序列。\n"
+                             "各分片使用不同的 -o，完成后用 merge 子命令合并")
+    add_detection_arguments(parser)
     
     args = parser.parse_args()
+    shard = parse_shard(args.shard) if args.shard else None
+    set_genetic_code(args.table)
+    pipelineMetrics.resolve_output_paths(args, args.output)
+    enable_metrics(args)
     
     # 环境检查
-    check_dependencies()
+    check_dependencies(args.aligner)
     
-    # 创建临时目录
-    temp_dir = "temp_conversion_work"
-    if not os.path.exists(temp_dir): os.makedirs(temp_dir)
+    # 创建临时目录 (每次运行唯一，同一工作目录下的多个作业互不干扰)
+    temp_dir = tempfile.mkdtemp(prefix="temp_conversion_work_", dir=".")
 
     try:
-        # 1. 加载数据
-        print(f"[信息] 正在加载序列数据...")
-        seqs1 = load_fasta(args.fasta1)
-        seqs2 = load_fasta(args.fasta2)
-        all_seqs = {**seqs1, **seqs2} # 合并字典
-        print(f"[信息] 序列加载完成 (物种1序列数: {len(seqs1)}, 物种2序列数: {len(seqs2)})")
-
-        # 2. 准备输出
-        with open(args.output, 'w', encoding='utf-8') as out_fh:
-            headers = [
-                "QuartetID", 
-                "Ka_P1", "Ks_P1", "Ka_P2", "Ks_P2", 
-                "Ka_O1", "Ks_O1", "Ka_O2", "Ks_O2",
-                "Conv_Sp1(Para<Ortho)", "Conv_Sp2(Para<Ortho)", 
-                "Boot_Prob_Sp1", "Boot_Prob_Sp2"
-            ]
-            out_fh.write("\t".join(headers) + "\n")
-            
-            processed_count = 0
-            
-            print(f"[信息] 开始分析四元组文件: {args.quartet}")
-            
-            with open(args.quartet, 'r', encoding='utf-8') as qf:
-                for line in qf:
-                    line = line.strip()
-                    if not line or line.startswith("#"): continue
-                    
-                    parts = line.split()
-                    if len(parts) < 4: continue
-                    
-                    # 假定格式: Para1 Ortho1 Para2 Ortho2
-                    # 对应: Lso1 Lma1 Lso2 Lma2
-                    id_p1_a, id_o1, id_p1_b, id_o2 = parts[0], parts[1], parts[2], parts[3]
-                    
-                    current_ids = [id_p1_a, id_p1_b, id_o1, id_o2]
-                    quartet_id = f"{id_p1_a}-{id_p1_b}"
-                    
-                    # 执行比对流程
-                    dna_aln = run_alignment_workflow(current_ids, all_seqs, temp_dir)
-                    if not dna_aln:
-                        continue
-                        
-                    # 计算距离
-                    # P1: 物种1内的旁系 (Lso1 vs Lso2)
-                    # P2: 物种2内的旁系 (Lma1 vs Lma2) - 注意：原脚本逻辑需要两个物种的旁系对比
-                    # O1: 直系对1 (Lso1 vs Lma1)
-                    # O2: 直系对2 (Lso2 vs Lma2)
-                    
-                    # 映射关系:
-                    # id_p1_a (Lso1)
-                    # id_p1_b (Lso2)
-                    # id_o1   (Lma1)
-                    # id_o2   (Lma2)
-                    
-                    # 定义对比组
-                    pairs = {
-                        "P1": (id_p1_a, id_p1_b), # Sp1 Paralog
-                        "P2": (id_o1, id_o2),     # Sp2 Paralog (Inferred)
-                        "O1": (id_p1_a, id_o1),   # Ortho pair 1
-                        "O2": (id_p1_b, id_o2)    # Ortho pair 2
-                    }
-                    
-                    stats = {}
-                    valid_calc = True
-                    for k, (u1, u2) in pairs.items():
-                        res = calculate_kaks(dna_aln[u1], dna_aln[u2])
-                        if res[1] == 0 and res[3] == 0: # Ks=0且Ps=0，可能是完全相同或错误
-                             # 允许完全相同的情况存在
-                             pass
-                        stats[k] = res
-
-                    # 提取 Ks 值
-                    ks_p1 = stats["P1"][1]
-                    ks_p2 = stats["P2"][1]
-                    ks_o1 = stats["O1"][1]
-                    ks_o2 = stats["O2"][1]
-                    
-                    # 基因转换判定逻辑 (Ks_Paralog < Ks_Ortholog)
-                    # 物种1是否发生转换：Lso1和Lso2比直系更像
-                    is_conv_sp1 = (ks_p1 < ks_o1 and ks_p1 < ks_o2)
-                    
-                    # 物种2是否发生转换：Lma1和Lma2比直系更像
-                    is_conv_sp2 = (ks_p2 < ks_o1 and ks_p2 < ks_o2)
-                    
-                    # Bootstrap 验证
-                    boot_sup_sp1 = 0
-                    boot_sup_sp2 = 0
-                    
-                    if is_conv_sp1 or is_conv_sp2:
-                        aln_len = len(list(dna_aln.values())[0]) // 3
-                        for _ in range(args.boot):
-                            res_aln = bootstrap_resample(dna_aln, aln_len)
-                            
-                            # 快速计算无需全部计算，只需计算必要的
-                            b_ks_p1 = calculate_kaks(res_aln[pairs["P1"][0]], res_aln[pairs["P1"][1]])[1]
-                            b_ks_p2 = calculate_kaks(res_aln[pairs["P2"][0]], res_aln[pairs["P2"][1]])[1]
-                            b_ks_o1 = calculate_kaks(res_aln[pairs["O1"][0]], res_aln[pairs["O1"][1]])[1]
-                            b_ks_o2 = calculate_kaks(res_aln[pairs["O2"][0]], res_aln[pairs["O2"][1]])[1]
-                            
-                            if is_conv_sp1 and (b_ks_p1 < b_ks_o1 and b_ks_p1 < b_ks_o2):
-                                boot_sup_sp1 += 1
-                            if is_conv_sp2 and (b_ks_p2 < b_ks_o1 and b_ks_p2 < b_ks_o2):
-                                boot_sup_sp2 += 1
-                                
-                    prob_sp1 = boot_sup_sp1 / args.boot if is_conv_sp1 else 0.0
-                    prob_sp2 = boot_sup_sp2 / args.boot if is_conv_sp2 else 0.0
-                    
-                    # 写入行
-                    row = [
-                        quartet_id,
-                        f"{stats['P1'][0]:.4f}", f"{stats['P1'][1]:.4f}",
-                        f"{stats['P2'][0]:.4f}", f"{stats['P2'][1]:.4f}",
-                        f"{stats['O1'][0]:.4f}", f"{stats['O1'][1]:.4f}",
-                        f"{stats['O2'][0]:.4f}", f"{stats['O2'][1]:.4f}",
-                        "Y" if is_conv_sp1 else "N",
-                        "Y" if is_conv_sp2 else "N",
-                        f"{prob_sp1:.2f}",
-                        f"{prob_sp2:.2f}"
-                    ]
-                    out_fh.write("\t".join(row) + "\n")
-                    
-                    processed_count += 1
-                    if processed_count % 10 == 0:
-                        print(f"\r[进度] 已处理 {processed_count} 个四元组...", end='', flush=True)
-
-        print(f"\n[完成] 结果已保存至: {args.output}")
+        with pipelineMetrics.profiled(args.profile):
+            # 1. 加载数据
+            print(f"[信息] 正在加载序列数据...")
+            with stage("load_sequences"):
+                needed_ids = None
+                if args.lazy_fasta or shard is not None:
+                    # 只加载 (本分片) 四元组中出现的基因
+                    needed_ids = collect_quartet_gene_ids(iter_shard_quartets(iter_quartets(args.quartet), shard))
+                if args.lazy_fasta:
+                    seqs1 = load_fasta_indexed(args.fasta1, needed_ids)
+                    seqs2 = load_fasta_indexed(args.fasta2, needed_ids)
+                else:
+                    # 分片运行时仍顺序读取整个 FASTA，但只保留本分片用到的基因
+                    seqs1 = load_fasta(args.fasta1, needed_ids)
+                    seqs2 = load_fasta(args.fasta2, needed_ids)
+                all_seqs = {**seqs1, **seqs2} # 合并字典
+            count_metric("sequences_loaded", len(all_seqs))
+            print(f"[信息] 序列加载完成 (物种1序列数: {len(seqs1)}, 物种2序列数: {len(seqs2)})")
+
+            # 2. 分析并写出结果
+            source = args.quartet if shard is None else f"{args.quartet} (分片 {shard[0]}/{shard[1]})"
+            error_count = run_detection(iter_shard_quartets(iter_quartets(args.quartet), shard), all_seqs,
+                                        temp_dir, args, source=source)
 
     finally:
         # 清理临时目录
         if os.path.exists(temp_dir):
             shutil.rmtree(temp_dir)
 
+    write_metrics(args)
+    if error_count:
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""
+比对后端基准测试：比较 ClustalW 与内置比对器的吞吐量及 Ks 一致性。
+
+用法:
+    python benchmarks/bench_aligners.py -n 200 --length 300
+未安装 clustalw2 时只测试内置比对器。
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_script, build_dataset
+
+detect = load_script("3.detetConver.py")
+
+PAIR_KEYS = ["P1", "P2", "O1", "O2"]
+
+def run_backend(aligner, seqs, quartets, temp_dir):
+    """用指定后端比对所有四元组，返回 (耗时秒数, 每个四元组四个比较组的 Ks 列表)"""
+    ks_values = []
+    start = time.perf_counter()
+    for p1, o1, p2, o2 in quartets:
+        dna_aln = detect.run_alignment_workflow([p1, p2, o1, o2], seqs, temp_dir, aligner=aligner)
+        if not dna_aln:
+            ks_values.append(None)
+            continue
+        pairs = {"P1": (p1, p2), "P2": (o1, o2), "O1": (p1, o1), "O2": (p2, o2)}
+        ks_values.append([detect.calculate_kaks(dna_aln[a], dna_aln[b])[1] for a, b in (pairs[k] for k in PAIR_KEYS)])
+    return time.perf_counter() - start, ks_values
+
+def conv_call(ks):
+    """由四个 Ks 值得到 (物种1, 物种2) 的置换判定"""
+    ks_p1, ks_p2, ks_o1, ks_o2 = ks
+    return (ks_p1 < ks_o1 and ks_p1 < ks_o2), (ks_p2 < ks_o1 and ks_p2 < ks_o2)
+
+def main():
+    parser = argparse.ArgumentParser(description="比较 ClustalW 与内置比对器的吞吐量和 Ks 一致性")
+    parser.add_argument("-n", "--quartets", type=int, default=200, help="模拟四元组数量 (默认: 200)")
+    parser.add_argument("--length", type=int, default=300, help="平均基因长度 (密码子数，默认: 300)")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子 (默认: 1)")
+    args = parser.parse_args()
+
+    seqs, quartets = build_dataset(args.quartets, args.length, args.seed)
+    backends = ["internal"]
+    if shutil.which("clustalw2"):
+        backends.insert(0, "clustalw")
+    else:
+        print("[提示] 未找到 clustalw2，仅测试内置比对器。")
+
+    results = {}
+    temp_dir = tempfile.mkdtemp(prefix="bench_aligners_")
+    try:
+        for backend in backends:
+            elapsed, ks_values = run_backend(backend, seqs, quartets, temp_dir)
+            results[backend] = ks_values
+            print(f"[{backend:>8}] {len(quartets)} 个四元组，耗时 {elapsed:.2f} s，吞吐量 {len(quartets) / elapsed:.1f} 四元组/s")
+    finally:
+        shutil.rmtree(temp_dir)
+
+    if len(results) == 2:
+        both = [(a, b) for a, b in zip(results["clustalw"], results["internal"]) if a and b]
+        diffs = [abs(x - y) for a, b in both for x, y in zip(a, b)]
+        same_call = sum(1 for a, b in both if conv_call(a) == conv_call(b))
+        print(f"[一致性] 可比较四元组 {len(both)} 个")
+        print(f"[一致性] Ks 平均绝对差 {sum(diffs) / max(len(diffs), 1):.4f}，最大绝对差 {max(diffs, default=0):.4f}")
+        print(f"[一致性] 置换判定一致比例 {same_call / max(len(both), 1):.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+完整流程基准测试：生成模拟基因组 (CDS、共线性 Block、旁系同源文件，含已知的置换事件)，
+在多个规模下依次运行三个步骤脚本，记录各步骤耗时与第三步各阶段耗时 (--metrics)，
+并以模拟真值检查置换判定的准确性。
+
+用法:
+    python benchmarks/bench_pipeline.py --scales 1000,10000,100000 --lengths 300 --boots 0,100
+    # 验证优化：同一数据上比较候选参数与基准参数的结果是否一致
+    python benchmarks/bench_pipeline.py --scales 1000 --detect-args "--kernel numpy" --baseline-args ""
+默认使用内置比对器 (无需 ClustalW)。
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import REPO_DIR, write_pipeline_inputs
+
+REPORT_COLUMNS = ["quartets", "length", "boot", "stage1_s", "stage2_s", "stage3_s", "quartets_per_s",
+                  "align_s", "kaks_s", "bootstrap_s", "peak_rss_mb", "sensitivity", "false_pos_rate",
+                  "baseline_agreement", "baseline_max_ks_diff"]
+
+def run_step(script, step_args, metrics_path, cwd):
+    """在 cwd 下运行一个步骤脚本并开启 --metrics，返回 (墙钟秒数, 统计字典)；失败时打印错误输出并退出"""
+    cmd = [sys.executable, os.path.join(REPO_DIR, script), *step_args, "--metrics", metrics_path]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        print(f"[错误] 运行失败: {' '.join(shlex.quote(c) for c in cmd)}")
+        print(proc.stdout[-2000:])
+        sys.exit(1)
+    with open(metrics_path, encoding="utf-8") as fh:
+        return elapsed, json.load(fh)
+
+def read_calls(result_file):
+    """读取第三步结果，返回 {QuartetID: (Conv_Sp1, Conv_Sp2, (Ks_P1, Ks_P2, Ks_O1, Ks_O2))}"""
+    calls = {}
+    with open(result_file, encoding="utf-8") as fh:
+        for row in csv.reader(fh, delimiter="\t"):
+            if row[0] == "QuartetID":
+                continue
+            ks = tuple(float(row[i]) if row[i] != "NA" else None for i in (2, 4, 6, 8))
+            calls[row[0]] = (row[9] == "Y", row[10] == "Y", ks)
+    return calls
+
+def read_truth(truth_file):
+    with open(truth_file, encoding="utf-8") as fh:
+        next(fh)
+        return {qid: (sp1 == "Y", sp2 == "Y") for qid, sp1, sp2 in (line.split() for line in fh)}
+
+def accuracy(calls, truth):
+    """以模拟真值计算置换判定的敏感度与假阳性率 (两个物种合并统计；未输出的四元组视为未检出)"""
+    tp = fn = fp = tn = 0
+    for qid, expected in truth.items():
+        observed = calls.get(qid, (False, False))[:2]
+        for exp, obs in zip(expected, observed):
+            if exp:
+                tp += obs
+                fn += not obs
+            else:
+                fp += obs
+                tn += not obs
+    return tp / max(tp + fn, 1), fp / max(fp + tn, 1)
+
+def agreement(calls, baseline):
+    """两次运行的置换判定一致比例与 Ks 最大绝对差"""
+    shared = calls.keys() & baseline.keys()
+    same = sum(1 for qid in shared if calls[qid][:2] == baseline[qid][:2])
+    diffs = [abs(a - b) for qid in shared for a, b in zip(calls[qid][2], baseline[qid][2])
+             if a is not None and b is not None]
+    missing = len(calls.keys() ^ baseline.keys())
+    return same / max(len(shared) + missing, 1), max(diffs, default=0.0)
+
+def phase_wall(metrics, name):
+    return metrics["phases"].get(name, {}).get("wall_s", 0.0)
+
+def main():
+    parser = argparse.ArgumentParser(description="在多个规模下对完整流程计时并检查置换判定的准确性",
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--scales", default="1000,10000,100000", help="四元组数量，逗号分隔 (默认: 1000,10000,100000)")
+    parser.add_argument("--lengths", default="300", help="平均基因长度 (密码子数)，逗号分隔 (默认: 300)")
+    parser.add_argument("--boots", default="0,100", help="第三步的 --boot 取值，逗号分隔 (默认: 0,100)")
+    parser.add_argument("--para-div", type=float, default=0.15, help="旁系拷贝的分化程度 (默认: 0.15)")
+    parser.add_argument("--ortho-div", type=float, default=0.05, help="物种分化程度 (默认: 0.05)")
+    parser.add_argument("--aligner", default="internal", help="第三步使用的比对器 (默认: internal)")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="第三步的并行进程数 (默认: 1)")
+    parser.add_argument("--detect-args", default="", help='传给第三步的其他参数，例如 "--kernel numpy --align-batch 32"')
+    parser.add_argument("--baseline-args", default=None,
+                        help="可选：以这组参数再运行一次第三步作为基准，报告判定一致比例与 Ks 最大差异")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子 (默认: 1)")
+    parser.add_argument("--keep", default=None, help="保留模拟数据与结果的目录 (默认: 运行结束后删除)")
+    parser.add_argument("--report", default=None, help="将汇总表写入 TSV 文件")
+    args = parser.parse_args()
+
+    scales = [int(x) for x in args.scales.split(",")]
+    lengths = [int(x) for x in args.lengths.split(",")]
+    boots = [int(x) for x in args.boots.split(",")]
+    work_root = os.path.abspath(args.keep) if args.keep else tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.makedirs(work_root, exist_ok=True)
+
+    rows = []
+    try:
+        for n in scales:
+            for length in lengths:
+                work = os.path.join(work_root, f"n{n}_len{length}")
+                os.makedirs(work, exist_ok=True)
+                print(f"[信息] 生成模拟数据: {n} 个四元组，平均长度 {length} 密码子 -> {work}")
+                paths = write_pipeline_inputs(work, n, length, args.seed,
+                                              para_div=args.para_div, ortho_div=args.ortho_div)
+                truth = read_truth(paths["truth"])
+
+                # 第一、二步与 --boot 无关，每个数据集只运行一次
+                ortho_file = paths["block"] + ".pseu.ortologs"
+                quartet_file = os.path.join(work, "synthetic.quartet")
+                stage1_s, _ = run_step("1.filterOrthlogs.py", ["-i", paths["block"]],
+                                       os.path.join(work, "stage1.metrics.json"), work)
+                stage2_s, stage2 = run_step("2.extractGeneQuartets.py",
+                                            ["-o", ortho_file, "-p", paths["para"], "-out", quartet_file],
+                                            os.path.join(work, "stage2.metrics.json"), work)
+                if stage2["counters"].get("quartets") != n:
+                    print(f"[警告] 第二步生成 {stage2['counters'].get('quartets')} 个四元组，期望 {n} 个")
+
+                for boot in boots:
+                    common_args = ["-q", quartet_file, "-a", paths["fasta1"], "-b", paths["fasta2"],
+                                   "--boot", str(boot), "--aligner", args.aligner, "-t", str(args.threads),
+                                   "--seed", str(args.seed)]
+                    result_file = os.path.join(work, f"result.boot{boot}.tsv")
+                    stage3_s, stage3 = run_step("3.detetConver.py",
+                                                common_args + ["-o", result_file] + shlex.split(args.detect_args),
+                                                result_file + ".metrics.json", work)
+                    calls = read_calls(result_file)
+                    sensitivity, fpr = accuracy(calls, truth)
+
+                    agree = max_diff = None
+                    if args.baseline_args is not None:
+                        baseline_file = os.path.join(work, f"baseline.boot{boot}.tsv")
+                        run_step("3.detetConver.py",
+                                 common_args + ["-o", baseline_file] + shlex.split(args.baseline_args),
+                                 baseline_file + ".metrics.json", work)
+                        agree, max_diff = agreement(calls, read_calls(baseline_file))
+
+                    row = {
+                        "quartets": n, "length": length, "boot": boot,
+                        "stage1_s": round(stage1_s, 3), "stage2_s": round(stage2_s, 3), "stage3_s": round(stage3_s, 3),
+                        "quartets_per_s": stage3.get("throughput", {}).get("per_s"),
+                        "align_s": round(phase_wall(stage3, "align"), 3),
+                        "kaks_s": round(phase_wall(stage3, "kaks"), 3),
+                        "bootstrap_s": round(phase_wall(stage3, "bootstrap"), 3),
+                        "peak_rss_mb": round(max(stage3["peak_rss_mb"] or 0, stage3["peak_rss_children_mb"] or 0), 1),
+                        "sensitivity": round(sensitivity, 4), "false_pos_rate": round(fpr, 4),
+                        "baseline_agreement": None if agree is None else round(agree, 4),
+                        "baseline_max_ks_diff": None if max_diff is None else round(max_diff, 6),
+                    }
+                    rows.append(row)
+                    print("[结果] " + "  ".join(f"{k}={v}" for k, v in row.items() if v is not None))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    print("\t".join(REPORT_COLUMNS))
+    for row in rows:
+        print("\t".join("" if row[c] is None else str(row[c]) for c in REPORT_COLUMNS))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as fh:
+            fh.write("\t".join(REPORT_COLUMNS) + "\n")
+            for row in rows:
+                fh.write("\t".join("" if row[c] is None else str(row[c]) for c in REPORT_COLUMNS) + "\n")
+        print(f"[信息] 汇总表已写入: {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+快速筛选 (--screen) 基准测试：以完整流程 (比对 + Ka/Ks) 的置换判定为基准，
+统计 k-mer 筛选的召回率、筛除比例与耗时。
+
+用法:
+    python benchmarks/bench_screen.py -n 400 --length 300 --margins 0,0.1,0.2,0.5
+默认使用内置比对器 (无需 ClustalW)。
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_script, build_dataset
+
+detect = load_script("3.detetConver.py")
+
+def full_calls(seqs, quartets, aligner, temp_dir):
+    """完整流程的置换判定，返回 (耗时秒数, [(物种1, 物种2) 或 None, ...])"""
+    calls = []
+    start = time.perf_counter()
+    for p1, o1, p2, o2 in quartets:
+        dna_aln = detect.run_alignment_workflow([p1, p2, o1, o2], seqs, temp_dir, aligner=aligner)
+        if not dna_aln:
+            calls.append(None)
+            continue
+        ks = {key: detect.calculate_kaks(dna_aln[a], dna_aln[b])[1]
+              for key, (a, b) in {"P1": (p1, p2), "P2": (o1, o2), "O1": (p1, o1), "O2": (p2, o2)}.items()}
+        calls.append((ks["P1"] < ks["O1"] and ks["P1"] < ks["O2"],
+                      ks["P2"] < ks["O1"] and ks["P2"] < ks["O2"]))
+    return time.perf_counter() - start, calls
+
+def screen_passes(seqs, quartets, k, margin):
+    """快速筛选的结果，返回 (耗时秒数, [是否通过, ...])"""
+    args = argparse.Namespace(screen_k=k, screen_margin=margin)
+    start = time.perf_counter()
+    passes = [detect.screen_quartet(q, seqs, args) is None for q in quartets]
+    return time.perf_counter() - start, passes
+
+def main():
+    parser = argparse.ArgumentParser(description="测量 k-mer 快速筛选相对完整流程的召回率")
+    parser.add_argument("-n", "--quartets", type=int, default=400, help="模拟四元组数量 (默认: 400)")
+    parser.add_argument("--length", type=int, default=300, help="平均基因长度 (密码子数，默认: 300)")
+    parser.add_argument("--para-div", type=float, default=0.15, help="旁系拷贝的分化程度 (默认: 0.15)")
+    parser.add_argument("--ortho-div", type=float, default=0.05, help="物种分化程度 (默认: 0.05)")
+    parser.add_argument("-k", type=int, default=8, help="k-mer 长度 (默认: 8)")
+    parser.add_argument("--margins", default="0,0.1,0.2,0.5", help="要测试的相对余量，逗号分隔 (默认: 0,0.1,0.2,0.5)")
+    parser.add_argument("--aligner", default="internal", choices=sorted(detect.ALIGNER_BACKENDS),
+                        help="完整流程使用的比对器 (默认: internal)")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子 (默认: 1)")
+    args = parser.parse_args()
+
+    detect.check_dependencies(args.aligner)
+    seqs, quartets = build_dataset(args.quartets, args.length, args.seed,
+                                   para_div=args.para_div, ortho_div=args.ortho_div)
+
+    temp_dir = tempfile.mkdtemp(prefix="bench_screen_")
+    try:
+        full_time, calls = full_calls(seqs, quartets, args.aligner, temp_dir)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    positives = [i for i, call in enumerate(calls) if call and (call[0] or call[1])]
+    simulated = [i for i in range(len(quartets)) if i % 4 == 0]
+    print(f"[完整流程] {len(quartets)} 个四元组，耗时 {full_time:.2f} s；判定为置换候选 {len(positives)} 个 (模拟置换 {len(simulated)} 个)")
+
+    for margin in (float(m) for m in args.margins.split(",") if m.strip()):
+        screen_time, passes = screen_passes(seqs, quartets, args.k, margin)
+        recall = sum(passes[i] for i in positives) / max(len(positives), 1)
+        sim_recall = sum(passes[i] for i in simulated) / max(len(simulated), 1)
+        removed = 1 - sum(passes) / max(len(passes), 1)
+        # 估算开启筛选后的总耗时：筛选本身 + 通过筛选的四元组的完整流程
+        est_time = screen_time + full_time * (1 - removed)
+        print(f"[margin={margin:<4}] 召回率 (相对完整流程) {recall:.3f}，召回率 (相对模拟真值) {sim_recall:.3f}，"
+              f"筛除比例 {removed:.3f}，筛选耗时 {screen_time:.3f} s，预计总耗时 {est_time:.2f} s")
+
+if __name__ == "__main__":
+    main()
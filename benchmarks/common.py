@@ -0,0 +1,154 @@
+"""
+基准测试公共工具：加载流程脚本、生成模拟 CDS 序列与完整的流程输入文件。
+流程脚本文件名以数字开头 (如 3.detetConver.py)，无法直接 import，这里按文件路径加载。
+"""
+import os
+import sys
+import random
+import importlib.util
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BASES = "TCAG"
+STOP_CODONS = {"TAA", "TAG", "TGA"}
+SENSE_CODONS = [a + b + c for a in BASES for b in BASES for c in BASES if a + b + c not in STOP_CODONS]
+
+def load_script(filename, module_name=None):
+    """按文件名加载仓库根目录下的流程脚本，返回模块对象"""
+    path = os.path.join(REPO_DIR, filename)
+    # 流程脚本会导入仓库根目录下的公共模块 (如 pipelineMetrics)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    module_name = module_name or "pipeline_" + os.path.splitext(filename)[0].replace(".", "_")
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def random_cds(rng, n_codons):
+    """生成不含终止密码子的随机 CDS"""
+    return "".join(rng.choice(SENSE_CODONS) for _ in range(n_codons))
+
+def mutate(rng, seq, rate, indel_rate=0.0):
+    """
+    按给定速率对 CDS 引入点突变 (以及可选的整密码子插入/缺失)，并保证不产生终止密码子。
+    """
+    codons = []
+    for i in range(0, len(seq), 3):
+        codon = list(seq[i:i+3])
+        for j in range(3):
+            if rng.random() < rate:
+                codon[j] = rng.choice([b for b in BASES if b != codon[j]])
+        codon = "".join(codon)
+        if codon in STOP_CODONS:
+            codon = rng.choice(SENSE_CODONS)
+        if indel_rate and rng.random() < indel_rate:
+            if rng.random() < 0.5:
+                continue # 缺失
+            codons.append(rng.choice(SENSE_CODONS)) # 插入
+        codons.append(codon)
+    return "".join(codons)
+
+def simulate_quartet(rng, n_codons, para_div=0.15, ortho_div=0.05, converted=False, indel_rate=0.0):
+    """
+    模拟一个四元组：祖先基因经 WGD 产生两个旁系拷贝，再随物种分化形成两个直系对。
+    converted=True 时，物种1 的第二个旁系拷贝被第一个拷贝整体置换。
+    :return: (Para1, Ortho1, Para2, Ortho2) 四条 CDS
+    """
+    ancestor = random_cds(rng, n_codons)
+    copy_a = mutate(rng, ancestor, para_div, indel_rate)
+    copy_b = mutate(rng, ancestor, para_div, indel_rate)
+    
+    para1 = mutate(rng, copy_a, ortho_div, indel_rate)
+    ortho1 = mutate(rng, copy_a, ortho_div, indel_rate)
+    ortho2 = mutate(rng, copy_b, ortho_div, indel_rate)
+    if converted:
+        para2 = mutate(rng, para1, ortho_div / 5)
+    else:
+        para2 = mutate(rng, copy_b, ortho_div, indel_rate)
+    return para1, ortho1, para2, ortho2
+
+def build_dataset(n, length, seed, indel_rate=0.02, para_div=0.15, ortho_div=0.05, gene_ids=None):
+    """
+    生成 n 个模拟四元组 (四分之一为置换事件)，返回 (序列字典, 四元组列表)。
+    第 i 个四元组 i % 4 == 0 时物种1发生置换 (期望 Conv_Sp1 = Y，见 expected_calls)。
+    :param gene_ids: 可选，由序号生成四元组基因ID (Para1, Ortho1, Para2, Ortho2) 的函数
+    """
+    rng = random.Random(seed)
+    seqs = {}
+    quartets = []
+    for i in range(n):
+        n_codons = max(20, int(rng.gauss(length, length * 0.2)))
+        ids = gene_ids(i) if gene_ids else (f"Sp1g{i:06d}a", f"Sp2g{i:06d}a", f"Sp1g{i:06d}b", f"Sp2g{i:06d}b")
+        cds_list = simulate_quartet(rng, n_codons, para_div, ortho_div, converted=expected_calls(i)[0], indel_rate=indel_rate)
+        for gid, cds in zip(ids, cds_list):
+            seqs[gid] = cds
+        quartets.append(ids)
+    return seqs, quartets
+
+def expected_calls(i):
+    """build_dataset 中第 i 个四元组的真实置换状态 (物种1, 物种2)"""
+    return i % 4 == 0, False
+
+# -----------------------------------------------------------------------------
+# 模拟流程输入文件 (Block / 旁系同源 / CDS)
+# -----------------------------------------------------------------------------
+# 旁系拷贝 a/b 分别位于 1 号与 11 号染色体，与第一步的默认参数 (-c "1,1;11,11") 及
+# 默认基因ID解析规则 (如 Lso01g00001) 一致；Block 文件中另加入其他染色体对的干扰 block。
+
+def pipeline_gene_ids(i):
+    """第 i 个模拟四元组的基因ID (Para1, Ortho1, Para2, Ortho2)"""
+    return f"Lso01g{i:06d}", f"Lma01g{i:06d}", f"Lso11g{i:06d}", f"Lma11g{i:06d}"
+
+def write_fasta(path, records):
+    with open(path, "w", encoding="utf-8") as fh:
+        for gene_id, seq in records:
+            fh.write(f">{gene_id}\n")
+            for i in range(0, len(seq), 60):
+                fh.write(seq[i:i+60] + "\n")
+
+def write_block_file(path, quartets, block_size=50, noise_ratio=0.5, seed=0):
+    """
+    写出 MCScanX 风格的共线性 Block 文件 ("the Nth path ..." 标题行 + 基因行)。
+    每个四元组贡献两条直系关系 (1-1 与 11-11 号染色体)，另按 noise_ratio 加入非目标染色体对的 block。
+    """
+    rng = random.Random(seed)
+    chr1 = [(q[0], q[1]) for q in quartets]
+    chr11 = [(q[2], q[3]) for q in quartets]
+    blocks = [chr1[i:i+block_size] for i in range(0, len(chr1), block_size)]
+    blocks += [chr11[i:i+block_size] for i in range(0, len(chr11), block_size)]
+    n_noise = int(len(blocks) * noise_ratio)
+    for b in range(n_noise):
+        c1, c2 = rng.randint(2, 10), rng.randint(2, 10)
+        blocks.append([(f"Lso{c1:02d}g{b:04d}{j:03d}", f"Lma{c2:02d}g{b:04d}{j:03d}") for j in range(block_size)])
+    rng.shuffle(blocks)
+    with open(path, "w", encoding="utf-8") as fh:
+        for n, block in enumerate(blocks, 1):
+            fh.write(f"the {n}th path length {len(block)}\n")
+            for pos, (gene1, gene2) in enumerate(block):
+                fh.write(f"{gene1}\t{pos}\t{gene2}\t{pos}\t0\n")
+            fh.write("++++++++++++++++++++++++++++++++++++++\n")
+
+def write_pipeline_inputs(out_dir, n, length, seed, **dataset_args):
+    """
+    在 out_dir 下生成完整的流程输入，返回各文件路径组成的字典：
+    block (第一步输入)、para (第二步旁系同源文件)、fasta1/fasta2 (第三步 CDS)、truth (真实置换状态)、quartets (四元组列表)
+    """
+    seqs, quartets = build_dataset(n, length, seed, gene_ids=pipeline_gene_ids, **dataset_args)
+    paths = {name: os.path.join(out_dir, filename) for name, filename in (
+        ("block", "synthetic.block.rr.txt"), ("para", "synthetic.paralog"),
+        ("fasta1", "sp1.cds.fasta"), ("fasta2", "sp2.cds.fasta"), ("truth", "synthetic.truth.tsv"))}
+
+    write_block_file(paths["block"], quartets, seed=seed)
+    with open(paths["para"], "w", encoding="utf-8") as fh:
+        for i, (p1, _, p2, _) in enumerate(quartets):
+            fh.write(f"{i}\t{p1}\t{p2}\t0.1\n")
+    write_fasta(paths["fasta1"], ((g, seqs[g]) for q in quartets for g in (q[0], q[2])))
+    write_fasta(paths["fasta2"], ((g, seqs[g]) for q in quartets for g in (q[1], q[3])))
+    with open(paths["truth"], "w", encoding="utf-8") as fh:
+        fh.write("QuartetID\tConv_Sp1\tConv_Sp2\n")
+        for i, q in enumerate(quartets):
+            sp1, sp2 = expected_calls(i)
+            fh.write(f"{q[0]}-{q[2]}\t{'Y' if sp1 else 'N'}\t{'Y' if sp2 else 'N'}\n")
+    paths["quartets"] = quartets
+    return paths
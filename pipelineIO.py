@@ -0,0 +1,140 @@
+"""
+流程脚本共用的文件读写工具。
+- open_text(): 按扩展名透明读取压缩的输入文件 (.gz / .bgz 为 gzip 与 bgzip，.zst / .zstd 需安装 zstandard)，
+  边解压边读取，不写临时文件
+- ColumnarWriter: 以列式格式 (.parquet 需安装 pyarrow；.npz 只需 numpy) 分批写出完整精度的结果表
+"""
+import io
+import os
+import sys
+import gzip
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+GZIP_SUFFIXES = (".gz", ".bgz")
+ZSTD_SUFFIXES = (".zst", ".zstd")
+
+def compression_of(path):
+    """按扩展名判断压缩格式："gzip" (含 bgzip)、"zstd" 或 None (未压缩)"""
+    lower = path.lower()
+    if lower.endswith(GZIP_SUFFIXES):
+        return "gzip"
+    if lower.endswith(ZSTD_SUFFIXES):
+        return "zstd"
+    return None
+
+def strip_compression_suffix(path):
+    """去掉压缩扩展名 (如 a.block.rr.txt.gz -> a.block.rr.txt)，用于由输入文件名派生输出文件名"""
+    if compression_of(path) is None:
+        return path
+    return os.path.splitext(path)[0]
+
+def open_text(path, encoding="utf-8"):
+    """
+    以文本模式打开输入文件，按扩展名透明解压。
+    bgzip 文件是多个 gzip 成员的串联，可直接按 gzip 读取。
+    """
+    compression = compression_of(path)
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding=encoding)
+    if compression == "zstd":
+        if zstandard is None:
+            print(f"[错误] 读取 zstd 压缩文件需要 zstandard 库 (pip install zstandard): {path}")
+            sys.exit(1)
+        raw = open(path, "rb")
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(reader, encoding=encoding)
+    return open(path, "r", encoding=encoding)
+
+# 列式输出支持的格式 (--columnar 的取值即文件扩展名)
+COLUMNAR_FORMATS = ("parquet", "npz")
+
+class ColumnarWriter:
+    """
+    分批写出列式结果表。columns 为 [(列名, 类型), ...]，类型为 "str" / "float" / "int" / "bool"。
+    add() 逐行缓存，每满 batch_size 行转换为一批 NumPy 数组：
+    - .parquet: 每批写为一个 row group，内存占用只与批大小有关
+    - .npz: 各批数组在 close() 时拼接后写出 (键为列名，可用 numpy.load 读取)
+    文件先写到 <路径>.tmp，close() 时原子替换，中途中断不会留下不完整的结果。
+    """
+
+    DTYPES = {"float": np.float64, "int": np.int64, "bool": np.bool_, "str": np.str_}
+
+    def __init__(self, path, columns, batch_size=4096):
+        self.format = os.path.splitext(path)[1].lstrip(".").lower()
+        if self.format not in COLUMNAR_FORMATS:
+            raise ValueError(f"不支持的列式格式: {path}")
+        if self.format == "parquet" and pyarrow is None:
+            print("[错误] 写出 Parquet 需要 pyarrow 库 (pip install pyarrow)，或改用 --columnar npz。")
+            sys.exit(1)
+        self.path = path
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.rows = 0
+        self._pending = []
+        self._batches = []      # .npz: 已转换的各批数组
+        self._parquet = None
+        self._tmp_path = path + ".tmp"
+
+    def add(self, row):
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        arrays = [np.array(values, dtype=self.DTYPES[kind])
+                  for (_, kind), values in zip(self.columns, zip(*self._pending))]
+        self.rows += len(self._pending)
+        self._pending = []
+        if self.format == "npz":
+            self._batches.append(arrays)
+            return
+        table = pyarrow.table({name: array for (name, _), array in zip(self.columns, arrays)})
+        if self._parquet is None:
+            self._parquet = pyarrow.parquet.ParquetWriter(self._tmp_path, table.schema)
+        self._parquet.write_table(table)
+
+    def close(self):
+        self.flush()
+        if self.format == "npz":
+            data = {}
+            for i, (name, kind) in enumerate(self.columns):
+                parts = [arrays[i] for arrays in self._batches]
+                data[name] = np.concatenate(parts) if parts else np.array([], dtype=self.DTYPES[kind])
+            with open(self._tmp_path, "wb") as fh:
+                np.savez(fh, **data)
+            self._batches = []
+        else:
+            if self._parquet is None:
+                empty = {name: pyarrow.array([], type=pyarrow.from_numpy_dtype(self.DTYPES[kind]) if kind != "str"
+                                             else pyarrow.string())
+                         for name, kind in self.columns}
+                self._parquet = pyarrow.parquet.ParquetWriter(self._tmp_path, pyarrow.table(empty).schema)
+            self._parquet.close()
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            if self._parquet is not None:
+                self._parquet.close()
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+        return False
@@ -0,0 +1,161 @@
+"""
+运行统计 (--metrics) 与性能剖析 (--profile) 的公共工具，由三个流程脚本共用。
+统计内容：各步骤 (stage) 与各计算阶段 (phase) 的墙钟时间、CPU 时间和调用次数，
+计数器 (如按原因统计的跳过数)，吞吐量，以及峰值内存 (RSS)。
+"""
+import sys
+import json
+import time
+import cProfile
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # Windows 无 resource 模块：不统计子进程 CPU 时间与峰值内存
+    resource = None
+
+def peak_rss_mb(who="self"):
+    """峰值常驻内存 (MB)；who 为 "self" 或 "children" (已结束的子进程中的最大值)"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return usage.ru_maxrss / scale
+
+def children_cpu_seconds():
+    """已结束的子进程 (进程池 worker、外部比对器等) 累计的 CPU 时间"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return round(usage.ru_utime + usage.ru_stime, 6)
+
+class RunMetrics:
+    """
+    一次运行的统计信息。
+    stage(): 脚本级步骤 (如 加载序列、分析)；phase(): 单个任务内部的计算阶段 (如 比对、Ka/Ks)。
+    并行时每个 worker 各自记录，通过 snapshot(reset=True) 取出增量，由主进程 merge() 汇总。
+    """
+
+    def __init__(self, script):
+        self.script = script
+        self.started = time.time()
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        self.stages = {}    # 名称 -> [墙钟秒数, CPU 秒数, 次数]
+        self.phases = {}
+        self.counters = {}
+
+    @staticmethod
+    def _add(table, name, wall, cpu, calls=1):
+        entry = table.setdefault(name, [0.0, 0.0, 0])
+        entry[0] += wall
+        entry[1] += cpu
+        entry[2] += calls
+
+    @contextlib.contextmanager
+    def _timer(self, table, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self._add(table, name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def stage(self, name):
+        return self._timer(self.stages, name)
+
+    def phase(self, name):
+        return self._timer(self.phases, name)
+
+    def add_phase(self, name, wall, cpu, calls=1):
+        self._add(self.phases, name, wall, cpu, calls)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self, reset=False):
+        """取出可序列化的阶段计时与计数器 (用于 worker 向主进程回传)"""
+        snap = {"phases": self.phases, "counters": self.counters}
+        if reset:
+            self.phases = {}
+            self.counters = {}
+        return snap
+
+    def merge(self, snap):
+        for name, (wall, cpu, calls) in snap["phases"].items():
+            self._add(self.phases, name, wall, cpu, calls)
+        for name, n in snap["counters"].items():
+            self.count(name, n)
+
+    def report(self, items=None, item_stage=None):
+        """
+        汇总为字典。
+        :param items: 吞吐量的计数器名 (如 "quartets_done")
+        :param item_stage: 计算吞吐量所用的步骤名；None 表示整个运行
+        """
+        wall = time.perf_counter() - self._wall0
+        timing = lambda table: {name: {"wall_s": round(w, 6), "cpu_s": round(c, 6), "calls": n}
+                                for name, (w, c, n) in table.items()}
+        report = {
+            "script": self.script,
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "wall_s": round(wall, 6),
+            "cpu_s": round(time.process_time() - self._cpu0, 6),
+            "cpu_children_s": children_cpu_seconds(),
+            "peak_rss_mb": peak_rss_mb("self"),
+            "peak_rss_children_mb": peak_rss_mb("children"),
+            "stages": timing(self.stages),
+            "phases": timing(self.phases),
+            "counters": dict(sorted(self.counters.items())),
+        }
+        if items is not None:
+            span = self.stages[item_stage][0] if item_stage in self.stages else wall
+            report["throughput"] = {"items": items, "per_s": round(self.counters.get(items, 0) / span, 3) if span > 0 else None}
+        return report
+
+    def write(self, path, **report_args):
+        report = self.report(**report_args)
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+            fh.write("\n")
+        print(f"[信息] 运行统计已写入: {path}")
+        return report
+
+@contextlib.contextmanager
+def profiled(path):
+    """在 cProfile 下运行代码块并将统计写入 path (可用 python -m pstats 查看)；path 为 None 时不剖析"""
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"[信息] cProfile 统计已写入: {path}")
+
+def stage(metrics, name):
+    """metrics.stage(name)；metrics 为 None (未开启 --metrics) 时不计时"""
+    return metrics.stage(name) if metrics is not None else contextlib.nullcontext()
+
+# 默认文件名中的占位符，由 resolve_output_paths() 替换为实际输出文件路径
+OUTPUT_PLACEHOLDER = "<输出文件>"
+
+def add_metrics_arguments(parser, default_metrics=OUTPUT_PLACEHOLDER + ".metrics.json",
+                          default_profile=OUTPUT_PLACEHOLDER + ".prof"):
+    """添加 --metrics / --profile 参数 (可省略路径，使用默认文件名)"""
+    parser.add_argument("--metrics", nargs="?", const=default_metrics, default=None, metavar="FILE",
+                        help=f"记录各步骤/阶段的墙钟与 CPU 时间、跳过原因、吞吐量和峰值内存，\n写入 JSON 文件 (默认: {default_metrics})")
+    parser.add_argument("--profile", nargs="?", const=default_profile, default=None, metavar="FILE",
+                        help=f"使用 cProfile 剖析主进程并写出统计文件 (默认: {default_profile})")
+
+def resolve_output_paths(args, output_file):
+    """将 --metrics/--profile 默认文件名中的占位符替换为输出文件路径"""
+    for name in ("metrics", "profile"):
+        path = getattr(args, name)
+        if path:
+            setattr(args, name, path.replace(OUTPUT_PLACEHOLDER, output_file))
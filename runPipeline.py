@@ -0,0 +1,305 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import argparse
+import tempfile
+import importlib.util
+
+import pipelineMetrics
+
+# =========================================================
+# 0. 加载三个步骤的脚本
+# =========================================================
+# 流程脚本文件名以数字开头 (如 3.detetConver.py)，无法直接 import，这里按文件路径加载
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_stage(filename, module_name):
+    """按文件名加载同目录下的流程脚本，返回模块对象"""
+    path = os.path.join(SCRIPT_DIR, filename)
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    # 注册到 sys.modules，进程池子进程才能按模块名找到 worker 函数
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+stage1 = load_stage("1.filterOrthlogs.py", "filterOrthlogs")
+stage2 = load_stage("2.extractGeneQuartets.py", "extractGeneQuartets")
+stage3 = load_stage("3.detetConver.py", "detetConver")
+
+# =========================================================
+# 1. 流式连接
+# =========================================================
+
+def tee_to_file(records, path):
+    """边传递记录边写入中间文件 (制表符分隔)，用于可选地保留各步骤的中间结果"""
+    with open(path, 'w', encoding='utf-8') as fh:
+        for record in records:
+            fh.write("\t".join(record) + "\n")
+            yield record
+
+def count_records(records, stats, key):
+    """边传递记录边计数"""
+    for record in records:
+        stats[key] = stats.get(key, 0) + 1
+        yield record
+
+def iter_pipeline_quartets(args, stats):
+    """
+    串联第一步与第二步，返回四元组生成器。
+    - 一对多模式 (--multi)：直系关系边读边与旁系基因对做对称哈希连接，四元组随即产出，
+      第三步在第一步扫描完之前即可开始
+    - 默认模式：与 2.extractGeneQuartets.py 一致，同一基因的多个直系基因只保留最后一个，
+      因此需要先读完第一步的结果，之后旁系基因对与四元组仍为流式
+    """
+    target_pairs = stage1.parse_target_chroms(args.chroms)
+
+    ortholog_pairs = stage1.iter_filtered_pairs(args.input, target_pairs, args.bulk)
+    ortholog_pairs = count_records(ortholog_pairs, stats, 'orthologs')
+    if args.write_intermediate:
+        ortholog_pairs = tee_to_file(ortholog_pairs, f"{args.output}.pseu.ortologs")
+
+    paralog_pairs = stage2.iter_paralog_pairs(args.para, stats)
+    if args.multi:
+        quartets = stage2.iter_streaming_quartets(ortholog_pairs, paralog_pairs, args.max_per_pair, stats)
+    else:
+        ortholog_map = dict(ortholog_pairs)
+        print(f"[信息] 直系同源映射构建完成，共 {len(ortholog_map)} 条记录。")
+        quartets = stage2.iter_map_quartets(paralog_pairs, ortholog_map)
+
+    quartets = count_records(quartets, stats, 'quartets')
+    if args.write_intermediate:
+        quartets = tee_to_file(quartets, f"{args.output}.quartet")
+    return quartets
+
+def run_pair(args, all_seqs, temp_dir):
+    """对一对基因组 (args.input / args.para / args.output) 运行第一、二步并完成检测，返回统计字典"""
+    stats = {}
+    quartets = iter_pipeline_quartets(args, stats)
+    stats['errors'] = stage3.run_detection(quartets, all_seqs, temp_dir, args, source=f"{args.input} + {args.para}")
+    return stats
+
+def report_pair_stats(args, stats, metrics, sequences_loaded):
+    """打印统计并写出运行统计文件 (--metrics)"""
+    if metrics is not None:
+        metrics.count("sequences_loaded", sequences_loaded)
+        for key in ('orthologs', 'total_lines', 'quartets', 'duplicates', 'capped'):
+            if key in stats:
+                metrics.count(key, stats[key])
+        stage3.write_metrics(args)
+
+    print(f"[统计] 直系同源基因对: {stats.get('orthologs', 0)} 对")
+    print(f"[统计] 扫描旁系记录: {stats.get('total_lines', 0)} 条")
+    print(f"[统计] 生成四元组: {stats.get('quartets', 0)} 个")
+    if args.multi:
+        print(f"[统计] 去除对称/重复四元组: {stats.get('duplicates', 0)} 个")
+
+# =========================================================
+# 2. 批量模式 (多个基因组，共享序列库)
+# =========================================================
+
+def load_manifest(manifest_file):
+    """
+    读取批量模式的清单 (JSON)，相对路径以清单所在目录为基准:
+    {
+      "genomes": {"Lso": "Lso.cds.fasta", "Lma": "Lma.cds.fasta", ...},
+      "pairs": [{"species1": "Lso", "species2": "Lma", "blocks": "Lso_Lma*.block.rr.txt",
+                 "paralogs": "Lso_Lma.paralog", "output": "Lso_Lma.result.txt", "chroms": "1,1;11,11"}, ...],
+      "store": "cds_store"
+    }
+    chroms (默认取命令行 -c) 与 store (默认 <清单文件>.store) 可省略。
+    """
+    if not os.path.exists(manifest_file):
+        print(f"[错误] 未找到清单文件: {manifest_file}")
+        sys.exit(1)
+    try:
+        with open(manifest_file, encoding='utf-8') as fh:
+            manifest = json.load(fh)
+    except ValueError as e:
+        print(f"[错误] 清单文件不是有效的 JSON: {e}")
+        sys.exit(1)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    resolve = lambda path: os.path.join(base_dir, path)
+    genomes = manifest.get("genomes")
+    pairs = manifest.get("pairs")
+    if not isinstance(genomes, dict) or not genomes or not isinstance(pairs, list) or not pairs:
+        print("[错误] 清单需要包含非空的 'genomes' (名称 -> CDS 文件) 与 'pairs' 列表。")
+        sys.exit(1)
+    manifest["genomes"] = {name: resolve(path) for name, path in genomes.items()}
+
+    outputs = set()
+    for n, pair in enumerate(pairs, 1):
+        missing = [key for key in ("species1", "species2", "blocks", "paralogs", "output") if key not in pair]
+        if missing:
+            print(f"[错误] 清单第 {n} 个基因组对缺少字段: {', '.join(missing)}")
+            sys.exit(1)
+        for key in ("species1", "species2"):
+            if pair[key] not in genomes:
+                print(f"[错误] 清单第 {n} 个基因组对引用了未列出的基因组: {pair[key]}")
+                sys.exit(1)
+        for key in ("blocks", "paralogs", "output"):
+            pair[key] = resolve(pair[key])
+        if pair["output"] in outputs:
+            print(f"[错误] 多个基因组对使用了同一个输出文件: {pair['output']}")
+            sys.exit(1)
+        outputs.add(pair["output"])
+    if manifest.get("store"):
+        manifest["store"] = resolve(manifest["store"])
+    return manifest
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="runPipeline.py batch",
+        description="批量模式：按清单对多个基因组对依次运行完整流程，每对写出独立的结果文件。\n"
+                    "各基因组的 CDS 只加载一次，存入内存映射的共享序列库，所有基因组对与 worker 进程共用",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("manifest", help="清单文件 (JSON)，格式见 README")
+    parser.add_argument("--store", default=None,
+                        help="共享序列库目录 (默认: 清单中的 store，或 <清单文件>.store)；\nFASTA 未改动时直接复用")
+    add_join_arguments(parser, batch=True)
+    stage3.add_detection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    manifest = load_manifest(args.manifest)
+    check_join_arguments(args)
+    for pair in manifest["pairs"]:
+        check_pair_inputs(pair["blocks"], pair["paralogs"])
+
+    stage1.set_id_parsing(stage1.id_parsing_spec(args))
+    stage3.set_genetic_code(args.table)
+    stage3.check_dependencies(args.aligner)
+    profile_args = argparse.Namespace(metrics=None, profile=args.profile)
+    pipelineMetrics.resolve_output_paths(profile_args, args.manifest)
+
+    store_dir = args.store or manifest.get("store") or args.manifest + ".store"
+    temp_dir = tempfile.mkdtemp(prefix="pipeline_work_", dir=".")
+    failed_pairs = []
+    try:
+        with pipelineMetrics.profiled(profile_args.profile):
+            store = stage3.SequenceStore.open_or_build(store_dir, manifest["genomes"])
+            for n, pair in enumerate(manifest["pairs"], 1):
+                sp1, sp2 = pair["species1"], pair["species2"]
+                print(f"[信息] ===== 基因组对 {n}/{len(manifest['pairs'])}: {sp1} - {sp2} =====")
+                pair_args = argparse.Namespace(**vars(args))
+                pair_args.input = pair["blocks"]
+                pair_args.para = pair["paralogs"]
+                pair_args.output = pair["output"]
+                pair_args.chroms = pair.get("chroms", args.chroms)
+                # 每对单独统计，--metrics 默认写到各自的 <输出文件>.metrics.json
+                pair_args.profile = None
+                pipelineMetrics.resolve_output_paths(pair_args, pair_args.output)
+                metrics = stage3.enable_metrics(pair_args, script="runPipeline batch")
+
+                seqs = store.view([sp1, sp2])
+                stats = run_pair(pair_args, seqs, temp_dir)
+                report_pair_stats(pair_args, stats, metrics,
+                                  sum(store.genome_size(name) for name in {sp1, sp2}))
+                if stats['errors']:
+                    failed_pairs.append(f"{sp1}-{sp2}")
+    finally:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+    print(f"[信息] 批量模式完成，共 {len(manifest['pairs'])} 个基因组对。")
+    if failed_pairs:
+        print(f"[错误] 以下基因组对有分析出错的四元组 (可加 --resume 重新运行): {', '.join(failed_pairs)}")
+        sys.exit(1)
+
+# =========================================================
+# 3. 主程序
+# =========================================================
+
+def add_join_arguments(parser, batch=False):
+    """第一、二步的参数；批量模式下输入文件由清单给出"""
+    # 第一步
+    if not batch:
+        parser.add_argument("-i", "--input", required=True,
+                            help='共线性 Block 文件的匹配模式 (必须用引号包裹)\n例如: -i "*.block.rr.txt"')
+    parser.add_argument("-c", "--chroms", default="1,1;11,11",
+                        help='需要筛选的染色体对 (默认: 1,1;11,11)，"all" 表示不限' +
+                             ("\n批量模式下可在清单中为每对单独指定" if batch else ""))
+    parser.add_argument("--bulk", action="store_true",
+                        help="第一步使用批量正则模式读取 Block 文件")
+    stage1.add_id_parsing_arguments(parser)
+    # 第二步
+    if not batch:
+        parser.add_argument("-p", "--para", required=True, help="旁系同源基因文件路径")
+    parser.add_argument("--multi", action="store_true",
+                        help="一对多模式：保留全部直系基因并枚举所有四元组组合；\n直系关系与旁系基因对流式连接，第三步可提前开始")
+    parser.add_argument("--max-per-pair", type=int, default=None,
+                        help="一对多模式下每个旁系基因对最多输出的四元组数 (默认: 不限)")
+    parser.add_argument("--write-intermediate", action="store_true",
+                        help="同时写出中间文件: <输出文件>.pseu.ortologs 与 <输出文件>.quartet")
+
+def check_join_arguments(args):
+    if args.max_per_pair is not None and not args.multi:
+        print("[错误] --max-per-pair 需要配合 --multi 使用。")
+        sys.exit(1)
+    if args.max_per_pair is not None and args.max_per_pair < 1:
+        print("[错误] --max-per-pair 必须为正整数。")
+        sys.exit(1)
+
+def check_pair_inputs(block_pattern, para_file):
+    if not glob.glob(block_pattern):
+        print(f"[错误] 未找到匹配模式 '{block_pattern}' 的文件，请检查路径。")
+        sys.exit(1)
+    if not os.path.exists(para_file):
+        print(f"[错误] 未找到文件: {para_file}")
+        sys.exit(1)
+
+def main():
+    # 子命令: batch (按清单批量运行多个基因组对)
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        description="基因置换检测一体化流程：筛选直系同源 -> 构建四元组 -> 检测置换\n"
+                    "三个步骤在内存中流式衔接，默认不写中间文件\n"
+                    "多个基因组对: python runPipeline.py batch 清单.json (见 batch -h)",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    add_join_arguments(parser)
+    # 第三步
+    parser.add_argument("-a", "--fasta1", required=True, help="物种1的 CDS 序列文件 (.fasta)")
+    parser.add_argument("-b", "--fasta2", required=True, help="物种2的 CDS 序列文件 (.fasta)")
+    parser.add_argument("-o", "--output", required=True, help="输出结果文件路径")
+    stage3.add_detection_arguments(parser)
+
+    args = parser.parse_args()
+
+    check_join_arguments(args)
+    check_pair_inputs(args.input, args.para)
+
+    stage1.set_id_parsing(stage1.id_parsing_spec(args))
+    stage3.set_genetic_code(args.table)
+    stage3.check_dependencies(args.aligner)
+    # 运行统计记录在第三步模块中；第一、二步与分析流式交织，其耗时计入 analyze 步骤
+    pipelineMetrics.resolve_output_paths(args, args.output)
+    metrics = stage3.enable_metrics(args, script="runPipeline")
+
+    temp_dir = tempfile.mkdtemp(prefix="pipeline_work_", dir=".")
+    try:
+        with pipelineMetrics.profiled(args.profile):
+            print(f"[信息] 正在加载序列数据...")
+            with stage3.stage("load_sequences"):
+                seqs1 = stage3.load_fasta(args.fasta1)
+                seqs2 = stage3.load_fasta(args.fasta2)
+                all_seqs = {**seqs1, **seqs2}
+            print(f"[信息] 序列加载完成 (物种1序列数: {len(seqs1)}, 物种2序列数: {len(seqs2)})")
+
+            stats = run_pair(args, all_seqs, temp_dir)
+    finally:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+    report_pair_stats(args, stats, metrics, len(all_seqs))
+    if stats['errors']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()